@@ -0,0 +1,60 @@
+import json
+
+import api
+
+# Clinic IDs served by the stand-in backend, and the appointment every NRIC has
+CLINIC_IDS = range(1, 51)
+APPOINTMENT_ID: int = 42
+
+
+# Canned response in the shape the controllers read from requests
+class FakeResponse:
+    def __init__(self, status_code: int, data: object = None) -> None:
+        self.status_code = status_code
+        self._data = data
+        self.content = json.dumps(data).encode()
+        self.headers = {}
+
+    def json(self) -> object:
+        return self._data
+
+
+def clinic(clinic_id: int) -> dict:
+    return {"clinicId": clinic_id, "clinicName": f"Happy Dental {clinic_id}", "clinicAddress": f"{clinic_id} Tampines Ave 1",
+            "clinicUnit": "01-23", "clinicPostal": 520000 + clinic_id, "clinicEmail": "clinic@example.com",
+            "clinicSubEmail": None, "clinicPhone": 61234567, "clinicSubPhone": None}
+
+
+# DHRMS backend stand-in: answers the endpoints the controllers use locally, so flows run without network access
+class FakeSession:
+    def __init__(self) -> None:
+        self.calls: dict[str, int] = {}
+
+    def get(self, url: str, **kwargs) -> FakeResponse:
+        uri = url[len(api.API_BASE_URL) + 1:]
+        endpoint = "/".join(uri.split('/')[:2])
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+        if uri.startswith('clinic/get/all'):
+            return FakeResponse(200, [clinic(clinic_id) for clinic_id in CLINIC_IDS])
+        if uri.startswith('clinic/get/'):
+            return FakeResponse(200, clinic(int(uri.rsplit('/', 1)[1])))
+        if uri.startswith('queue/get/count/'):
+            clinic_id = int(uri.rsplit('/', 1)[1])
+            return FakeResponse(200, {"clinicId": clinic_id, "clinicName": f"Happy Dental {clinic_id}",
+                                      "count": clinic_id % 15})
+        if uri.startswith('appointment/get/all/upcoming/nric/'):
+            return FakeResponse(200, [{"apptId": APPOINTMENT_ID, "startDateTime": "01/02/2023 10:30",
+                                       "firstName": "Tan", "lastName": "Ah Kow"}])
+        if uri.startswith('appointment/get/'):
+            return FakeResponse(200, dict(clinic(1), startDateTime="01/02/2023 10:30", status="Upcoming"))
+        return FakeResponse(404)
+
+    def head(self, url: str, **kwargs) -> FakeResponse:
+        return FakeResponse(200)
+
+
+# Route every api.get through a FakeSession
+def install() -> FakeSession:
+    api._session = FakeSession()
+    return api._session
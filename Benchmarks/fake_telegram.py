@@ -0,0 +1,148 @@
+import itertools
+import json
+import logging
+import time
+
+from telegram.request import BaseRequest, RequestData
+from telegram.ext import Application
+
+FAKE_TOKEN = "123456:FAKE-TOKEN-FOR-OFFLINE-RUNS"
+FAKE_BOT_USER = {"id": 123456, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+# Bot API stand-in: answers every method locally, so handlers run without network access
+class FakeRequest(BaseRequest):
+    def __init__(self) -> None:
+        self.calls: dict[str, int] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: RequestData = None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None) -> tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        parameters = request_data.parameters if request_data is not None else {}
+
+        match endpoint:
+            case "getMe":
+                result = FAKE_BOT_USER
+            case "sendMessage" | "editMessageText":
+                result = bot_message(parameters.get('chat_id', 0), parameters.get('text', ''))
+            case "copyMessage":
+                result = {"message_id": next(_message_ids)}
+            case "getUpdates" | "getMyCommands":
+                result = []
+            case _:
+                result = True
+
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# Application wired to FakeRequest, with the bot's normal handlers
+def build_offline_application(shard: int = 0) -> Application:
+    import main
+
+    # Per-update INFO logging would dominate offline measurements
+    logging.disable(logging.INFO)
+
+    application = (Application.builder().token(FAKE_TOKEN).updater(None)
+                   .request(FakeRequest()).get_updates_request(FakeRequest()).build())
+    main.add_handlers(application)
+    return application
+
+
+""" START OF FAKE UPDATE METHODS
+
+The following methods build raw update payloads in the shape Telegram sends them.
+"""
+
+
+def user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"}
+
+
+def bot_message(chat_id: int, text: str = "") -> dict:
+    return {"message_id": next(_message_ids), "date": int(time.time()), "from": FAKE_BOT_USER,
+            "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+
+def text_update(chat_id: int, text: str) -> dict:
+    message = {"message_id": next(_message_ids), "date": int(time.time()), "from": user(chat_id),
+               "chat": {"id": chat_id, "type": "private"}, "text": text}
+    if text.startswith('/'):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split(' ')[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(chat_id: int, data: str) -> dict:
+    return {"update_id": next(_update_ids),
+            "callback_query": {"id": str(next(_update_ids)), "from": user(chat_id), "chat_instance": str(chat_id),
+                               "data": data, "message": bot_message(chat_id)}}
+
+
+def inline_update(chat_id: int, query: str) -> dict:
+    return {"update_id": next(_update_ids),
+            "inline_query": {"id": str(next(_update_ids)), "from": user(chat_id), "query": query, "offset": ""}}
+
+
+# One complete conversation through the FAQ flow, which needs no DHRMS backend
+def faq_conversation(chat_id: int) -> list[dict]:
+    import constants
+
+    return [
+        text_update(chat_id, "/start"),
+        callback_update(chat_id, str(constants.States.VIEW_FAQ)),
+        text_update(chat_id, "What is HappySmile?"),
+        callback_update(chat_id, "0"),
+        text_update(chat_id, "❌ Close")
+    ]
+
+
+# One complete conversation through each of the flows that call the DHRMS backend (see fake_backend.py)
+def find_clinic_conversation(chat_id: int) -> list[dict]:
+    import constants
+
+    return [
+        text_update(chat_id, "/start"),
+        callback_update(chat_id, str(constants.States.FIND_CLINICS_NEARBY)),
+        text_update(chat_id, "520012"),
+        text_update(chat_id, "12. Happy Dental 12"),
+        callback_update(chat_id, "0"),
+        text_update(chat_id, "❌ Close")
+    ]
+
+
+def clinic_queue_conversation(chat_id: int) -> list[dict]:
+    import constants
+
+    return [
+        text_update(chat_id, "/start"),
+        callback_update(chat_id, str(constants.States.GET_CLINIC_QUEUE)),
+        text_update(chat_id, "List All Clinics"),
+        text_update(chat_id, "12. Happy Dental 12"),
+        callback_update(chat_id, "0"),
+        text_update(chat_id, "❌ Close")
+    ]
+
+
+def appointments_conversation(chat_id: int) -> list[dict]:
+    import constants
+
+    return [
+        text_update(chat_id, "/start"),
+        callback_update(chat_id, str(constants.States.GET_APPOINTMENTS)),
+        text_update(chat_id, "S1234567D"),
+        text_update(chat_id, "#42 | 01/02/2023 10:30"),
+        callback_update(chat_id, "0"),
+        callback_update(chat_id, "4")
+    ]
+
+
+""" END OF FAKE UPDATE METHODS """
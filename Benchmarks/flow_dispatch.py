@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import re
+import time
+
+from telegram import Bot, Update
+from telegram.ext import BaseHandler, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+
+import flow
+
+import Controllers.FindClinic as FindClinic
+import Controllers.GetAppointments as GetAppointments
+import Controllers.GetClinicQueue as GetClinicQueue
+import Controllers.ViewFAQ as ViewFAQ
+
+from Benchmarks import fake_telegram
+
+# Sample inputs for pattern routes, since a regex cannot be turned back into text. Each pattern route uses the first
+# sample its regex matches, so the samples follow changes to the routes' patterns.
+PATTERN_SAMPLES = [
+    "520123",
+    "12. HappySmile Dental (Tampines)",
+    "S1234567D",
+    "#42 | 01/02/2023 10:30",
+]
+
+
+# First of PATTERN_SAMPLES that a pattern route matches
+def pattern_sample(pattern: str) -> str:
+    for sample in PATTERN_SAMPLES:
+        if re.fullmatch(pattern, sample):
+            return sample
+    raise ValueError(f"No sample in PATTERN_SAMPLES matches the route pattern {pattern!r}")
+
+
+# The handler chain the controllers used before the flow engine, built from the same table
+def legacy_chain(routes: list[flow.Route]) -> list[BaseHandler]:
+    chain = []
+    for route in routes:
+        match route.kind:
+            case flow.Route.TEXT:
+                chain.append(MessageHandler(filters.Regex(f"^{route.value}$") & ~filters.COMMAND, route.action))
+            case flow.Route.PATTERN:
+                chain.append(MessageHandler(filters.Regex(f"^{route.value}$") & ~filters.COMMAND, route.action))
+            case flow.Route.ANY_TEXT:
+                chain.append(MessageHandler(filters.TEXT & ~filters.COMMAND, route.action))
+            case flow.Route.CALLBACK:
+                chain.append(CallbackQueryHandler(route.action, pattern=f"^{route.value}$"))
+            case flow.Route.COMMAND:
+                chain.append(CommandHandler(route.value, route.action))
+    return chain
+
+
+# One update per route, matching the route's input
+def sample_updates(routes: list[flow.Route], bot: Bot) -> list[Update]:
+    updates = []
+    for route in routes:
+        match route.kind:
+            case flow.Route.TEXT:
+                payload = fake_telegram.text_update(1, route.value)
+            case flow.Route.PATTERN:
+                payload = fake_telegram.text_update(1, pattern_sample(route.value))
+            case flow.Route.ANY_TEXT:
+                payload = fake_telegram.text_update(1, "something else")
+            case flow.Route.CALLBACK:
+                payload = fake_telegram.callback_update(1, route.value)
+            case _:
+                payload = fake_telegram.text_update(1, f"/{route.value}")
+        updates.append(Update.de_json(payload, bot))
+    return updates
+
+
+# Time how long it takes to find the matching handler for every update, per dispatch
+def time_dispatch(dispatch, updates: list[Update], rounds: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for update in updates:
+            dispatch(update)
+    return (time.perf_counter() - started_at) / (rounds * len(updates)) * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare flow engine dispatch with the old handler chains.")
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    # CommandHandler needs the bot's username, so initialise an offline bot
+    application = fake_telegram.build_offline_application()
+    asyncio.run(application.initialize())
+
+    print(f"{'flow / state':<38} {'routes':>6} {'chain ns':>10} {'flow ns':>10} {'speed-up':>9}")
+    for controller in (FindClinic, GetClinicQueue, GetAppointments, ViewFAQ):
+        for state, routes in controller.FLOW.table.items():
+            updates = sample_updates(routes, application.bot)
+            chain = legacy_chain(routes)
+            compiled = flow.FlowStateHandler(routes)
+
+            def chain_dispatch(update: Update) -> None:
+                for handler in chain:
+                    if handler.check_update(update):
+                        return
+
+            chain_ns = time_dispatch(chain_dispatch, updates, args.rounds)
+            flow_ns = time_dispatch(compiled.check_update, updates, args.rounds)
+            print(f"{controller.FLOW.name + ' / ' + str(state):<38} {len(routes):>6} "
+                  f"{chain_ns:>10.0f} {flow_ns:>10.0f} {chain_ns / flow_ns:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+""" Memory soak test
+
+    python -m Benchmarks.memory_soak [--conversations N] [--chats N] [--abandon-rate R] [--budget-mb MB]
+
+Drives synthetic conversations through all four flows of bot.CONV_HANDLER, with the fake Bot API and the stand-in
+DHRMS backend. Some conversations are completed, the rest are abandoned part-way, as users do. Rate limiting is
+turned off, so that every update reaches its flow. tracemalloc snapshots are taken periodically.
+
+By default every conversation comes from a new chat, as it would with a growing user base. State is then expired
+as the running bot does it, with STATE_TTL and the per-chat cache TTLs shortened to SOAK_STATE_TTL seconds, so once
+the warm-up is over the state of new chats replaces expired state and memory has to level off: anything still
+growing is a leak. The chat registry (8 bytes per chat ever seen, kept for broadcasts) is the only per-chat memory
+meant to grow, and is not counted. With --chats N, conversations come from a fixed pool of N chats instead, and
+memory has to level off once every chat has been seen.
+
+Exits with status 1 if traced memory goes over the budget, or keeps growing after the warm-up.
+"""
+
+# Essential Info
+SOAK_MEMORY_BUDGET_MB = float(os.getenv('SOAK_MEMORY_BUDGET_MB', 256))
+# STATE_TTL, and the TTL of the other per-chat caches, used with a new chat per conversation, seconds
+SOAK_STATE_TTL: float = 10
+# Growth after the warm-up, relative to memory at the end of it, above which memory is considered not to level off
+PLATEAU_TOLERANCE: float = 0.05
+# Growth always tolerated, so that short runs with little memory in use are not failed on noise
+PLATEAU_SLACK_BYTES: int = 2 ** 20
+# Top allocation sites shown for growth after the warm-up
+TOP_SITES: int = 10
+
+
+# One conversation per flow, each a list of updates for a chat
+def conversation_scripts() -> list:
+    from Benchmarks import fake_telegram
+
+    return [fake_telegram.find_clinic_conversation, fake_telegram.clinic_queue_conversation,
+            fake_telegram.appointments_conversation, fake_telegram.faq_conversation]
+
+
+# Delete state untouched for STATE_TTL, as state_backend.expire_periodically does in the running bot
+def expire_state(application) -> None:
+    import state_backend
+
+    state_backend.drop_persistence_marks(application)
+    state_backend.BACKEND.expire(state_backend.STATE_TTL)
+
+
+# Memory the chat registry holds for the chats seen so far, which grows by design
+def registry_bytes() -> int:
+    import chat_registry
+
+    return chat_registry.known_chats.buffer_info()[1] * chat_registry.known_chats.itemsize
+
+
+# Conversations still open in the bot, i.e. chats whose top-level conversation has not ended
+def active_conversations() -> int:
+    import bot
+    import state_backend
+
+    return len(state_backend.BACKEND.keys(f"conv:{bot.CONV_HANDLER.name}:"))
+
+
+async def soak(conversations: int, chats: int, abandon_rate: float, snapshot_every: int, warm_up: int,
+               budget_mb: float, seed: int) -> bool:
+    from telegram import Update
+
+    import chat_registry
+
+    from Benchmarks import fake_backend, fake_telegram
+
+    rng = random.Random(seed)
+    fake_backend.install()
+    scripts = conversation_scripts()
+    application = fake_telegram.build_offline_application()
+
+    async with application:
+        # The running bot loads the registry at startup, after which it records every new chat
+        await chat_registry.load()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        # (conversations, traced bytes less the chat registry, active conversations)
+        samples: list[tuple[int, int, int]] = []
+        warmed_up: tracemalloc.Snapshot | None = None
+        started_at = time.perf_counter()
+        updates = 0
+        within_budget = True
+
+        print(f"{'conversations':>13} {'updates':>10} {'active':>8} {'traced MB':>10} {'bytes/active':>13} "
+              f"{'bytes/conv':>11} {'updates/s':>10}")
+        for number in range(1, conversations + 1):
+            chat_id = number % chats + 1 if chats else number
+            script = rng.choice(scripts)(chat_id)
+            if rng.random() < abandon_rate:
+                script = script[:rng.randrange(2, len(script))]
+
+            for payload in script:
+                await application.process_update(Update.de_json(payload, application.bot))
+            updates += len(script)
+
+            if number % snapshot_every and number != conversations:
+                continue
+
+            if not chats:
+                expire_state(application)
+            # Updates leave reference cycles behind (exceptions, coroutine frames), only count what outlives them
+            gc.collect()
+            traced = tracemalloc.get_traced_memory()[0]
+            current = traced - registry_bytes()
+            active = active_conversations()
+            samples.append((number, current, active))
+            print(f"{number:>13} {updates:>10} {active:>8} {traced / 2 ** 20:>10.1f} "
+                  f"{(current - baseline) / max(active, 1):>13.0f} {(current - baseline) / number:>11.0f} "
+                  f"{updates / (time.perf_counter() - started_at):>10.0f}")
+
+            if traced > budget_mb * 2 ** 20:
+                print(f"FAIL: traced memory {traced / 2 ** 20:.1f} MB is over the {budget_mb:g} MB budget")
+                within_budget = False
+                break
+            if warmed_up is None and number >= warm_up:
+                warmed_up = tracemalloc.take_snapshot()
+
+        final = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    # Snapshots taken by this script are not the bot's memory
+    if warmed_up is not None:
+        warmed_up, final = (snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+                            for snapshot in (warmed_up, final))
+
+    return report(samples, warmed_up, final, warm_up) and within_budget
+
+
+# Print whether memory levelled off after the warm-up, and where it kept growing, returns False if it did not
+def report(samples: list[tuple[int, int, int]], warmed_up: tracemalloc.Snapshot | None, final: tracemalloc.Snapshot,
+           warm_up: int) -> bool:
+    after_warm_up = [sample for sample in samples if sample[0] >= warm_up]
+    if warmed_up is None or len(after_warm_up) < 2:
+        print(f"\nNot enough conversations after the warm-up ({warm_up}) to tell whether memory levels off.")
+        return True
+
+    # Memory that levels off peaks no higher in the second half of the run than in the first, whatever the number
+    # of conversations left open at each sample
+    half = len(after_warm_up) // 2
+    first = max(after_warm_up[:half], key=lambda sample: sample[1])
+    last = max(after_warm_up[half:], key=lambda sample: sample[1])
+    growth = last[1] - first[1]
+    per_million = growth / max(last[0] - first[0], 1) * 1e6
+    print(f"\nAfter the warm-up: peak {first[1] / 2 ** 20:.2f} MB -> {last[1] / 2 ** 20:.2f} MB "
+          f"({per_million / 2 ** 20:+.2f} MB per million conversations)")
+
+    print("Allocation sites that grew most after the warm-up:")
+    for stat in final.compare_to(warmed_up, 'lineno')[:TOP_SITES]:
+        print(f"  {stat}")
+
+    if growth > max(PLATEAU_TOLERANCE * first[1], PLATEAU_SLACK_BYTES):
+        print(f"FAIL: memory kept growing after the warm-up (more than {PLATEAU_TOLERANCE:.0%})")
+        return False
+    print("Memory levelled off after the warm-up.")
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Soak the conversation handler and report memory per conversation.")
+    parser.add_argument('--conversations', type=int, default=1000000)
+    parser.add_argument('--chats', type=int, default=0,
+                        help="size of a fixed pool of chats, a new chat for every conversation by default")
+    parser.add_argument('--abandon-rate', type=float, default=0.3)
+    parser.add_argument('--snapshot-every', type=int, default=20000)
+    # Abandoned conversations leave per-chat state behind for each flow, which takes a while to fill for every chat
+    parser.add_argument('--warm-up', type=int, default=None,
+                        help="conversations before growth counts, 10 per chat of a fixed pool, a tenth of the run "
+                             "otherwise")
+    parser.add_argument('--budget-mb', type=float, default=SOAK_MEMORY_BUDGET_MB)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # Keep the chat registry, analytics and other runtime files of the run out of the real cache directory
+    os.environ.setdefault('BOT_CACHE_DIR', tempfile.mkdtemp(prefix='dhrms-soak-'))
+    # No throttling, so that every update reaches its flow and leaves its state behind
+    os.environ['RATE_LIMIT_DEFAULT'] = f"{2 ** 31}/1"
+    os.environ['RATE_LIMITS'] = ''
+    if not args.chats:
+        for name in ('STATE_TTL', 'APPOINTMENT_CACHE_TTL', 'NEGATIVE_CACHE_TTL'):
+            os.environ[name] = str(SOAK_STATE_TTL)
+
+    if args.warm_up is not None:
+        warm_up = args.warm_up
+    else:
+        warm_up = 10 * args.chats if args.chats else args.conversations // 10
+    passed = asyncio.run(soak(args.conversations, args.chats, args.abandon_rate, args.snapshot_every, warm_up,
+                              args.budget_mb, args.seed))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
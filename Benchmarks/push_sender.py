@@ -0,0 +1,64 @@
+import argparse
+import http.client
+import json
+import random
+import time
+
+import push_events
+
+
+# Stand-in for the DHRMS backend: sign and POST a list of events, returns the HTTP status
+def send(connection: http.client.HTTPConnection, events: list[dict], secret: str) -> int:
+    body = json.dumps(events).encode()
+    timestamp = str(int(time.time()))
+    connection.request('POST', push_events.PUSH_EVENTS_PATH, body, {
+        'Content-Type': 'application/json',
+        'X-DHRMS-Timestamp': timestamp,
+        'X-DHRMS-Signature': push_events.sign(timestamp, body, secret)
+    })
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+# A burst of queue count changes, with the occasional clinic or appointment change mixed in
+def burst(size: int, clinic_ids: list[int]) -> list[dict]:
+    events = []
+    for _ in range(size):
+        roll = random.random()
+        if roll < 0.9:
+            events.append({'type': 'queue.count', 'clinicId': random.choice(clinic_ids), 'count': random.randint(0, 30)})
+        elif roll < 0.95:
+            events.append({'type': 'clinic.updated', 'clinicId': random.choice(clinic_ids)})
+        else:
+            events.append({'type': 'appointment.changed', 'apptId': random.randint(1, 10000)})
+    return events
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Send signed push events to a running bot's push event receiver.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=push_events.PUSH_EVENTS_PORT or 8081)
+    parser.add_argument('--secret', default=push_events.PUSH_EVENTS_SECRET)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--events-per-request', type=int, default=10)
+    parser.add_argument('--clinics', type=int, nargs='+', default=list(range(1, 21)))
+    args = parser.parse_args()
+    if not args.secret:
+        parser.error("a secret is needed, set PUSH_EVENTS_SECRET or pass --secret")
+
+    connection = http.client.HTTPConnection(args.host, args.port, timeout=10)
+    statuses = {}
+    started_at = time.perf_counter()
+    for _ in range(args.requests):
+        status = send(connection, burst(args.events_per_request, args.clinics), args.secret)
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - started_at
+    connection.close()
+
+    print(f"{args.requests} requests, {args.requests * args.events_per_request} events in {elapsed:.2f}s "
+          f"({elapsed / args.requests * 1000:.2f} ms per request) | statuses {statuses}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import json
+import multiprocessing
+import os
+
+import sharding
+
+from Benchmarks import fake_telegram
+
+
+# Push the same fake workload through 1..N shards and report throughput and speed-up
+def run(workers: int, chats: int) -> float:
+    results = multiprocessing.get_context('spawn').Queue()
+    processes, inboxes = sharding.start_workers(workers, results, fake_telegram.build_offline_application)
+    dispatcher = sharding.Dispatcher(inboxes)
+
+    payloads = [json.dumps(update).encode()
+                for chat_id in range(1, chats + 1)
+                for update in fake_telegram.faq_conversation(chat_id)]
+
+    for payload in payloads:
+        dispatcher.dispatch(payload)
+    dispatcher.close()
+
+    # Workers time themselves from the moment they are ready, so process start-up is excluded
+    shard_results = [results.get() for _ in processes]
+    elapsed = max(result[2] for result in shard_results)
+    for process in processes:
+        process.join()
+
+    processed = sum(result[1] for result in shard_results)
+    print(f"workers={workers:<3} updates={processed:<8} wall={elapsed:7.2f}s  "
+          f"throughput={processed / elapsed:9.1f} updates/s  routed={dispatcher.routed}")
+    return processed / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark sharded update processing with a fake update source.")
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chats', type=int, default=2000)
+    args = parser.parse_args()
+
+    baseline = None
+    workers = 1
+    while workers <= args.max_workers:
+        throughput = run(workers, args.chats)
+        baseline = baseline or throughput
+        print(f"    speed-up x{throughput / baseline:.2f} (linear would be x{workers})")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import clinic_directory
+import clinic_snapshot
+
+
+# Synthetic clinic list entry and detail record shaped like the DHRMS API responses
+def fake_clinic(clinic_id: int) -> tuple[dict, dict]:
+    clinic = {
+        "clinicId": clinic_id,
+        "clinicName": f"HappySmile Dental Clinic {clinic_id} (Branch)",
+        "clinicAddress": f"{clinic_id % 900 + 1} Tampines Street {clinic_id % 90 + 10}",
+        "clinicUnit": f"{clinic_id % 20:02d}-{clinic_id % 300:03d}",
+        "clinicPostal": 100000 + clinic_id * 7 % 800000,
+    }
+    details = dict(clinic, clinicEmail=f"clinic{clinic_id}@happysmile.sg", clinicSubEmail=None,
+                   clinicPhone=60000000 + clinic_id, clinicSubPhone=None)
+    return clinic, details
+
+
+def timed(label: str, function, repeat: int):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started_at)
+    print(f"  {label:<44} {best * 1000:9.2f} ms")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure clinic snapshot write and load times.")
+    parser.add_argument('--clinics', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    clinics, details = {}, {}
+    for clinic_id in range(1, args.clinics + 1):
+        clinics[clinic_id], details[clinic_id] = fake_clinic(clinic_id)
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = os.path.join(directory, 'clinics.snapshot')
+        json_path = os.path.join(directory, 'clinics.json')
+        clinic_directory.CLINIC_SNAPSHOT_PATH = snapshot_path
+
+        print(f"{args.clinics} clinics with detail records")
+        timed("write snapshot (atomic, fsync)", lambda: clinic_snapshot.write(snapshot_path, clinics, details),
+              args.repeat)
+        with open(json_path, 'w') as f:
+            json.dump({"clinics": list(clinics.values()), "details": list(details.values())}, f)
+        print(f"  {'snapshot size':<44} {os.path.getsize(snapshot_path) / 1024:9.1f} KiB")
+
+        snapshot = timed("open snapshot (mmap + index only)", lambda: clinic_snapshot.Snapshot(snapshot_path),
+                         args.repeat)
+        timed("decode one record", lambda: snapshot.get(args.clinics // 2), args.repeat)
+        timed("decode all records", snapshot.records, args.repeat)
+        snapshot.close()
+
+        timed("clinic_directory.load_snapshot (ready to serve)", clinic_directory.load_snapshot, args.repeat)
+
+        def load_json() -> dict:
+            with open(json_path) as f:
+                return json.load(f)
+
+        timed("baseline: plain JSON file load", load_json, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
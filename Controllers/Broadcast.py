@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import chat_registry
+import constants
+
+from telegram import Bot, Update
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from telegram.ext import Application, CommandHandler, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+ADMIN_CHAT_IDS: set[int] = {int(chat_id) for chat_id in os.getenv('ADMIN_CHAT_IDS', '').split(',') if chat_id.strip()}
+BROADCAST_CHECKPOINT_PATH = os.getenv('BROADCAST_CHECKPOINT_PATH', os.path.join(constants.CACHE_DIR, 'broadcast.json'))
+# Telegram allows roughly 30 messages per second to different chats, stay below that
+BROADCAST_RATE = int(os.getenv('BROADCAST_RATE', 25))
+
+# Checkpoint of the running (or last) broadcast, mirrored to BROADCAST_CHECKPOINT_PATH
+checkpoint: dict | None = None
+broadcast_task: asyncio.Task | None = None
+# Set on shutdown: the running broadcast stops after its current batch, to be resumed from the checkpoint
+pausing: bool = False
+
+
+""" START OF SUPPORT METHODS """
+
+
+# Only chats listed in ADMIN_CHAT_IDS may broadcast
+def is_admin(update: Update) -> bool:
+    return update.effective_chat is not None and update.effective_chat.id in ADMIN_CHAT_IDS
+
+
+# Write the checkpoint atomically, so a crash never leaves a half-written file behind
+def save_checkpoint() -> None:
+    os.makedirs(os.path.dirname(BROADCAST_CHECKPOINT_PATH) or '.', exist_ok=True)
+    temp_path = BROADCAST_CHECKPOINT_PATH + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, BROADCAST_CHECKPOINT_PATH)
+
+
+# Load the last checkpoint from disk
+def load_checkpoint() -> dict | None:
+    if not os.path.isfile(BROADCAST_CHECKPOINT_PATH):
+        return None
+    with open(BROADCAST_CHECKPOINT_PATH) as f:
+        return json.load(f)
+
+
+# Human-readable progress of the current broadcast
+def format_progress() -> str:
+    if checkpoint is None:
+        return "No broadcast has been sent yet."
+
+    status = "finished" if checkpoint['done'] else "in progress"
+    return (f"Broadcast {checkpoint['id']} {status}: "
+            f"{checkpoint['sent']} sent, {checkpoint['failed']} failed, "
+            f"{checkpoint['position']}/{chat_registry.count()} recipients processed.")
+
+
+# Send the broadcast to one chat, returns True on success
+async def send_one(bot: Bot, chat_id: int) -> bool:
+    for _ in range(3):
+        try:
+            if checkpoint.get('message_id') is not None:
+                await bot.copy_message(chat_id, checkpoint['from_chat_id'], checkpoint['message_id'])
+            else:
+                await bot.send_message(chat_id, checkpoint['text'])
+            return True
+        except RetryAfter as exc:
+            await asyncio.sleep(exc.retry_after)
+        except Forbidden:
+            # The user blocked the bot or deleted the chat
+            return False
+        except TelegramError as exc:
+            logger.warning(f"Broadcast to [{chat_id}] failed: {exc!r}")
+            return False
+    return False
+
+
+# Send to every known chat from the checkpointed position, one rate-limited batch per second
+async def run_broadcast(bot: Bot) -> None:
+    batch: list[tuple[int, int]] = []
+    recipients = chat_registry.stream(checkpoint['position'])
+
+    while True:
+        if pausing:
+            logger.info(f"Broadcast {checkpoint['id']} paused at recipient {checkpoint['position']}.")
+            # The checkpoint is only found again if BROADCAST_CHECKPOINT_PATH survives the restart, so the admin
+            # is told where the broadcast stopped either way
+            try:
+                await bot.send_message(checkpoint['admin_chat_id'],
+                                       f"Paused by a restart. {format_progress()} It resumes after the restart if "
+                                       f"the checkpoint file is on storage that survives it.")
+            except TelegramError as exc:
+                logger.warning(f"Could not report paused broadcast to admin: {exc!r}")
+            return
+
+        batch.clear()
+        for entry in recipients:
+            batch.append(entry)
+            if len(batch) >= BROADCAST_RATE:
+                break
+        if not batch:
+            break
+
+        started_at = time.monotonic()
+        results = await asyncio.gather(*[send_one(bot, chat_id) for _, chat_id in batch])
+
+        checkpoint['sent'] += sum(results)
+        checkpoint['failed'] += len(results) - sum(results)
+        checkpoint['position'] = batch[-1][0] + 1
+        save_checkpoint()
+
+        await asyncio.sleep(max(0.0, 1.0 - (time.monotonic() - started_at)))
+
+    checkpoint['done'] = True
+    save_checkpoint()
+    logger.info(format_progress())
+
+    try:
+        await bot.send_message(checkpoint['admin_chat_id'], format_progress())
+    except TelegramError as exc:
+        logger.warning(f"Could not report broadcast result to admin: {exc!r}")
+
+
+# Stop the running broadcast after its current batch, called on shutdown
+async def pause() -> None:
+    global pausing
+    pausing = True
+    if broadcast_task is not None and not broadcast_task.done():
+        await asyncio.wait([broadcast_task])
+
+
+# Start run_broadcast as a background task of the application
+def start_broadcast(application: Application) -> None:
+    global broadcast_task
+    broadcast_task = application.create_task(run_broadcast(application.bot))
+
+
+""" END OF SUPPORT METHODS """
+
+""" START OF BOT METHODS """
+
+
+# /broadcast <text>, or /broadcast in reply to the message to copy to every user
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    global checkpoint
+
+    if not is_admin(update):
+        logger.warning(f"{update.effective_user.first_name} [{update.effective_user.id}] | Unauthorised /broadcast.")
+        return
+
+    if broadcast_task is not None and not broadcast_task.done():
+        await update.message.reply_text("A broadcast is already running.\n\n" + format_progress())
+        return
+
+    reply = update.message.reply_to_message
+    text = update.message.text.partition(' ')[2].strip()
+    if reply is None and not text:
+        await update.message.reply_text("Usage: /broadcast <message>, or reply to a message with /broadcast")
+        return
+
+    checkpoint = {
+        'id': int(time.time()),
+        'admin_chat_id': update.effective_chat.id,
+        'text': text,
+        'from_chat_id': reply.chat_id if reply is not None else None,
+        'message_id': reply.message_id if reply is not None else None,
+        'position': 0,
+        'sent': 0,
+        'failed': 0,
+        'done': False
+    }
+    save_checkpoint()
+
+    logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | Started broadcast {checkpoint['id']}.")
+    await update.message.reply_text(f"Broadcasting to {chat_registry.count()} chats. Use /broadcast_status to check progress.")
+    start_broadcast(context.application)
+
+
+# /broadcast_status
+async def broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin(update):
+        return
+
+    await update.message.reply_text(format_progress())
+
+
+# Resume an unfinished broadcast after a restart
+async def resume(application: Application) -> None:
+    global checkpoint
+
+    checkpoint = load_checkpoint()
+    if checkpoint is not None and not checkpoint['done']:
+        logger.info(f"Resuming broadcast {checkpoint['id']} from recipient {checkpoint['position']}.")
+        start_broadcast(application)
+
+
+""" END OF BOT METHODS """
+
+BROADCAST_HANDLERS = [
+    CommandHandler("broadcast", broadcast),
+    CommandHandler("broadcast_status", broadcast_status)
+]
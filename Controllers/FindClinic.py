@@ -1,29 +1,27 @@
 import logging
-import requests
 
+import admission
+import analytics
+import api
+import clinic_directory
 import constants
+import flow
 import helpers
+import rate_limit
+import validation
 
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
-    ReplyKeyboardRemove,
     Update
 )
 from telegram.ext import (
     CallbackContext,
-    CallbackQueryHandler,
     ContextTypes,
-    ConversationHandler,
-    MessageHandler,
-    filters, CommandHandler
+    ConversationHandler
 )
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Essential Info
@@ -33,9 +31,8 @@ WEBSITE = constants.WEBSITE
 PROCESS_NAME = constants.FIND_CLINICS_NEARBY
 STATES = constants.States
 
-# Initialise Session Dictionaries
-# clinic_dict: dict[int, Clinic.Clinic] = {}
-state_dict: dict[int, int] = {}
+# Initialise Flow
+FLOW = flow.Flow("FindClinic", PROCESS_NAME, logger)
 
 
 # Callback data
@@ -54,26 +51,6 @@ These methods may be transferred to another file/class in the future.
 """
 
 
-# Store current state
-async def store_state(chat_id: int, state: int = -1) -> None:
-    state_dict[chat_id] = state
-
-
-# Get state from dictionary
-async def get_state(chat_id: int) -> int:
-    if chat_id in state_dict:
-        return state_dict[chat_id]
-
-
-# Clear chat state
-async def clear_state(chat_id: int) -> bool:
-    if chat_id in state_dict:
-        del state_dict[chat_id]
-        return True
-    else:
-        return False
-
-
 # Set keyboard
 async def set_keyboard(curr_state: int, prev_state: int) -> list[list[InlineKeyboardButton]] | list[list[str]]:
     match curr_state:
@@ -106,15 +83,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | Started [{PROCESS_NAME}] process.")
     logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | [{PROCESS_NAME}] State: Start")
 
-    prev_state = await get_state(update.effective_chat.id)
+    prev_state = await FLOW.get_state(update.effective_chat.id)
     keyboard = ReplyKeyboardMarkup(await set_keyboard(FindClinicsNearbyState.START, prev_state), one_time_keyboard=True)
 
-    await store_state(update.effective_chat.id, FindClinicsNearbyState.START)
+    await FLOW.store_state(update.effective_chat.id, FindClinicsNearbyState.START)
     await helpers.handle_message(update, "Enter your postal code: \n\n*OR* \n\nPick an option:", keyboard)
 
     return FindClinicsNearbyState.CHOOSING
 
 
+@rate_limit.limited(FLOW.name)
+@admission.guard('clinic/get/all')
 async def list_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     if query is not None:
@@ -124,22 +103,38 @@ async def list_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
     clinic_list = [['⬅️Back']]
     if update.message is not None:
-        uri = 'https://happy-smile-dhrms.herokuapp.com/api/clinic/get/all/'
-        if update.message.text != 'List All Clinics':
-            uri += update.message.text
-
-        result = requests.get(uri)
-        for clinic in result.json():
-            clinic_list.append([f"{clinic.get('clinicId')}. {clinic.get('clinicName')}"])
+        # The full list is served from the clinic directory once it has been loaded
+        if update.message.text == 'List All Clinics' and clinic_directory.clinics:
+            clinic_list += clinic_directory.keyboard_rows()
+        elif update.message.text == 'List All Clinics':
+            result = api.get('clinic/get/all/')
+            for clinic in result.json():
+                clinic_list.append([f"{clinic.get('clinicId')}. {clinic.get('clinicName')}"])
+        else:
+            postal_code = update.message.text
+            # Postal codes in sectors that do not exist, or that recently matched no clinic, skip the backend
+            if not validation.is_valid_postal_code(postal_code):
+                validation.avoid("invalid postal code")
+                await helpers.handle_message(update, "That doesn't look like a valid postal code\. Please check it and try again:")
+                return FindClinicsNearbyState.CHOOSING
+
+            if not validation.is_known_empty('postal code', postal_code):
+                result = api.get(f"clinic/get/all/{postal_code}")
+                for clinic in result.json():
+                    clinic_list.append([f"{clinic.get('clinicId')}. {clinic.get('clinicName')}"])
+                if len(clinic_list) == 1:
+                    validation.remember_empty('postal code', postal_code)
 
     keyboard = ReplyKeyboardMarkup(clinic_list, one_time_keyboard=True)
 
-    await store_state(update.effective_chat.id, FindClinicsNearbyState.LIST_RESULTS)
+    await FLOW.store_state(update.effective_chat.id, FindClinicsNearbyState.LIST_RESULTS)
     await helpers.handle_message(update, "Here are the results\! \n\nSelect a clinic to view more details:", keyboard)
 
     return FindClinicsNearbyState.LIST_RESULTS
 
 
+@rate_limit.limited(FLOW.name)
+@admission.guard('clinic/get')
 async def clinic_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     if query is not None:
@@ -147,82 +142,51 @@ async def clinic_details(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | [{PROCESS_NAME}] State: Clinic Details")
 
-    prev_state = await get_state(update.effective_chat.id)
+    prev_state = await FLOW.get_state(update.effective_chat.id)
     keyboard = await set_keyboard(FindClinicsNearbyState.CLINIC_DETAILS, prev_state)
 
     clinic_info_msg = ""
     if update.message is not None:
-        uri = f"https://happy-smile-dhrms.herokuapp.com/api/clinic/get/{update.message.text.split('.')[0]}"
-        result = requests.get(uri)
-        clinic_dict = result.json()
-        clinic_info_msg = "*" + clinic_dict.get('clinicName').replace('.', '\.').replace('-', '\-').replace('(', '\(').replace(')', '\)') + "*"
-        clinic_info_msg += f"\n\n*Clinic ID:* {clinic_dict.get('clinicId')}"
-        clinic_info_msg += "\n*Clinic Address:* " + clinic_dict.get('clinicAddress').replace('.', '\.').replace('-', '\-').replace('(', '\(').replace(')', '\)')
-        clinic_info_msg += "\n*Unit No\.:* \#" + clinic_dict.get('clinicUnit').replace('-', '\-')
-        clinic_info_msg += f"\n*Postal:* {clinic_dict.get('clinicPostal')}"
-        clinic_info_msg += "\n*Email:* " + clinic_dict.get('clinicEmail').replace('.', '\.').replace('_', '\_')
-        if clinic_dict.get('clinicSubEmail') is not None:
-            clinic_info_msg += "\n*Secondary Email:* " + clinic_dict.get('clinicSubEmail').replace('.', '\.').replace(
-                '_', '\_')
+        clinic_id = helpers.selected_clinic_id(update, context)
+        analytics.note_clinic(clinic_id)
+        clinic_dict = clinic_directory.get_details(clinic_id)
+        if clinic_dict is not None:
+            clinic_info_msg = clinic_directory.format_clinic_details(clinic_dict)
         else:
-            clinic_info_msg += "\n*Secondary Email:* N/A"
-        clinic_info_msg += f"\n*Phone:* \+65 {clinic_dict.get('clinicPhone')}"
-        if clinic_dict.get('clinicSubEmail') is not None:
-            clinic_info_msg += f"\n*Secondary Phone:* \+65 {clinic_dict.get('clinicSubPhone')}"
-        else:
-            clinic_info_msg += "\n*Secondary Phone:* N/A"
+            clinic_info_msg = "Sorry, I couldn't find this clinic\. Please go back and try again\."
 
-    await store_state(update.effective_chat.id, FindClinicsNearbyState.CLINIC_DETAILS)
+    await FLOW.store_state(update.effective_chat.id, FindClinicsNearbyState.CLINIC_DETAILS)
     await helpers.handle_message(update, clinic_info_msg, InlineKeyboardMarkup(keyboard))
 
     return FindClinicsNearbyState.CLINIC_DETAILS
 
 
-async def end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    if query is not None:
-        await query.answer()
-
-    logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | Cancelled [{PROCESS_NAME}] process.")
+""" END OF BOT METHODS """
 
-    await helpers.handle_message(update,
-                                 "Alright, I'll see you again soon\! " +
-                                 "\n\nFor more information, please visit our website at " +
-                                 WEBSITE.replace('.', '\.').replace('-', '\-') + "\." +
-                                 "\n\nPress start on the menu or type \/start to start the bot again\.",
-                                 ReplyKeyboardRemove())
-
-    await clear_state(update.effective_chat.id)
-    return STATES.END
-
-
-# Initialise a conversation handler for [PRODUCT CREATION]
-FIND_CLINICS_CONV_HANDLER: ConversationHandler[CallbackContext] = ConversationHandler(
+# Initialise a conversation handler for [FIND CLINICS NEARBY]
+FIND_CLINICS_CONV_HANDLER: ConversationHandler[CallbackContext] = FLOW.compile(
     entry_points=[
-        CallbackQueryHandler(start, pattern=f"^{STATES.FIND_CLINICS_NEARBY}$")
+        flow.callback(STATES.FIND_CLINICS_NEARBY, start)
     ],
     states={
-        FindClinicsNearbyState.START: [MessageHandler(filters.TEXT & ~filters.COMMAND, start)],
+        FindClinicsNearbyState.START: [flow.any_text(start)],
         FindClinicsNearbyState.CHOOSING: [
-            MessageHandler(filters.Regex('^[0-9]{6}$') & ~filters.COMMAND, list_results),
-            MessageHandler(filters.Regex('^List All Clinics$') & ~filters.COMMAND, list_results),
-            MessageHandler(filters.Regex('^❌ Close$') & ~filters.COMMAND, end)
+            flow.pattern('[0-9]{6}', list_results),
+            flow.text('List All Clinics', list_results),
+            flow.text('❌ Close', FLOW.end)
         ],
         FindClinicsNearbyState.LIST_RESULTS: [
-            MessageHandler(filters.Regex('^⬅️Back$') & ~filters.COMMAND, start),
-            MessageHandler(filters.Regex('^[0-9]+[.][ ][ A-Za-z0-9_@.\/#&():*+-]+$') & ~filters.COMMAND, clinic_details)
+            flow.text('⬅️Back', start),
+            flow.pattern('[0-9]+[.][ ][ A-Za-z0-9_@.\\/#&():*+-]+', clinic_details)
         ],
         FindClinicsNearbyState.CLINIC_DETAILS: [
-            CallbackQueryHandler(start, pattern=f"^{FindClinicsNearbyState.START}$"),
+            flow.callback(FindClinicsNearbyState.START, start)
         ],
-        FindClinicsNearbyState.END: [MessageHandler(filters.TEXT & ~filters.COMMAND, end)]
+        FindClinicsNearbyState.END: [flow.any_text(FLOW.end)]
     },
     fallbacks=[
-        CallbackQueryHandler(start, pattern=f"^{FindClinicsNearbyState.START}$"),
-        CallbackQueryHandler(end, pattern=f"^{FindClinicsNearbyState.END}$"),
-        CommandHandler("stop", end)
-    ],
-    map_to_parent={
-        STATES.END: ConversationHandler.END
-    }
+        flow.callback(FindClinicsNearbyState.START, start),
+        flow.callback(FindClinicsNearbyState.END, FLOW.end),
+        flow.command("stop", FLOW.end)
+    ]
 )
@@ -1,40 +1,37 @@
 import logging
-import requests
 
+import admission
+import appointment_cache
 import constants
+import flow
 import helpers
+import rate_limit
+import validation
 
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
-    ReplyKeyboardRemove,
     Update
 )
 from telegram.ext import (
     CallbackContext,
-    CallbackQueryHandler,
     ContextTypes,
-    ConversationHandler,
-    MessageHandler,
-    filters, CommandHandler
+    ConversationHandler
 )
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Essential Info
 TELEGRAM_BOT_API_TOKEN = constants.TELEGRAM_BOT_API_TOKEN
 BOT_NAME = constants.BOT_NAME
 WEBSITE = constants.WEBSITE
-PROCESS_NAME = constants.FIND_CLINICS_NEARBY
+PROCESS_NAME = constants.GET_APPOINTMENTS
 STATES = constants.States
+UNAVAILABLE_MESSAGE = "Appointments are not available right now\. Please try again later\."
 
-# Initialise Session Dictionaries
-state_dict: dict[int, int] = {}
+# Initialise Flow
+FLOW = flow.Flow("GetAppointments", PROCESS_NAME, logger)
 
 
 # Callback data
@@ -53,26 +50,6 @@ These methods may be transferred to another file/class in the future.
 """
 
 
-# Store current state
-async def store_state(chat_id: int, state: int = -1) -> None:
-    state_dict[chat_id] = state
-
-
-# Get state from dictionary
-async def get_state(chat_id: int) -> int:
-    if chat_id in state_dict:
-        return state_dict[chat_id]
-
-
-# Clear chat state
-async def clear_state(chat_id: int) -> bool:
-    if chat_id in state_dict:
-        del state_dict[chat_id]
-        return True
-    else:
-        return False
-
-
 # Set keyboard
 async def set_keyboard(curr_state: int, prev_state: int) -> list[list[InlineKeyboardButton]] | list[list[str]]:
     match curr_state:
@@ -103,15 +80,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | Started [{PROCESS_NAME}] process.")
     logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | [{PROCESS_NAME}] State: Start")
 
-    prev_state = await get_state(update.effective_chat.id)
+    prev_state = await FLOW.get_state(update.effective_chat.id)
     keyboard = await set_keyboard(GetAppointmentsState.START, prev_state)
 
-    await store_state(update.effective_chat.id, GetAppointmentsState.START)
+    await FLOW.store_state(update.effective_chat.id, GetAppointmentsState.START)
     await helpers.handle_message(update, "Enter your NRIC:", InlineKeyboardMarkup(keyboard))
 
     return GetAppointmentsState.CHOOSING
 
 
+@rate_limit.limited(FLOW.name)
+@admission.guard('appointment/get/all/upcoming')
 async def list_appointments(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     if query is not None:
@@ -122,23 +101,30 @@ async def list_appointments(update: Update, context: ContextTypes.DEFAULT_TYPE)
     appt_list = []
     firstName = ""
     lastName = ""
+    appointments = []
     if update.message is not None:
-        uri = f"https://happy-smile-dhrms.herokuapp.com/api/appointment/get/all/upcoming/nric/{update.message.text}"
-        result = requests.get(uri)
-
-        if result.status_code == 200:
-            for appt in result.json():
-                appt_list.append([f"#{appt.get('apptId')} | {appt.get('startDateTime')}"])
-                firstName = appt.get('firstName')
-                lastName = appt.get('lastName')
-
+        # A mistyped NRIC is caught here instead of costing a backend call
+        if not validation.is_valid_nric(update.message.text):
+            validation.avoid("invalid nric")
+            await helpers.handle_message(update, "That doesn't look like a valid NRIC/FIN\. Please check it and try again:")
+            return GetAppointmentsState.CHOOSING
+
+        appointments = appointment_cache.get_upcoming(update.effective_chat.id, update.message.text.upper())
+        if appointments is None:
+            await helpers.handle_message(update, UNAVAILABLE_MESSAGE)
+            return GetAppointmentsState.CHOOSING
+
+        for appt in appointments:
+            appt_list.append([f"#{appt.get('apptId')} | {appt.get('startDateTime')}"])
+            firstName = appt.get('firstName')
+            lastName = appt.get('lastName')
 
     appt_list.append(['⬅️Back'])
     keyboard = ReplyKeyboardMarkup(appt_list, one_time_keyboard=True)
 
-    await store_state(update.effective_chat.id, GetAppointmentsState.LIST_APPOINTMENTS)
+    await FLOW.store_state(update.effective_chat.id, GetAppointmentsState.LIST_APPOINTMENTS)
 
-    if result.status_code == 200:
+    if appointments:
         await helpers.handle_message(update, f"Welcome back *{firstName} {lastName}*\! \n\nHere are your upcoming "
                                              f"appointments\! \n\n_Note: Appointments are displayed in the form of "
                                              f"DD/MM/YYYY HH:mm format\._ \n\nSelect an appointment to view more "
@@ -150,6 +136,8 @@ async def list_appointments(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return GetAppointmentsState.LIST_APPOINTMENTS
 
 
+@rate_limit.limited(FLOW.name)
+@admission.guard('appointment/get')
 async def appointment_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     if query is not None:
@@ -157,14 +145,16 @@ async def appointment_details(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | [{PROCESS_NAME}] State: Appointment Details")
 
-    prev_state = await get_state(update.effective_chat.id)
+    prev_state = await FLOW.get_state(update.effective_chat.id)
     keyboard = await set_keyboard(GetAppointmentsState.APPOINTMENTS_DETAILS, prev_state)
 
     appt_info_msg = "*APPOINTMENT DETAILS* 📝"
     if update.message is not None:
-        uri = f"https://happy-smile-dhrms.herokuapp.com/api/appointment/get/{update.message.text.split('|')[0].strip()[1:]}"
-        result = requests.get(uri)
-        clinic_dict = result.json()
+        clinic_dict = appointment_cache.get_details(update.effective_chat.id,
+                                                    update.message.text.split('|')[0].strip()[1:])
+        if clinic_dict is None:
+            await helpers.handle_message(update, UNAVAILABLE_MESSAGE)
+            return GetAppointmentsState.LIST_APPOINTMENTS
         appt_info_msg += f"\n\n*Date & Time:* {clinic_dict.get('startDateTime')} ⏰"
         appt_info_msg += f"\n*Status:* {clinic_dict.get('status')}"
         if clinic_dict.get('status') == 'Upcoming':
@@ -182,55 +172,42 @@ async def appointment_details(update: Update, context: ContextTypes.DEFAULT_TYPE
         if clinic_dict.get('clinicSubEmail') is not None:
             appt_info_msg += f"\n*Secondary Phone:* \+65 {clinic_dict.get('clinicSubPhone')}"
 
-    await store_state(update.effective_chat.id, GetAppointmentsState.APPOINTMENTS_DETAILS)
+    await FLOW.store_state(update.effective_chat.id, GetAppointmentsState.APPOINTMENTS_DETAILS)
     await helpers.handle_message(update, appt_info_msg, InlineKeyboardMarkup(keyboard))
 
     return GetAppointmentsState.APPOINTMENTS_DETAILS
 
 
 async def end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    if query is not None:
-        await query.answer()
-
-    logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | Cancelled [{PROCESS_NAME}] process.")
+    appointment_cache.invalidate(update.effective_chat.id)
 
-    await helpers.handle_message(update,
-                                 "Alright, I'll see you again soon\! " +
-                                 "\n\nFor more information, please visit our website at " +
-                                 WEBSITE.replace('.', '\.').replace('-', '\-') + "\." +
-                                 "\n\nPress start on the menu or type \/start to start the bot again\.",
-                                 ReplyKeyboardRemove())
+    return await FLOW.end(update, context)
 
-    await clear_state(update.effective_chat.id)
-    return STATES.END
 
+""" END OF BOT METHODS """
 
-# Initialise a conversation handler for [PRODUCT CREATION]
-GET_APPOINTMENTS_CONV_HANDLER: ConversationHandler[CallbackContext] = ConversationHandler(
+# Initialise a conversation handler for [GET APPOINTMENTS]
+GET_APPOINTMENTS_CONV_HANDLER: ConversationHandler[CallbackContext] = FLOW.compile(
     entry_points=[
-        CallbackQueryHandler(start, pattern=f"^{STATES.GET_APPOINTMENTS}$")
+        flow.callback(STATES.GET_APPOINTMENTS, start)
     ],
     states={
-        GetAppointmentsState.START: [MessageHandler(filters.TEXT & ~filters.COMMAND, start)],
+        GetAppointmentsState.START: [flow.any_text(start)],
         GetAppointmentsState.CHOOSING: [
-            MessageHandler(filters.Regex('^[STFG]\d{7}[A-Z]$') & ~filters.COMMAND, list_appointments)
+            flow.pattern('[STFGMstfgm]\\d{7}[A-Za-z]', list_appointments)
         ],
         GetAppointmentsState.LIST_APPOINTMENTS: [
-            MessageHandler(filters.Regex('^[#][0-9]+[ ][|][ ][\d]{2}[\/][\d]{2}[\/][\d]{4}[ ][\d]{2}[:][\d]{2}$') & ~filters.COMMAND, appointment_details),
-            MessageHandler(filters.Regex('^⬅️Back$') & ~filters.COMMAND, start)
+            flow.pattern('[#][0-9]+[ ][|][ ][\\d]{2}[\\/][\\d]{2}[\\/][\\d]{4}[ ][\\d]{2}[:][\\d]{2}', appointment_details),
+            flow.text('⬅️Back', start)
         ],
         GetAppointmentsState.APPOINTMENTS_DETAILS: [
-            CallbackQueryHandler(start, pattern=f"^{GetAppointmentsState.START}$"),
+            flow.callback(GetAppointmentsState.START, start)
         ],
-        GetAppointmentsState.END: [MessageHandler(filters.TEXT & ~filters.COMMAND, end)]
+        GetAppointmentsState.END: [flow.any_text(end)]
     },
     fallbacks=[
-        CallbackQueryHandler(start, pattern=f"^{GetAppointmentsState.START}$"),
-        CallbackQueryHandler(end, pattern=f"^{GetAppointmentsState.END}$"),
-        CommandHandler("stop", end)
-    ],
-    map_to_parent={
-        STATES.END: ConversationHandler.END
-    }
+        flow.callback(GetAppointmentsState.START, start),
+        flow.callback(GetAppointmentsState.END, end),
+        flow.command("stop", end)
+    ]
 )
@@ -1,8 +1,14 @@
 import logging
-import requests
 
+import admission
+import analytics
+import api
+import clinic_directory
 import constants
+import flow
 import helpers
+import rate_limit
+import validation
 
 from datetime import datetime
 
@@ -10,22 +16,14 @@ from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
-    ReplyKeyboardRemove,
     Update
 )
 from telegram.ext import (
     CallbackContext,
-    CallbackQueryHandler,
     ContextTypes,
-    ConversationHandler,
-    MessageHandler,
-    filters, CommandHandler
+    ConversationHandler
 )
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Essential Info
@@ -35,9 +33,8 @@ WEBSITE = constants.WEBSITE
 PROCESS_NAME = constants.GET_CLINIC_QUEUE
 STATES = constants.States
 
-# Initialise Session Dictionaries
-# clinic_dict: dict[int, Clinic.Clinic] = {}
-state_dict: dict[int, int] = {}
+# Initialise Flow
+FLOW = flow.Flow("GetClinicQueue", PROCESS_NAME, logger)
 
 
 # Callback data
@@ -56,31 +53,12 @@ These methods may be transferred to another file/class in the future.
 """
 
 
-# Store current state
-async def store_state(chat_id: int, state: int = -1) -> None:
-    state_dict[chat_id] = state
-
-
-# Get state from dictionary
-async def get_state(chat_id: int) -> int:
-    if chat_id in state_dict:
-        return state_dict[chat_id]
-
-
-# Clear chat state
-async def clear_state(chat_id: int) -> bool:
-    if chat_id in state_dict:
-        del state_dict[chat_id]
-        return True
-    else:
-        return False
-
-
 # Set keyboard
 async def set_keyboard(curr_state: int, prev_state: int) -> list[list[InlineKeyboardButton]] | list[list[str]]:
     match curr_state:
         case GetClinicQueueState.START:
             return [
+                ["Shortest Queue"],
                 ["List All Clinics"],
                 ["❌ Close"]
             ]
@@ -108,15 +86,18 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | Started [{PROCESS_NAME}] process.")
     logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | [{PROCESS_NAME}] State: Start")
 
-    prev_state = await get_state(update.effective_chat.id)
+    prev_state = await FLOW.get_state(update.effective_chat.id)
     keyboard = ReplyKeyboardMarkup(await set_keyboard(GetClinicQueueState.START, prev_state), one_time_keyboard=True)
 
-    await store_state(update.effective_chat.id, GetClinicQueueState.START)
-    await helpers.handle_message(update, "Pick an option:", keyboard)
+    await FLOW.store_state(update.effective_chat.id, GetClinicQueueState.START)
+    await helpers.handle_message(update, "Pick an option, or send your postal code to find the shortest queue near you:",
+                                 keyboard)
 
     return GetClinicQueueState.CHOOSING
 
 
+@rate_limit.limited(FLOW.name)
+@admission.guard('clinic/get/all')
 async def list_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     if query is not None:
@@ -127,22 +108,65 @@ async def list_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
     clinic_list = [['⬅️Back']]
     if update.message is not None:
-        uri = 'https://happy-smile-dhrms.herokuapp.com/api/clinic/get/all/'
-        if update.message.text != 'List All Clinics':
-            uri += update.message.text
+        # The full list is served from the clinic directory once it has been loaded
+        if update.message.text == 'List All Clinics' and clinic_directory.clinics:
+            clinic_list += clinic_directory.keyboard_rows()
+        else:
+            uri = 'clinic/get/all/'
+            if update.message.text != 'List All Clinics':
+                uri += update.message.text
 
-        result = requests.get(uri)
-        for clinic in result.json():
-            clinic_list.append([f"{clinic.get('clinicId')}. {clinic.get('clinicName')}"])
+            result = api.get(uri)
+            for clinic in result.json():
+                clinic_list.append([f"{clinic.get('clinicId')}. {clinic.get('clinicName')}"])
 
     keyboard = ReplyKeyboardMarkup(clinic_list, one_time_keyboard=True)
 
-    await store_state(update.effective_chat.id, GetClinicQueueState.LIST_RESULTS)
+    await FLOW.store_state(update.effective_chat.id, GetClinicQueueState.LIST_RESULTS)
     await helpers.handle_message(update, "Select a clinic to view its current queue status:", keyboard)
 
     return GetClinicQueueState.LIST_RESULTS
 
 
+@rate_limit.limited(FLOW.name)
+@admission.guard('queue/rank')
+async def shortest_queue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    if query is not None:
+        await query.answer()
+
+    logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | [{PROCESS_NAME}] State: Shortest Queue")
+
+    postal_code = None
+    if update.message.text.isdigit():
+        if validation.is_valid_postal_code(update.message.text):
+            postal_code = int(update.message.text)
+        else:
+            validation.avoid("invalid postal code")
+            await helpers.handle_message(update, "That doesn't look like a valid postal code\. Please check it and try again:")
+            return GetClinicQueueState.CHOOSING
+
+    # numpy is only loaded once someone asks for a ranking, keeping it off the startup path
+    import queue_ranking
+
+    clinic_ids, counts = await queue_ranking.get_counts()
+    ranking, no_count, no_location = queue_ranking.rank(clinic_ids, counts, postal_code)
+    queue_info_msg = clinic_directory.format_queue_ranking(ranking, postal_code, no_count, no_location)
+    queue_info_msg += f"\n\n_Note: This message is generated at {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\. Select a clinic to get its latest queue status\._"
+
+    # Ranked clinics can be opened like the full list
+    clinic_list = [['⬅️Back']] + [[f"{clinic_id}. {clinic_directory.clinics[clinic_id].get('clinicName')}"]
+                                  for clinic_id, _, _ in ranking]
+    keyboard = ReplyKeyboardMarkup(clinic_list, one_time_keyboard=True)
+
+    await FLOW.store_state(update.effective_chat.id, GetClinicQueueState.LIST_RESULTS)
+    await helpers.handle_message(update, queue_info_msg, keyboard)
+
+    return GetClinicQueueState.LIST_RESULTS
+
+
+@rate_limit.limited(FLOW.name)
+@admission.guard('queue/get/count')
 async def clinic_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     if query is not None:
@@ -150,86 +174,65 @@ async def clinic_details(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | [{PROCESS_NAME}] State: View Clinic Queue Status")
 
-    prev_state = await get_state(update.effective_chat.id)
+    prev_state = await FLOW.get_state(update.effective_chat.id)
     keyboard = await set_keyboard(GetClinicQueueState.CLINIC_DETAILS, prev_state)
 
     queue_info_msg = ""
     if update.message is not None:
-        uri = f"https://happy-smile-dhrms.herokuapp.com/api/queue/get/count/{update.message.text.split('.')[0]}"
-        result = requests.get(uri)
-
-        if result.status_code == 200:
-            queue_dict = result.json()
-            queue_info_msg = "*" + queue_dict.get('clinicName').replace('.', '\.').replace('-', '\-').replace('(', '\(').replace(')', '\)') + "*"
-
-            if queue_dict.get('count') < 5:
-                queue_info_msg += f"\n\n🟢 *SHORT WAITING TIME* 🟢"
-            elif queue_dict.get('count') < 10:
-                queue_info_msg += f"\n\n🟡 *MODERATE WAITING TIME* 🟡"
-            else:
-                queue_info_msg += f"\n\n🔴 *LONG WAITING TIME* 🔴"
-
-            queue_info_msg += f"\n\nCurrently in Queue: *{queue_dict.get('count')}*"
+        clinic_id = helpers.selected_clinic_id(update, context)
+        analytics.note_clinic(clinic_id)
+        # Counts pushed by the backend are current, no need to ask for them
+        pushed = clinic_directory.get_pushed_queue_count(clinic_id)
+        if pushed is not None:
+            queue_info_msg = clinic_directory.format_queue_status(*pushed)
         else:
-            uri = f"https://happy-smile-dhrms.herokuapp.com/api/clinic/get/{update.message.text.split('.')[0]}"
-            result = requests.get(uri)
-            clinic_dict = result.json()
-            queue_info_msg = "*" + clinic_dict.get('clinicName').replace('.', '\.').replace('-', '\-').replace('(', '\(').replace(')', '\)') + "*"
-            queue_info_msg += f"\n\n🟢 *SHORT WAITING TIME* 🟢"
-            queue_info_msg += f"\n\nCurrently in Queue: *None*"
+            uri = f"queue/get/count/{clinic_id}"
+            result = api.get(uri)
+
+            if result.status_code == 200:
+                queue_dict = result.json()
+                queue_info_msg = clinic_directory.format_queue_status(queue_dict.get('clinicName'), queue_dict.get('count'))
+                clinic_directory.record_queue_count(int(queue_dict.get('clinicId', clinic_id)),
+                                                    queue_dict.get('clinicName'), queue_dict.get('count'))
+            else:
+                clinic_dict = clinic_directory.get_details(clinic_id) or {}
+                queue_info_msg = clinic_directory.format_queue_status(clinic_dict.get('clinicName'), None)
 
     queue_info_msg += f"\n\n_Note: This message is generated at {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\. Please go back and select the clinic again to get the latest queue status\._"
 
-    await store_state(update.effective_chat.id, GetClinicQueueState.CLINIC_DETAILS)
+    await FLOW.store_state(update.effective_chat.id, GetClinicQueueState.CLINIC_DETAILS)
     await helpers.handle_message(update, queue_info_msg, InlineKeyboardMarkup(keyboard))
 
     return GetClinicQueueState.CLINIC_DETAILS
 
 
-async def end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    if query is not None:
-        await query.answer()
-
-    logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | Cancelled [{PROCESS_NAME}] process.")
+""" END OF BOT METHODS """
 
-    await helpers.handle_message(update,
-                                 "Alright, I'll see you again soon\! " +
-                                 "\n\nFor more information, please visit our website at " +
-                                 WEBSITE.replace('.', '\.').replace('-', '\-') + "\." +
-                                 "\n\nPress start on the menu or type \/start to start the bot again\.",
-                                 ReplyKeyboardRemove())
-
-    await clear_state(update.effective_chat.id)
-    return STATES.END
-
-
-# Initialise a conversation handler for [PRODUCT CREATION]
-GET_CLINIC_QUEUE_CONV_HANDLER: ConversationHandler[CallbackContext] = ConversationHandler(
+# Initialise a conversation handler for [GET CLINIC QUEUE]
+GET_CLINIC_QUEUE_CONV_HANDLER: ConversationHandler[CallbackContext] = FLOW.compile(
     entry_points=[
-        CallbackQueryHandler(start, pattern=f"^{STATES.GET_CLINIC_QUEUE}$")
+        flow.callback(STATES.GET_CLINIC_QUEUE, start)
     ],
     states={
-        GetClinicQueueState.START: [MessageHandler(filters.TEXT & ~filters.COMMAND, start)],
+        GetClinicQueueState.START: [flow.any_text(start)],
         GetClinicQueueState.CHOOSING: [
-            MessageHandler(filters.Regex('^List All Clinics$') & ~filters.COMMAND, list_results),
-            MessageHandler(filters.Regex('^❌ Close$') & ~filters.COMMAND, end)
+            flow.text('Shortest Queue', shortest_queue),
+            flow.pattern('[0-9]{6}', shortest_queue),
+            flow.text('List All Clinics', list_results),
+            flow.text('❌ Close', FLOW.end)
         ],
         GetClinicQueueState.LIST_RESULTS: [
-            MessageHandler(filters.Regex('^⬅️Back$') & ~filters.COMMAND, start),
-            MessageHandler(filters.Regex('^[0-9]+[.][ ][ A-Za-z0-9_@.\/#&():*+-]+$') & ~filters.COMMAND, clinic_details)
+            flow.text('⬅️Back', start),
+            flow.pattern('[0-9]+[.][ ][ A-Za-z0-9_@.\\/#&():*+-]+', clinic_details)
         ],
         GetClinicQueueState.CLINIC_DETAILS: [
-            CallbackQueryHandler(start, pattern=f"^{GetClinicQueueState.START}$"),
+            flow.callback(GetClinicQueueState.START, start)
         ],
-        GetClinicQueueState.END: [MessageHandler(filters.TEXT & ~filters.COMMAND, end)]
+        GetClinicQueueState.END: [flow.any_text(FLOW.end)]
     },
     fallbacks=[
-        CallbackQueryHandler(start, pattern=f"^{GetClinicQueueState.START}$"),
-        CallbackQueryHandler(end, pattern=f"^{GetClinicQueueState.END}$"),
-        CommandHandler("stop", end)
-    ],
-    map_to_parent={
-        STATES.END: ConversationHandler.END
-    }
+        flow.callback(GetClinicQueueState.START, start),
+        flow.callback(GetClinicQueueState.END, FLOW.end),
+        flow.command("stop", FLOW.end)
+    ]
 )
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import os
+
+import clinic_directory
+
+from telegram import Update
+from telegram.ext import ContextTypes, InlineQueryHandler
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))
+INLINE_DEBOUNCE = float(os.getenv('INLINE_DEBOUNCE', 0.3))
+
+# Latest inline query ID per user, used to drop queries superseded by further typing
+latest_query: dict[int, str] = {}
+
+
+""" START OF BOT METHODS """
+
+
+# Answer "@bot <name or postal>" from the in-memory clinic directory
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.inline_query
+    user_id = query.from_user.id
+    latest_query[user_id] = query.id
+
+    # Wait briefly, if the user typed another character in the meantime only the newer query is answered
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    if latest_query.get(user_id) != query.id:
+        return
+    del latest_query[user_id]
+
+    results = clinic_directory.inline_results(query.query)
+    logger.info(f"{query.from_user.first_name} [{user_id}] | Inline query [{query.query}] | {len(results)} results")
+
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+
+
+""" END OF BOT METHODS """
+
+# Non-blocking, so that debouncing does not hold up other updates
+INLINE_QUERY_HANDLER = InlineQueryHandler(inline_query, block=False)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+
+import profiler
+
+import Controllers.Broadcast as Broadcast
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from telegram.ext import CommandHandler, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+DEFAULT_SECONDS: float = 60
+# Telegram messages are limited to 4096 characters
+MAX_SUMMARY_LENGTH: int = 3500
+
+# Task that switches profiling off at the end of the window
+profile_task: asyncio.Task | None = None
+
+
+""" START OF SUPPORT METHODS """
+
+
+# Which updates a profile covers: when sharded, only the worker that received /profile is profiled
+def scope() -> str:
+    if profiler.shard is None:
+        return ""
+    return f" on shard {profiler.shard} (only chats routed to this worker)"
+
+
+# Switch profiling off after the window and send the admin the result
+async def finish_after(bot: Bot, chat_id: int, seconds: float) -> None:
+    await asyncio.sleep(seconds)
+    await finish(bot, chat_id)
+
+
+async def finish(bot: Bot, chat_id: int) -> None:
+    path = profiler.stop()
+    text = f"Profiled {profiler.sampled} of {profiler.seen} updates{scope()}."
+    if path is not None:
+        text += (f"\nProfile written to {path}\n{profiler.CAVEAT}\n\n"
+                 f"{profiler.summary()[:MAX_SUMMARY_LENGTH]}")
+
+    try:
+        await bot.send_message(chat_id, text)
+    except TelegramError as exc:
+        logger.warning(f"Could not send profile summary to admin: {exc!r}")
+
+
+""" END OF SUPPORT METHODS """
+
+""" START OF BOT METHODS """
+
+
+# /profile [seconds] [sample rate], or /profile stop
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    global profile_task
+
+    if not Broadcast.is_admin(update):
+        logger.warning(f"{update.effective_user.first_name} [{update.effective_user.id}] | Unauthorised /profile.")
+        return
+
+    if profile_task is not None and not profile_task.done():
+        profile_task.cancel()
+        if context.args and context.args[0] == 'stop':
+            await finish(context.bot, update.effective_chat.id)
+            return
+        profiler.stop()
+
+    try:
+        seconds = float(context.args[0]) if context.args else DEFAULT_SECONDS
+        rate = float(context.args[1]) if len(context.args) > 1 else profiler.PROFILE_SAMPLE_RATE
+    except ValueError:
+        await update.message.reply_text("Usage: /profile [seconds] [sample rate 0-1], or /profile stop")
+        return
+
+    seconds = profiler.start(seconds, rate)
+    profile_task = context.application.create_task(finish_after(context.bot, update.effective_chat.id, seconds))
+    await update.message.reply_text(f"Profiling {profiler.sample_rate:.0%} of conversation updates{scope()} "
+                                    f"for {seconds:.0f}s.")
+
+
+""" END OF BOT METHODS """
+
+PROFILE_HANDLERS = [
+    CommandHandler("profile", profile)
+]
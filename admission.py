@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+import api
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+# Updates that have waited longer than this many backend round trips are answered with BUSY_MESSAGE
+ADMISSION_WAIT_FACTOR = float(os.getenv('ADMISSION_WAIT_FACTOR', 4))
+ADMISSION_MIN_WAIT = float(os.getenv('ADMISSION_MIN_WAIT', 2))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', 15))
+
+BUSY_MESSAGE = "We're receiving a lot of requests right now. Please try again shortly."
+# Weight of the newest sample in the moving averages
+EWMA_WEIGHT: float = 0.2
+
+# Seconds the update being handled spent queued before the bot got to it
+queue_time: contextvars.ContextVar[float] = contextvars.ContextVar('queue_time', default=0.0)
+
+# Arrival times and duplicate marks of queued updates, keyed by update ID
+arrivals: dict[int, float] = {}
+duplicates: set[int] = set()
+# Number of queued updates per (chat, input), to spot repeated taps
+queued_inputs: dict[tuple, int] = {}
+# (chat, input) of the guarded actions still running; repeats arriving meanwhile are dropped
+pending_inputs: set[tuple] = set()
+
+# Highest update ID ever queued; everything up to it has been fetched from Telegram
+last_queued_id: int = 0
+
+average_queue_time: float = 0.0
+shed: int = 0
+dropped: int = 0
+
+
+""" START OF SUPPORT METHODS """
+
+
+# Chat and input of an update: the callback data of a tapped button or the text of a message
+def input_key(update: object) -> tuple | None:
+    if not isinstance(update, Update) or update.effective_chat is None:
+        return None
+    if update.callback_query is not None:
+        return update.effective_chat.id, 'callback', update.callback_query.data
+    if update.message is not None:
+        return update.effective_chat.id, 'text', update.message.text
+    return None
+
+
+# Record that an update has arrived and is waiting to be handled, and mark it if it repeats an input still waiting
+# or still being handled by a guarded action. Recording the same update again has no effect.
+def arrived(update: object, arrived_at: float | None = None) -> None:
+    global last_queued_id
+
+    if not isinstance(update, Update) or update.update_id in arrivals:
+        return
+    last_queued_id = max(last_queued_id, update.update_id)
+    arrivals[update.update_id] = time.monotonic() if arrived_at is None else arrived_at
+    key = input_key(update)
+    if key is not None:
+        if queued_inputs.get(key) or key in pending_inputs:
+            duplicates.add(update.update_id)
+        queued_inputs[key] = queued_inputs.get(key, 0) + 1
+
+
+# Forget a queued update, returns when it arrived (None if it was not recorded).
+# Called when the update is handled, or taken out of the queue without being handled.
+def forget(update: Update) -> float | None:
+    arrived_at = arrivals.pop(update.update_id, None)
+    if arrived_at is None:
+        return None
+
+    key = input_key(update)
+    if key is not None:
+        queued_inputs[key] -= 1
+        if not queued_inputs[key]:
+            del queued_inputs[key]
+    return arrived_at
+
+
+# Application update queue that records each update as it is queued by the updater
+class AdmissionQueue(asyncio.Queue):
+    def put_nowait(self, item: object) -> None:
+        arrived(item)
+        super().put_nowait(item)
+
+    async def put(self, item: object) -> None:
+        arrived(item)
+        await super().put(item)
+
+
+# Busy threshold of an endpoint, following its measured backend latency
+class Gate:
+    def __init__(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        self.latency = 0.0
+
+    # Longest acceptable queueing delay, a few round trips of the endpoint
+    def threshold(self) -> float:
+        return min(ADMISSION_MAX_WAIT, max(ADMISSION_MIN_WAIT, ADMISSION_WAIT_FACTOR * self.latency))
+
+    # Whether a request that has already waited this long should be turned away
+    def should_shed(self, waited: float) -> bool:
+        return waited > self.threshold()
+
+    def record_latency(self, seconds: float) -> None:
+        self.latency = seconds if self.latency == 0.0 else self.latency + EWMA_WEIGHT * (seconds - self.latency)
+
+
+gates: dict[str, Gate] = {}
+
+
+# Tell the user to try again, without touching the backend
+async def reply_busy(update: Update) -> None:
+    if update.callback_query is not None:
+        await update.callback_query.answer(BUSY_MESSAGE)
+    elif update.message is not None:
+        await update.message.reply_text(BUSY_MESSAGE)
+
+
+# Queueing delay, shedding and duplicate counts, and per-endpoint backend latency
+def report() -> str:
+    lines = [f"Admission | average queue time {average_queue_time * 1000:.0f} ms, {shed} shed, {dropped} dropped"]
+    for gate in gates.values():
+        lines.append(f"  {gate.endpoint}: latency {gate.latency * 1000:.0f} ms, "
+                     f"threshold {gate.threshold() * 1000:.0f} ms")
+    return "\n".join(lines)
+
+
+""" END OF SUPPORT METHODS """
+
+""" START OF BOT METHODS """
+
+
+# Group -4 handler: measures how long the update was queued and drops repeated taps of an input still in the queue,
+# or still being handled
+async def admit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    global average_queue_time, dropped
+
+    arrived_at = forget(update)
+    if arrived_at is None:
+        return
+
+    waited = time.monotonic() - arrived_at
+    queue_time.set(waited)
+    average_queue_time += EWMA_WEIGHT * (waited - average_queue_time)
+
+    if update.update_id in duplicates or input_key(update) in pending_inputs:
+        duplicates.discard(update.update_id)
+        dropped += 1
+        if update.callback_query is not None:
+            await update.callback_query.answer()
+        raise ApplicationHandlerStop
+
+
+# Decorator for controller actions that call the backend endpoint.
+# Requests are turned away with a busy reply once the update has queued for longer than a few backend round trips
+# of the endpoint, and the conversation stays in its current state. Until the action finishes, its chat and input
+# are marked pending, so that repeats of the input arriving meanwhile are dropped by admit. Only the time spent in
+# api.get counts towards the endpoint's latency, not the replies sent to Telegram.
+def guard(endpoint: str):
+    gate = gates.setdefault(endpoint, Gate(endpoint))
+
+    def decorator(action):
+        @functools.wraps(action)
+        async def guarded(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            global shed
+
+            if gate.should_shed(queue_time.get()):
+                shed += 1
+                logger.warning(f"Shedding [{endpoint}] for [{update.effective_chat.id}] | "
+                               f"queued {queue_time.get() * 1000:.0f} ms, threshold {gate.threshold() * 1000:.0f} ms")
+                await reply_busy(update)
+                return None
+
+            key = input_key(update)
+            if key is not None:
+                pending_inputs.add(key)
+            backend_time = [0.0]
+            token = api.backend_time.set(backend_time)
+            try:
+                return await action(update, context)
+            finally:
+                pending_inputs.discard(key)
+                api.backend_time.reset(token)
+                if backend_time[0]:
+                    gate.record_latency(backend_time[0])
+
+        return guarded
+
+    return decorator
+
+
+""" END OF BOT METHODS """
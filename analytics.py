@@ -0,0 +1,130 @@
+import asyncio
+import contextvars
+import logging
+import os
+import struct
+import time
+
+from telegram.ext import Application
+
+import constants
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+ANALYTICS_PATH = os.getenv('ANALYTICS_PATH', os.path.join(constants.CACHE_DIR, 'analytics.bin'))
+ANALYTICS_BUFFER_SIZE = int(os.getenv('ANALYTICS_BUFFER_SIZE', 8192))
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', 5))
+
+""" Analytics event log format
+
+    header   <4sHH      magic b'DHAE', format version, record size
+    records  <dq16shhIf per event: unix time, chat ID, flow name (UTF-8, NUL-padded), state before, state after,
+                        clinic ID (0 if none), handler latency in milliseconds
+
+Records are fixed-size and only ever appended, so the file can be read while the bot is writing to it, and loads
+directly as a numpy structured array (see analytics_report.py).
+"""
+
+MAGIC: bytes = b'DHAE'
+VERSION: int = 1
+HEADER = struct.Struct('<4sHH')
+RECORD = struct.Struct('<dq16shhIf')
+
+# State recorded for updates handled by a flow's entry points and fallbacks, which run outside any one state
+# (-1 is ConversationHandler.END, recorded as the state after an update that left the flow)
+ENTRY: int = -2
+FALLBACK: int = -3
+
+# Preallocated ring of ANALYTICS_BUFFER_SIZE records; record() packs into it, flush() drains it
+buffer = bytearray(RECORD.size * ANALYTICS_BUFFER_SIZE)
+head: int = 0
+pending: int = 0
+dropped: int = 0
+written: int = 0
+
+# Clinic IDs fit the record's unsigned 32-bit field; anything else typed by a user is recorded as 0 (no clinic)
+MAX_CLINIC_ID: int = 2 ** 32 - 1
+
+# Clinic the current update is about, set by controllers with note_clinic()
+clinic_id: contextvars.ContextVar[int] = contextvars.ContextVar('clinic_id', default=0)
+
+
+""" START OF RECORDING METHODS """
+
+
+# Tag the event of the update being handled with a clinic ID
+def note_clinic(value: int) -> None:
+    clinic_id.set(value if 0 <= value <= MAX_CLINIC_ID else 0)
+
+
+# Record one event: packs it into the ring without allocating a buffer or blocking.
+# When the ring is full the oldest unflushed event is overwritten and counted as dropped.
+def record(chat_id: int, flow_name: bytes, from_state: int, to_state: int, clinic: int, latency_ms: float) -> None:
+    global head, pending, dropped
+
+    if not 0 <= clinic <= MAX_CLINIC_ID:
+        clinic = 0
+    RECORD.pack_into(buffer, head * RECORD.size, time.time(), chat_id, flow_name, from_state, to_state, clinic,
+                     latency_ms)
+    head = (head + 1) % ANALYTICS_BUFFER_SIZE
+    if pending == ANALYTICS_BUFFER_SIZE:
+        dropped += 1
+    else:
+        pending += 1
+
+
+# Take the pending events out of the ring, oldest first
+def drain() -> bytes:
+    global pending
+
+    start = (head - pending) % ANALYTICS_BUFFER_SIZE
+    if start + pending <= ANALYTICS_BUFFER_SIZE:
+        data = bytes(buffer[start * RECORD.size:(start + pending) * RECORD.size])
+    else:
+        data = bytes(buffer[start * RECORD.size:]) + bytes(buffer[:head * RECORD.size])
+    pending = 0
+    return data
+
+
+""" END OF RECORDING METHODS """
+
+""" START OF FLUSH METHODS """
+
+
+# Append records to ANALYTICS_PATH, writing the header first if the file is new
+def append(data: bytes) -> None:
+    os.makedirs(os.path.dirname(ANALYTICS_PATH) or '.', exist_ok=True)
+    with open(ANALYTICS_PATH, 'ab') as f:
+        if f.tell() == 0:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        f.write(data)
+
+
+# Write the pending events in one batch, off the event loop
+async def flush() -> int:
+    global written
+
+    if not pending:
+        return 0
+
+    count = pending
+    data = drain()
+    try:
+        await asyncio.to_thread(append, data)
+    except OSError as exc:
+        logger.warning(f"Could not write {count} analytics events: {exc!r}")
+        return 0
+
+    written += count
+    return count
+
+
+# Flush the ring every ANALYTICS_FLUSH_INTERVAL seconds
+async def flush_periodically(application: Application) -> None:
+    while True:
+        await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL)
+        await flush()
+
+
+""" END OF FLUSH METHODS """
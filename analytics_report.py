@@ -0,0 +1,122 @@
+import argparse
+import glob
+import os
+import struct
+
+from collections import Counter, defaultdict
+
+import numpy as np
+
+""" Offline report over the analytics event logs written by analytics.py
+
+    python analytics_report.py [paths ...]
+
+Without paths, reads .cache/analytics.bin and the per-shard .cache/analytics.bin.<n> files.
+"""
+
+MAGIC: bytes = b'DHAE'
+HEADER = struct.Struct('<4sHH')
+# Same layout as analytics.RECORD
+DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('chat', '<i8'),
+    ('flow', 'S16'),
+    ('from_state', '<i2'),
+    ('to_state', '<i2'),
+    ('clinic', '<u4'),
+    ('latency', '<f4')
+])
+
+ENTRY: int = -2
+FALLBACK: int = -3
+END: int = -1
+
+
+# Load one event log as a structured array
+def read(path: str) -> np.ndarray:
+    with open(path, 'rb') as f:
+        magic, _, record_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or record_size != DTYPE.itemsize:
+            raise ValueError(f"{path} is not an analytics event log")
+        data = f.read()
+    # A write may be in progress at the end of the file
+    return np.frombuffer(data[:len(data) - len(data) % DTYPE.itemsize], dtype=DTYPE)
+
+
+# Per flow: sessions started, sessions reaching each state, and where unfinished sessions stopped
+def funnels(events: np.ndarray) -> dict[str, dict]:
+    report = defaultdict(lambda: {'sessions': 0, 'completed': 0, 'reached': Counter(), 'abandoned': Counter()})
+    # (chat, flow) -> states of the open session, in order
+    open_sessions: dict[tuple[int, bytes], list[int]] = {}
+
+    def close(key: tuple[int, bytes], states: list[int]) -> None:
+        flow = report[key[1].decode()]
+        flow['sessions'] += 1
+        flow['reached'].update(set(states))
+        if states[-1] == END:
+            flow['completed'] += 1
+        else:
+            flow['abandoned'][states[-1]] += 1
+
+    for event in events[np.argsort(events['time'], kind='stable')]:
+        key = (int(event['chat']), bytes(event['flow']))
+        if event['from_state'] == ENTRY:
+            if key in open_sessions:
+                close(key, open_sessions.pop(key))
+            open_sessions[key] = []
+        if key not in open_sessions:
+            continue
+
+        open_sessions[key].append(int(event['to_state']))
+        if event['to_state'] == END:
+            close(key, open_sessions.pop(key))
+
+    for key, states in open_sessions.items():
+        close(key, states)
+    return report
+
+
+# Most viewed clinics per flow
+def popular_clinics(events: np.ndarray, top: int) -> dict[str, list[tuple[int, int]]]:
+    report = {}
+    tagged = events[events['clinic'] > 0]
+    for flow in np.unique(tagged['flow']):
+        clinics, counts = np.unique(tagged['clinic'][tagged['flow'] == flow], return_counts=True)
+        order = np.argsort(-counts, kind='stable')[:top]
+        report[flow.decode()] = [(int(clinics[i]), int(counts[i])) for i in order]
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Funnels, popular clinics and handler latency from analytics logs.")
+    parser.add_argument('paths', nargs='*')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    cache_dir = os.getenv('BOT_CACHE_DIR', '.cache')
+    paths = args.paths or sorted(glob.glob(os.path.join(cache_dir, 'analytics.bin*')))
+    if not paths:
+        parser.error("no analytics logs found")
+
+    events = np.concatenate([read(path) for path in paths])
+    print(f"{len(events)} events from {len(paths)} file(s)")
+
+    for flow, funnel in sorted(funnels(events).items()):
+        print(f"\n{flow}: {funnel['sessions']} sessions, {funnel['completed']} closed by the user")
+        for state, count in sorted(funnel['reached'].items(), key=lambda item: -item[1]):
+            label = "END" if state == END else f"state {state}"
+            print(f"  reached {label:<10} {count:6d}  {count / funnel['sessions']:6.1%}")
+        for state, count in funnel['abandoned'].most_common():
+            print(f"  left at state {state:<4} {count:6d}  {count / funnel['sessions']:6.1%}")
+
+        latency = events['latency'][events['flow'] == flow.encode()]
+        print(f"  handler latency p50 {np.percentile(latency, 50):.1f} ms, p95 {np.percentile(latency, 95):.1f} ms")
+
+    for flow, clinics in sorted(popular_clinics(events, args.top).items()):
+        print(f"\nPopular clinics in {flow}:")
+        for clinic_id, count in clinics:
+            print(f"  {clinic_id:>6}  {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import asyncio
+import contextvars
+import logging
+import time
+
+import constants
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+API_BASE_URL = constants.API_BASE_URL
+WEBSITE = constants.WEBSITE
+
+# Shared HTTP session, created on first use so that importing requests does not delay startup
+_session = None
+# ETag / Last-Modified of the last 200 response per URI, sent back by conditional_get
+validators: dict[str, dict[str, str]] = {}
+# Seconds spent in get, added up for the action being timed by admission.guard
+backend_time: contextvars.ContextVar[list[float] | None] = contextvars.ContextVar('backend_time', default=None)
+
+
+# Get (or lazily create) the shared HTTP session
+def get_session():
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
+
+# Send a GET request to the DHRMS backend, relative to API_BASE_URL
+def get(uri: str, **kwargs):
+    started_at = time.monotonic()
+    try:
+        with tracing.span(f"GET /{tracing.redact(uri)}", tracing.KIND_CLIENT) as span:
+            result = get_session().get(f"{API_BASE_URL}/{uri}", **kwargs)
+            if span is not None:
+                span.set('http.response.status_code', result.status_code)
+                if result.status_code >= 500:
+                    span.fail(f"HTTP {result.status_code}")
+            return result
+    finally:
+        elapsed = backend_time.get()
+        if elapsed is not None:
+            elapsed[0] += time.monotonic() - started_at
+
+
+# GET that the backend may answer with 304 Not Modified (and no body) if the resource is unchanged since the last 200
+def conditional_get(uri: str, **kwargs):
+    headers = dict(kwargs.pop('headers', None) or {})
+    cached = validators.get(uri, {})
+    if 'ETag' in cached:
+        headers['If-None-Match'] = cached['ETag']
+    if 'Last-Modified' in cached:
+        headers['If-Modified-Since'] = cached['Last-Modified']
+
+    result = get(uri, headers=headers, **kwargs)
+    if result.status_code == 200:
+        validators[uri] = {name: result.headers[name] for name in ('ETag', 'Last-Modified') if name in result.headers}
+    return result
+
+
+# Body size of a response as transferred, i.e. before decompression when the server sent Content-Length
+def response_size(result) -> int:
+    return int(result.headers.get('Content-Length', len(result.content)))
+
+
+""" START OF STARTUP TASKS
+
+The following coroutines are registered with helpers.post_init and run concurrently when the bot starts.
+"""
+
+
+# Check that the DHRMS website is reachable
+async def health_check() -> None:
+    result = await asyncio.to_thread(get_session().head, WEBSITE, timeout=30)
+    logger.info(f"Backend health check | HTTP {result.status_code}")
+
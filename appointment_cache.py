@@ -0,0 +1,107 @@
+import hashlib
+import hmac
+import logging
+import os
+
+from cachetools import TTLCache
+
+import api
+import validation
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+APPOINTMENT_CACHE_TTL = float(os.getenv('APPOINTMENT_CACHE_TTL', 120))
+APPOINTMENT_CACHE_SIZE = int(os.getenv('APPOINTMENT_CACHE_SIZE', 1000))
+# Without a configured salt, a random one per process still keeps NRICs out of memory dumps and logs
+NRIC_HASH_SALT: bytes = os.getenv('NRIC_HASH_SALT', '').encode() or os.urandom(16)
+
+# Fields of an upcoming appointment that the list view needs, nothing else is cached
+LIST_FIELDS = ('apptId', 'startDateTime', 'firstName', 'lastName')
+
+# Per-chat entry: {'nric': salted hash, 'upcoming': [...], 'details': {apptId: {...}}}
+cache: TTLCache = TTLCache(maxsize=APPOINTMENT_CACHE_SIZE, ttl=APPOINTMENT_CACHE_TTL)
+hits: int = 0
+misses: int = 0
+
+
+# Salted hash of an NRIC, the only form in which an NRIC is kept
+def hash_nric(nric: str) -> str:
+    return hmac.new(NRIC_HASH_SALT, nric.strip().upper().encode(), hashlib.sha256).hexdigest()
+
+
+# Upcoming appointments for an NRIC, served from the chat's cache entry while it is fresh. Returns None if the backend
+# could not be asked; only a definitive answer (200, or 404 for an unknown NRIC) is cached.
+def get_upcoming(chat_id: int, nric: str) -> list[dict] | None:
+    global hits, misses
+
+    digest = hash_nric(nric)
+    entry = cache.get(chat_id)
+    if entry is not None and entry['nric'] == digest:
+        hits += 1
+        return entry['upcoming']
+
+    misses += 1
+    upcoming = []
+    if not validation.is_known_empty('nric', digest):
+        try:
+            result = api.get(f"appointment/get/all/upcoming/nric/{nric}")
+        # requests' exceptions derive from OSError, so requests (imported lazily by api) is not needed here
+        except OSError as exc:
+            logger.warning(f"Upcoming appointments lookup failed: {exc!r}")
+            return None
+        if result.status_code == 200:
+            upcoming = [{field: appt.get(field) for field in LIST_FIELDS} for appt in result.json()]
+        elif result.status_code != 404:
+            logger.warning(f"Upcoming appointments lookup failed | HTTP {result.status_code}")
+            return None
+        if not upcoming:
+            validation.remember_empty('nric', digest)
+
+    cache[chat_id] = {'nric': digest, 'upcoming': upcoming, 'details': {}}
+    return upcoming
+
+
+# Details of one appointment, cached alongside the chat's appointment list. Returns None if they could not be fetched.
+def get_details(chat_id: int, appt_id: str) -> dict | None:
+    global hits, misses
+
+    entry = cache.get(chat_id)
+    if entry is not None and appt_id in entry['details']:
+        hits += 1
+        return entry['details'][appt_id]
+
+    misses += 1
+    try:
+        result = api.get(f"appointment/get/{appt_id}")
+    except OSError as exc:
+        logger.warning(f"Appointment [{appt_id}] lookup failed: {exc!r}")
+        return None
+    if result.status_code != 200:
+        logger.warning(f"Appointment [{appt_id}] lookup failed | HTTP {result.status_code}")
+        return None
+
+    details = result.json()
+    if entry is not None:
+        entry['details'][appt_id] = details
+    return details
+
+
+# Forget everything cached for a chat, called when the user leaves the flow
+def invalidate(chat_id: int) -> bool:
+    return cache.pop(chat_id, None) is not None
+
+
+# Forget cached appointments of the given NRICs (by salted hash) or containing the given appointment IDs,
+# returns the number of chats affected
+def invalidate_changed(nric_digests: set[str], appt_ids: set[str]) -> int:
+    for digest in nric_digests:
+        validation.negative_cache.pop(('nric', digest), None)
+
+    stale = [chat_id for chat_id, entry in cache.items()
+             if entry['nric'] in nric_digests
+             or not appt_ids.isdisjoint(entry['details'])
+             or any(str(appt.get('apptId')) in appt_ids for appt in entry['upcoming'])]
+    for chat_id in stale:
+        cache.pop(chat_id, None)
+    return len(stale)
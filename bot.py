@@ -1,7 +1,11 @@
 import logging
+import re
 
 import constants
 import helpers
+import profiler
+import state_backend
+import tracing
 
 import Controllers.FindClinic as FindClinic
 import Controllers.GetAppointments as GetAppointments
@@ -21,10 +25,6 @@ from telegram.ext import (
     ContextTypes, ConversationHandler, CallbackContext, MessageHandler, filters
 )
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Essential Info
@@ -33,12 +33,37 @@ BOT_NAME = constants.BOT_NAME
 WEBSITE = constants.WEBSITE
 STATES = constants.States
 
+# /start deep-link payloads, e.g. t.me/<bot>?start=queue_12 in a QR code at a clinic counter
+DEEP_LINK_PATTERN = re.compile(r"(queue|clinic)_[0-9]+|faq")
+DEEP_LINKS = {
+    "queue": (GetClinicQueue.FLOW, GetClinicQueue.clinic_details),
+    "clinic": (FindClinic.FLOW, FindClinic.clinic_details),
+    "faq": (ViewFAQ.FLOW, ViewFAQ.start)
+}
+FLOWS = [GetAppointments.FLOW, GetClinicQueue.FLOW, FindClinic.FLOW, ViewFAQ.FLOW]
+
+
+# Open the flow named by a /start deep link straight at its view, returns False if the payload is not a deep link
+async def follow_deep_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    if not context.args or not DEEP_LINK_PATTERN.fullmatch(context.args[0]):
+        return False
+
+    logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | Deep link [{context.args[0]}]")
+    # A deep link may arrive in the middle of another flow, which is left behind
+    for flow in FLOWS:
+        flow.leave(update)
+
+    flow, action = DEEP_LINKS[context.args[0].partition('_')[0]]
+    return await flow.open(action, update, context) is not None
+
 
 # Sends a message with inline buttons attached.
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     query = update.callback_query
     if query is not None:
         await query.answer()
+    elif await follow_deep_link(update, context):
+        return STATES.SELECTING_ACTION
 
     keyboard = [
         [InlineKeyboardButton("Check Upcoming Appointments", callback_data=str(STATES.GET_APPOINTMENTS))],
@@ -97,7 +122,8 @@ async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return STATES.END
 
 # Conversation Handler for [START]
-CONV_HANDLER: ConversationHandler[CallbackContext] = ConversationHandler(
+CONV_HANDLER: ConversationHandler[CallbackContext] = state_backend.SharedConversationHandler(
+    name="Start",
     entry_points=[CommandHandler("start", start)],
     states={
         STATES.SELECTING_ACTION: [
@@ -105,6 +131,8 @@ CONV_HANDLER: ConversationHandler[CallbackContext] = ConversationHandler(
             GetClinicQueue.GET_CLINIC_QUEUE_CONV_HANDLER,
             FindClinic.FIND_CLINICS_CONV_HANDLER,
             ViewFAQ.VIEW_FAQ_CONV_HANDLER,
+            # Deep links also work in the middle of a conversation, e.g. when scanning a second QR code
+            CommandHandler("start", start, filters.Regex(rf"^/start ({DEEP_LINK_PATTERN.pattern})$")),
             CallbackQueryHandler(button)
         ]
     },
@@ -113,6 +141,10 @@ CONV_HANDLER: ConversationHandler[CallbackContext] = ConversationHandler(
         STATES.END: ConversationHandler.END
     }
 )
+# Updates are sampled into cProfile only while an admin has /profile switched on
+profiler.instrument(CONV_HANDLER)
+# Every update gets a trace; only slow or failed ones are written out
+tracing.instrument(CONV_HANDLER)
 
 
 def main() -> None:
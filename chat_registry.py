@@ -0,0 +1,91 @@
+import bisect
+import logging
+import os
+import struct
+
+from array import array
+from typing import Iterator
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import constants
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+CHAT_REGISTRY_PATH = os.getenv('CHAT_REGISTRY_PATH', os.path.join(constants.CACHE_DIR, 'chats.bin'))
+
+# Every known chat is one little-endian int64 in the registry file, in the order it was first seen
+RECORD = struct.Struct('<q')
+
+# Sorted copy of the registry for membership checks, 8 bytes per chat
+known_chats: array = array('q')
+loaded: bool = False
+# Chats seen before the registry was loaded (load runs in the background at startup), added once it is
+seen_before_load: set[int] = set()
+
+
+# Load the registry file into memory
+async def load() -> None:
+    global known_chats, loaded
+
+    chats = array('q')
+    if os.path.isfile(CHAT_REGISTRY_PATH):
+        with open(CHAT_REGISTRY_PATH, 'rb') as f:
+            data = f.read()
+        # A torn final record from a crash mid-write is ignored
+        chats.frombytes(data[:len(data) - len(data) % RECORD.size])
+
+    known_chats = array('q', sorted(set(chats)))
+    loaded = True
+    new_chats = sum(add(chat_id) for chat_id in seen_before_load)
+    seen_before_load.clear()
+    logger.info(f"Chat registry loaded | {len(known_chats)} chats, {new_chats} new while loading")
+
+
+# Record a chat, returns True if it was not known before
+def add(chat_id: int) -> bool:
+    position = bisect.bisect_left(known_chats, chat_id)
+    if position < len(known_chats) and known_chats[position] == chat_id:
+        return False
+
+    known_chats.insert(position, chat_id)
+    os.makedirs(os.path.dirname(CHAT_REGISTRY_PATH) or '.', exist_ok=True)
+    with open(CHAT_REGISTRY_PATH, 'ab') as f:
+        f.write(RECORD.pack(chat_id))
+    return True
+
+
+# Number of recipients a broadcast will go through
+def count() -> int:
+    if not os.path.isfile(CHAT_REGISTRY_PATH):
+        return 0
+    return os.path.getsize(CHAT_REGISTRY_PATH) // RECORD.size
+
+
+# Stream (position, chat_id) pairs from the registry file, starting at position, without loading it all
+def stream(start: int = 0, chunk_size: int = 1024) -> Iterator[tuple[int, int]]:
+    if not os.path.isfile(CHAT_REGISTRY_PATH):
+        return
+
+    with open(CHAT_REGISTRY_PATH, 'rb') as f:
+        f.seek(start * RECORD.size)
+        position = start
+        while True:
+            data = f.read(chunk_size * RECORD.size)
+            if len(data) < RECORD.size:
+                return
+            for (chat_id,) in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+                yield position, chat_id
+                position += 1
+
+
+# Handler that records the chat of every update
+async def record(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_chat is None:
+        return
+    if loaded:
+        add(update.effective_chat.id)
+    else:
+        seen_before_load.add(update.effective_chat.id)
@@ -0,0 +1,476 @@
+import asyncio
+import bisect
+import logging
+import os
+import re
+import time
+
+from collections import deque
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+import telegram
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import Application
+
+import api
+import clinic_snapshot
+import constants
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+CLINIC_REFRESH_INTERVAL = float(os.getenv('CLINIC_REFRESH_INTERVAL', 300))
+CLINIC_DETAIL_TTL = float(os.getenv('CLINIC_DETAIL_TTL', 3600))
+CLINIC_SNAPSHOT_PATH = os.getenv('CLINIC_SNAPSHOT_PATH', os.path.join(constants.CACHE_DIR, 'clinics.snapshot'))
+# Changed-since query, e.g. "clinic/get/changed/{since}" with since in unix seconds; empty if the backend has none
+CLINIC_DELTA_URI = os.getenv('CLINIC_DELTA_URI', '')
+# Queue counts pushed by the backend are served without a backend call for this long
+PUSHED_QUEUE_TTL = float(os.getenv('PUSHED_QUEUE_TTL', 300))
+
+# Telegram returns at most 50 inline results
+MAX_RESULTS: int = 50
+# Seconds by which changed-since queries overlap the previous sync: applying a change twice is harmless, missing one is not
+DELTA_OVERLAP: int = 5
+
+# In-memory directory, replaced as a whole on every refresh
+clinics: dict[int, dict] = {}
+# Detail records from /api/clinic/get/{id}, with the time they were fetched
+details: dict[int, tuple[float, dict]] = {}
+# Set when detail records changed since the last snapshot, so they are saved even when the clinic list has not
+details_changed: bool = False
+# Inline results are built on first use after each refresh, then reused
+clinic_articles: dict[int, InlineQueryResultArticle] = {}
+queue_articles: dict[int, InlineQueryResultArticle] = {}
+# Latest queue count pushed per clinic: (time received, clinic name, count)
+pushed_queue_counts: dict[int, tuple[float, str, int | None]] = {}
+postal_index: list[tuple[str, int]] = []
+name_index: list[tuple[str, int]] = []
+refreshed_at: float = 0.0
+background_tasks: set[asyncio.Task] = set()
+# Backend time of the last successful sync, used as the next changed-since value
+synced_at: int | None = None
+delta_supported: bool = bool(CLINIC_DELTA_URI)
+# Mode, HTTP status, bytes transferred, seconds taken and clinics changed of recent refresh cycles
+refresh_stats: deque[dict] = deque(maxlen=100)
+
+
+""" START OF FORMATTING METHODS """
+
+
+# Escape the characters used by clinic fields for MarkdownV2
+def escape(text: object) -> str:
+    return str(text).replace('.', '\.').replace('-', '\-').replace('(', '\(').replace(')', '\)').replace('_', '\_')
+
+
+# Clinic details message, as shown by FindClinic
+def format_clinic_details(clinic_dict: dict) -> str:
+    clinic_info_msg = "*" + escape(clinic_dict.get('clinicName')) + "*"
+    clinic_info_msg += f"\n\n*Clinic ID:* {clinic_dict.get('clinicId')}"
+    clinic_info_msg += "\n*Clinic Address:* " + escape(clinic_dict.get('clinicAddress'))
+    clinic_info_msg += "\n*Unit No\.:* \#" + escape(clinic_dict.get('clinicUnit'))
+    clinic_info_msg += f"\n*Postal:* {clinic_dict.get('clinicPostal')}"
+    clinic_info_msg += "\n*Email:* " + escape(clinic_dict.get('clinicEmail'))
+    if clinic_dict.get('clinicSubEmail') is not None:
+        clinic_info_msg += "\n*Secondary Email:* " + escape(clinic_dict.get('clinicSubEmail'))
+    else:
+        clinic_info_msg += "\n*Secondary Email:* N/A"
+    clinic_info_msg += f"\n*Phone:* \+65 {clinic_dict.get('clinicPhone')}"
+    if clinic_dict.get('clinicSubEmail') is not None:
+        clinic_info_msg += f"\n*Secondary Phone:* \+65 {clinic_dict.get('clinicSubPhone')}"
+    else:
+        clinic_info_msg += "\n*Secondary Phone:* N/A"
+    return clinic_info_msg
+
+
+# Colour band of a queue count, and what it means
+def queue_band(count: int | None) -> tuple[str, str]:
+    if count is None or count < 5:
+        return "🟢", "SHORT WAITING TIME"
+    elif count < 10:
+        return "🟡", "MODERATE WAITING TIME"
+    else:
+        return "🔴", "LONG WAITING TIME"
+
+
+# Queue status message, as shown by GetClinicQueue
+def format_queue_status(clinic_name: str, count: int | None) -> str:
+    queue_info_msg = "*" + escape(clinic_name) + "*"
+
+    colour, meaning = queue_band(count)
+    queue_info_msg += f"\n\n{colour} *{meaning}* {colour}"
+
+    queue_info_msg += f"\n\nCurrently in Queue: *{count if count is not None else 'None'}*"
+    return queue_info_msg
+
+
+# Ranked queue message, one line per clinic: (clinic ID, count, km or None)
+def format_queue_ranking(ranking: list[tuple[int, int, float | None]], postal_code: int | None,
+                         no_count: int = 0, no_location: int = 0) -> str:
+    if postal_code is not None:
+        queue_info_msg = f"*SHORTEST QUEUES NEAR {postal_code:06d}* 📍"
+    else:
+        queue_info_msg = "*SHORTEST QUEUES* ⏱"
+
+    for position, (clinic_id, count, km) in enumerate(ranking, start=1):
+        clinic = clinics.get(clinic_id, {})
+        queue_info_msg += f"\n\n{position}\. {queue_band(count)[0]} *{escape(clinic.get('clinicName'))}*"
+        queue_info_msg += f"\nIn Queue: *{count}*"
+        if km is not None:
+            queue_info_msg += f" \| About {km:.0f} km away" if km >= 1 else " \| Less than 1 km away"
+
+    if not ranking:
+        queue_info_msg += "\n\nQueue status is not available right now\. Please try again later\."
+
+    left_out = []
+    if no_count:
+        left_out.append(f"{no_count} with no queue status available")
+    if no_location:
+        left_out.append(f"{no_location} whose location is unknown")
+    if left_out:
+        queue_info_msg += f"\n\n_Not ranked: {' and '.join(left_out)}\. Use List All Clinics to check them\._"
+    return queue_info_msg
+
+
+""" END OF FORMATTING METHODS """
+
+""" START OF INDEX METHODS """
+
+
+# Search index entries of a clinic: its postal code and the words of its name
+def _index_entries(clinic_id: int, clinic: dict) -> tuple[tuple[str, int], list[tuple[str, int]]]:
+    tokens = set(re.findall(r"\w+", str(clinic.get('clinicName', '')).lower()))
+    return (str(clinic.get('clinicPostal', '')), clinic_id), [(token, clinic_id) for token in tokens]
+
+
+# Rebuild the directory and its search indexes from the clinic list
+def load(clinic_list: list[dict]) -> None:
+    global clinics, clinic_articles, postal_index, name_index, refreshed_at
+
+    new_clinics = {int(clinic['clinicId']): clinic for clinic in clinic_list}
+    new_postal_index, new_name_index = [], []
+    for clinic_id, clinic in new_clinics.items():
+        postal_entry, name_entries = _index_entries(clinic_id, clinic)
+        new_postal_index.append(postal_entry)
+        new_name_index += name_entries
+    new_postal_index.sort()
+    new_name_index.sort()
+    # Swap references only once everything is built, so lookups never see a half-built index
+    clinics, postal_index, name_index, clinic_articles = new_clinics, new_postal_index, new_name_index, {}
+    refreshed_at = time.time()
+
+
+# Remove one entry from a sorted index
+def _remove_entry(index: list[tuple[str, int]], entry: tuple[str, int]) -> None:
+    position = bisect.bisect_left(index, entry)
+    if position < len(index) and index[position] == entry:
+        del index[position]
+
+
+# Drop a clinic's search index entries and everything built from it
+def _unindex(clinic_id: int) -> None:
+    clinic = clinics[clinic_id]
+    postal_entry, name_entries = _index_entries(clinic_id, clinic)
+    _remove_entry(postal_index, postal_entry)
+    for entry in name_entries:
+        _remove_entry(name_index, entry)
+    clinic_articles.pop(clinic_id, None)
+    details.pop(clinic_id, None)
+
+
+# Whether a clinic differs from the directory's copy, ignoring fields merged in from its detail record
+def _is_changed(clinic: dict) -> bool:
+    current = clinics.get(int(clinic['clinicId']))
+    return current is None or any(current.get(field) != value for field, value in clinic.items())
+
+
+# Changed and deleted clinics between the directory and a full clinic list
+def diff(clinic_list: list[dict]) -> tuple[list[dict], list[int]]:
+    listed = {int(clinic['clinicId']) for clinic in clinic_list}
+    return [clinic for clinic in clinic_list if _is_changed(clinic)], [clinic_id for clinic_id in clinics if clinic_id not in listed]
+
+
+# Update the directory in place with changed and deleted clinics only, returns the number of clinics affected
+def apply_diff(changed: list[dict], deleted: list[int]) -> int:
+    global refreshed_at
+
+    affected = 0
+    for clinic_id in deleted:
+        if clinic_id in clinics:
+            _unindex(clinic_id)
+            del clinics[clinic_id]
+            affected += 1
+
+    for clinic in changed:
+        clinic_id = int(clinic['clinicId'])
+        if not _is_changed(clinic):
+            continue
+        if clinic_id in clinics:
+            _unindex(clinic_id)
+        clinics[clinic_id] = clinic
+        postal_entry, name_entries = _index_entries(clinic_id, clinic)
+        bisect.insort(postal_index, postal_entry)
+        for entry in name_entries:
+            bisect.insort(name_index, entry)
+        affected += 1
+
+    if affected:
+        refreshed_at = time.time()
+    return affected
+
+
+# Inline result for a clinic, built once per refresh
+def clinic_article(clinic_id: int) -> InlineQueryResultArticle:
+    article = clinic_articles.get(clinic_id)
+    if article is None:
+        clinic = clinics[clinic_id]
+        article = clinic_articles[clinic_id] = InlineQueryResultArticle(
+            id=f"clinic-{clinic_id}",
+            title=str(clinic.get('clinicName')),
+            description=f"{clinic.get('clinicAddress', '')} S({clinic.get('clinicPostal', '')})",
+            input_message_content=InputTextMessageContent(format_clinic_details(get_cached_details(clinic_id) or clinic),
+                                                          parse_mode=telegram.constants.ParseMode.MARKDOWN_V2)
+        )
+    return article
+
+
+# "<id>. <name>" keyboard rows for every clinic, as used by the list views
+def keyboard_rows() -> list[list[str]]:
+    return [[f"{clinic_id}. {clinic.get('clinicName')}"] for clinic_id, clinic in clinics.items()]
+
+
+# Detail record if one has been fetched (or loaded from the snapshot), without calling the backend
+def get_cached_details(clinic_id: int) -> dict | None:
+    entry = details.get(clinic_id)
+    return entry[1] if entry is not None else None
+
+
+# Fetch and remember a clinic's detail record
+def fetch_details(clinic_id: int) -> dict | None:
+    result = api.get(f"clinic/get/{clinic_id}")
+    if result.status_code != 200:
+        return None
+
+    record = result.json()
+    set_details(clinic_id, record)
+    return record
+
+
+# Remember a clinic's detail record, to be saved with the next snapshot
+def set_details(clinic_id: int, record: dict) -> None:
+    global details_changed
+
+    details[clinic_id] = (time.time(), record)
+    clinic_articles.pop(clinic_id, None)
+    details_changed = True
+
+
+# Detail record for a clinic: cached records are served immediately and refreshed in the background once stale
+def get_details(clinic_id: int) -> dict | None:
+    entry = details.get(clinic_id)
+    if entry is None:
+        return fetch_details(clinic_id)
+
+    if time.time() - entry[0] > CLINIC_DETAIL_TTL:
+        spawn(asyncio.to_thread(fetch_details, clinic_id))
+    return entry[1]
+
+
+# Remember the latest queue count seen for a clinic, so it can be shared inline without a backend call
+def record_queue_count(clinic_id: int, clinic_name: str, count: int | None) -> None:
+    generated_at = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+    queue_articles[clinic_id] = InlineQueryResultArticle(
+        id=f"queue-{clinic_id}",
+        title=f"Queue @ {clinic_name}: {count if count is not None else 'None'}",
+        description=f"As of {generated_at}",
+        input_message_content=InputTextMessageContent(
+            format_queue_status(clinic_name, count) + f"\n\n_Note: This message is generated at {escape(generated_at)}\._",
+            parse_mode=telegram.constants.ParseMode.MARKDOWN_V2)
+    )
+
+
+# Queue count pushed by the backend, as (clinic name, count), while it is within PUSHED_QUEUE_TTL
+def get_pushed_queue_count(clinic_id: int) -> tuple[str, int | None] | None:
+    entry = pushed_queue_counts.get(clinic_id)
+    if entry is None or time.time() - entry[0] > PUSHED_QUEUE_TTL:
+        return None
+    return entry[1], entry[2]
+
+
+# Apply a queue count pushed by the backend
+def push_queue_count(clinic_id: int, clinic_name: str, count: int | None) -> None:
+    pushed_queue_counts[clinic_id] = (time.time(), clinic_name, count)
+    record_queue_count(clinic_id, clinic_name, count)
+
+
+# Forget a clinic's detail record, so that it is fetched again on next use
+def invalidate_details(clinic_id: int) -> bool:
+    clinic_articles.pop(clinic_id, None)
+    return details.pop(clinic_id, None) is not None
+
+
+# Clinic IDs whose indexed keys start with prefix
+def _prefix_ids(index: list[tuple[str, int]], prefix: str) -> set[int]:
+    ids = set()
+    position = bisect.bisect_left(index, (prefix, -1))
+    while position < len(index) and index[position][0].startswith(prefix):
+        ids.add(index[position][1])
+        position += 1
+    return ids
+
+
+# Clinic IDs matching a postal code prefix or every word of a name
+def search(query: str) -> list[int]:
+    query = query.strip().lower()
+    if not query:
+        return sorted(clinics)[:MAX_RESULTS]
+
+    if query.isdigit():
+        ids = _prefix_ids(postal_index, query)
+        if int(query) in clinics:
+            ids.add(int(query))
+    else:
+        ids = None
+        for word in re.findall(r"\w+", query):
+            matches = _prefix_ids(name_index, word)
+            ids = matches if ids is None else ids & matches
+        ids = ids or set()
+
+    return sorted(ids)[:MAX_RESULTS]
+
+
+# Prebuilt inline results for a query: the clinic card, plus its last known queue status
+def inline_results(query: str) -> list[InlineQueryResultArticle]:
+    results = []
+    for clinic_id in search(query):
+        results.append(clinic_article(clinic_id))
+        if clinic_id in queue_articles:
+            results.append(queue_articles[clinic_id])
+    return results[:MAX_RESULTS]
+
+
+""" END OF INDEX METHODS """
+
+""" START OF REFRESH METHODS """
+
+
+# Run a coroutine in the background, keeping a reference until it finishes
+def spawn(coroutine) -> asyncio.Task:
+    task = asyncio.get_running_loop().create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+# Backend time of a response, from its Date header
+def _server_time(result) -> int:
+    try:
+        return int(parsedate_to_datetime(result.headers['Date']).timestamp())
+    except (KeyError, TypeError, ValueError):
+        return int(time.time())
+
+
+# Sync the directory with the backend and write a new snapshot if anything changed.
+# Uses the changed-since query where the backend offers it, otherwise a conditional GET of the full list,
+# and applies only the differences to the directory.
+async def refresh() -> None:
+    global delta_supported, synced_at
+
+    started_at = time.perf_counter()
+    transferred = 0
+    mode, result = 'delta', None
+
+    if delta_supported and synced_at is not None:
+        result = await asyncio.to_thread(api.get, CLINIC_DELTA_URI.format(since=synced_at - DELTA_OVERLAP), timeout=30)
+        transferred += api.response_size(result)
+        if result.status_code in (404, 405, 501):
+            logger.warning(f"Changed-since query not supported | HTTP {result.status_code}, using conditional GETs")
+            delta_supported, result = False, None
+
+    if result is None:
+        mode = 'full'
+        result = await asyncio.to_thread(api.conditional_get, 'clinic/get/all/', timeout=30)
+        transferred += api.response_size(result)
+
+    changed = 0
+    if result.status_code == 304:
+        mode = 'not modified'
+    elif result.status_code != 200:
+        logger.warning(f"Clinic directory refresh failed | HTTP {result.status_code}")
+    elif mode == 'delta':
+        records = result.json()
+        changed = apply_diff([record for record in records if not record.get('deleted')],
+                             [int(record['clinicId']) for record in records if record.get('deleted')])
+    elif clinics:
+        changed = apply_diff(*diff(result.json()))
+    else:
+        load(result.json())
+        changed = len(clinics)
+
+    if result.status_code in (200, 304):
+        synced_at = _server_time(result)
+
+    elapsed = time.perf_counter() - started_at
+    refresh_stats.append({'mode': mode, 'status': result.status_code, 'bytes': transferred, 'seconds': elapsed,
+                          'changed': changed})
+    logger.info(f"Clinic directory refresh | {mode}, HTTP {result.status_code}, {transferred} bytes, "
+                f"{changed} clinics changed, {elapsed * 1000:.0f} ms | {len(clinics)} clinics")
+
+    if changed or details_changed:
+        await save_snapshot()
+
+
+# Write the current directory and detail records to CLINIC_SNAPSHOT_PATH. The file is written in a thread from
+# copies taken here on the event loop, as push events, refreshes and detail fetches keep changing both dicts.
+async def save_snapshot() -> None:
+    global details_changed
+
+    details_changed = False
+    clinics_copy = dict(clinics)
+    details_copy = {clinic_id: entry[1] for clinic_id, entry in dict(details).items()}
+    size = await asyncio.to_thread(clinic_snapshot.write, CLINIC_SNAPSHOT_PATH, clinics_copy, details_copy)
+    logger.info(f"Clinic snapshot written | {len(clinics_copy)} clinics, {len(details_copy)} details, {size} bytes")
+
+
+# Load the directory from CLINIC_SNAPSHOT_PATH, returns False if there is no usable snapshot
+def load_snapshot() -> bool:
+    if not os.path.isfile(CLINIC_SNAPSHOT_PATH):
+        return False
+
+    try:
+        snapshot = clinic_snapshot.Snapshot(CLINIC_SNAPSHOT_PATH)
+    except (clinic_snapshot.SnapshotError, OSError, ValueError) as exc:
+        logger.warning(f"Ignoring clinic snapshot: {exc!r}")
+        return False
+
+    clinic_list = snapshot.records()
+    # Details from the snapshot count as fetched when it was written, so stale ones get refreshed on use
+    for record in clinic_list:
+        if snapshot.has_details(record['clinicId']):
+            details[record['clinicId']] = (snapshot.written_at, record)
+    snapshot.close()
+
+    load(clinic_list)
+    logger.info(f"Clinic directory loaded from snapshot | {len(clinics)} clinics")
+    return True
+
+
+# Startup: serve from the snapshot straight away and refresh in the background, or fetch if there is none
+async def warm_start() -> None:
+    if load_snapshot():
+        spawn(refresh())
+    else:
+        await refresh()
+
+
+# Keep the directory fresh in the background
+async def refresh_periodically(application: Application) -> None:
+    while True:
+        await asyncio.sleep(CLINIC_REFRESH_INTERVAL)
+        try:
+            await refresh()
+        except Exception as exc:
+            logger.warning(f"Clinic directory refresh failed: {exc!r}")
+
+
+""" END OF REFRESH METHODS """
@@ -0,0 +1,97 @@
+import json
+import mmap
+import os
+import struct
+import time
+
+""" Clinic directory snapshot format
+
+    header   <4sHHIQ   magic b'DHCS', format version, reserved, record count, written at (unix time)
+    index    <qIIHH    per record: clinic ID, offset into the file, length, flags, reserved, sorted by clinic ID
+    records            one compact UTF-8 JSON array, each element the clinic's list entry merged with its
+                       detail record (flag HAS_DETAILS set when a detail record was merged in)
+
+The index is fixed-size, so a reader parses only the header and index up front and decodes single records on
+demand straight from the memory-mapped file. Since the records form one JSON array, loading all of them is a
+single json.loads call.
+"""
+
+MAGIC: bytes = b'DHCS'
+VERSION: int = 2
+HEADER = struct.Struct('<4sHHIQ')
+INDEX_ENTRY = struct.Struct('<qIIHH')
+
+# Index flags
+HAS_DETAILS: int = 1
+
+
+# Raised when a file is not a snapshot this version can read
+class SnapshotError(Exception):
+    pass
+
+
+# Write a snapshot atomically: readers see either the previous file or the complete new one
+def write(path: str, clinics: dict[int, dict], details: dict[int, dict]) -> int:
+    records = [
+        (clinic_id, HAS_DETAILS if clinic_id in details else 0,
+         json.dumps({**clinics[clinic_id], **details.get(clinic_id, {})}, separators=(',', ':')).encode())
+        for clinic_id in sorted(clinics)
+    ]
+
+    offset = HEADER.size + INDEX_ENTRY.size * len(records) + 1
+    index = bytearray()
+    for clinic_id, flags, record in records:
+        index += INDEX_ENTRY.pack(clinic_id, offset, len(record), flags, 0)
+        offset += len(record) + 1
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(records), int(time.time())))
+        f.write(index)
+        f.write(b'[' + b','.join(record for _, _, record in records) + b']')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return offset if records else offset + 1
+
+
+# Read-only view of a snapshot file
+class Snapshot:
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mm) < HEADER.size:
+            raise SnapshotError(f"{path} is too short to be a snapshot")
+        magic, version, _, count, self.written_at = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError(f"{path} is not a version {VERSION} clinic snapshot")
+
+        self.records_start = HEADER.size + INDEX_ENTRY.size * count
+        self.index: dict[int, tuple[int, int, int]] = {
+            clinic_id: (offset, length, flags)
+            for clinic_id, offset, length, flags, _ in INDEX_ENTRY.iter_unpack(self._mm[HEADER.size:self.records_start])
+        }
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    # Whether the record for a clinic includes its detail record
+    def has_details(self, clinic_id: int) -> bool:
+        return bool(self.index[clinic_id][2] & HAS_DETAILS)
+
+    # Decode one record
+    def get(self, clinic_id: int) -> dict | None:
+        location = self.index.get(clinic_id)
+        if location is None:
+            return None
+        offset, length, _ = location
+        return json.loads(self._mm[offset:offset + length])
+
+    # Decode every record with one json.loads, in clinic ID order
+    def records(self) -> list[dict]:
+        return json.loads(self._mm[self.records_start:])
+
+    def close(self) -> None:
+        self._mm.close()
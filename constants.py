@@ -7,6 +7,7 @@ import logging
 import pytz
 from telegram.ext import ConversationHandler
 
+# Logging and environment variables are configured once here, every other module imports constants first
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -20,8 +21,12 @@ if load_dotenv() is False:
 TELEGRAM_BOT_API_TOKEN = os.getenv('TELEGRAM_BOT_API_TOKEN')
 BOT_NAME: str = "HappySmile Assistant Bot"
 WEBSITE: str = "https://happy-smile-dhrms.herokuapp.com/"
+API_BASE_URL: str = "https://happy-smile-dhrms.herokuapp.com/api"
 TIMEZONE: pytz = pytz.timezone('Asia/Singapore')
 
+# Runtime Files
+CACHE_DIR: str = os.getenv('BOT_CACHE_DIR', '.cache')
+
 # Process Names
 GET_APPOINTMENTS: str = "GET APPOINTMENTS"
 FIND_CLINICS_NEARBY: str = "FIND CLINICS NEARBY"
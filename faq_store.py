@@ -0,0 +1,75 @@
+import asyncio
+import json
+import logging
+import os
+
+from telegram import ReplyKeyboardMarkup
+from telegram.ext import Application
+from telegram.helpers import escape_markdown
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+FAQ_PATH = os.getenv('FAQ_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faq.json'))
+FAQ_RELOAD_INTERVAL = float(os.getenv('FAQ_RELOAD_INTERVAL', 2))
+
+CLOSE_BUTTON = "❌ Close"
+UNKNOWN_ANSWER = escape_markdown("Sorry, I'm not sure about this. Perhaps you can try emailing the clinic?", version=2)
+
+
+# FAQ content ready to send: answers already escaped for MarkdownV2 and the question keyboard already built.
+# Never modified after it is built; a reload swaps in a new instance.
+class FaqContent:
+    def __init__(self, faq: dict[str, str], version: tuple[int, int] = (0, 0)) -> None:
+        self.answers: dict[str, str] = {question: escape_markdown(answer, version=2) for question, answer in faq.items()}
+        self.keyboard = ReplyKeyboardMarkup([[question] for question in faq] + [[CLOSE_BUTTON]], one_time_keyboard=True)
+        # (mtime_ns, size) of the file this was loaded from
+        self.version = version
+
+
+content: FaqContent = FaqContent({})
+
+
+# File version used to notice changes without reading the file
+def file_version(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Read and validate a FAQ file: a JSON object of question -> answer, in display order
+def read(path: str) -> FaqContent:
+    version = file_version(path)
+    with open(path, encoding='utf-8') as f:
+        faq = json.load(f)
+
+    if not isinstance(faq, dict) or not all(isinstance(key, str) and isinstance(value, str) for key, value in faq.items()):
+        raise ValueError(f"{path} must map each question to its answer")
+    return FaqContent(faq, version)
+
+
+# Reload FAQ_PATH if it changed; a missing or invalid file keeps the current content
+def reload(force: bool = False) -> bool:
+    global content
+
+    try:
+        if not force and file_version(FAQ_PATH) == content.version:
+            return False
+        new_content = read(FAQ_PATH)
+    except (OSError, ValueError) as exc:
+        logger.warning(f"FAQ not reloaded, keeping {len(content.answers)} entries: {exc!r}")
+        return False
+
+    # One reference swap, so a tap sees either the old or the new content, never a mix
+    content = new_content
+    logger.info(f"FAQ loaded | {len(content.answers)} entries from {FAQ_PATH}")
+    return True
+
+
+# Watch FAQ_PATH and reload it when it changes
+async def watch(application: Application) -> None:
+    while True:
+        await asyncio.sleep(FAQ_RELOAD_INTERVAL)
+        reload()
+
+
+reload(force=True)
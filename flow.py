@@ -0,0 +1,253 @@
+import logging
+import re
+import time
+
+from typing import Awaitable, Callable
+
+from telegram import MessageEntity, ReplyKeyboardRemove, Update
+from telegram.ext import Application, BaseHandler, CallbackContext, ContextTypes, ConversationHandler
+
+import analytics
+import constants
+import helpers
+import state_backend
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+WEBSITE = constants.WEBSITE
+STATES = constants.States
+
+# Controller action: the usual (update, context) -> next state coroutine
+Action = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[object]]
+
+
+""" START OF ROUTES
+
+A route maps one kind of input to an action. A flow lists its routes per state, in the order the old handler chains
+evaluated them.
+"""
+
+
+class Route:
+    TEXT, PATTERN, ANY_TEXT, CALLBACK, COMMAND = range(5)
+
+    def __init__(self, kind: int, action: Action, value: str = None) -> None:
+        self.kind = kind
+        self.action = action
+        self.value = value
+
+
+# Message text equal to value
+def text(value: str, action: Action) -> Route:
+    return Route(Route.TEXT, action, value)
+
+
+# Message text fully matching a regular expression (written without ^ and $ anchors)
+def pattern(value: str, action: Action) -> Route:
+    return Route(Route.PATTERN, action, value)
+
+
+# Any other non-command message text
+def any_text(action: Action) -> Route:
+    return Route(Route.ANY_TEXT, action)
+
+
+# Callback query whose data equals value
+def callback(value: object, action: Action) -> Route:
+    return Route(Route.CALLBACK, action, str(value))
+
+
+# /command
+def command(value: str, action: Action) -> Route:
+    return Route(Route.COMMAND, action, value)
+
+
+""" END OF ROUTES """
+
+""" START OF DISPATCH """
+
+
+# Single handler for all routes of one state: exact matches are dict lookups, patterns share one compiled regex.
+# With a flow name, every handled update is recorded as an analytics event.
+class FlowStateHandler(BaseHandler[Update, CallbackContext]):
+    def __init__(self, routes: list[Route], flow_name: str = None, state: int = analytics.ENTRY) -> None:
+        super().__init__(self._dispatch)
+        self.routes = routes
+        self.flow_name = flow_name.encode() if flow_name is not None else None
+        self.state = state
+        self.texts: dict[str, Action] = {}
+        self.callbacks: dict[str, Action] = {}
+        self.commands: dict[str, Action] = {}
+        self.any_text: Action | None = None
+
+        patterns: list[str] = []
+        self.pattern_actions: dict[str, Action] = {}
+        for route in routes:
+            self._check_shadowing(route, patterns)
+            match route.kind:
+                case Route.TEXT:
+                    self.texts[route.value] = route.action
+                case Route.PATTERN:
+                    group = f"r{len(patterns)}"
+                    patterns.append(route.value)
+                    self.pattern_actions[group] = route.action
+                case Route.ANY_TEXT:
+                    self.any_text = route.action
+                case Route.CALLBACK:
+                    self.callbacks[route.value] = route.action
+                case Route.COMMAND:
+                    self.commands[route.value] = route.action
+
+        self.regex = re.compile("|".join(f"(?P<r{index}>{value})" for index, value in enumerate(patterns))) \
+            if patterns else None
+
+    # Reject a route that an earlier one would always have caught in the old handler chain, as it could never match.
+    # This is decidable for texts, exact duplicates and anything after any_text. A pattern that only overlaps an
+    # earlier pattern is not rejected; for inputs matching both, the earlier route wins.
+    def _check_shadowing(self, route: Route, patterns: list[str]) -> None:
+        if route.kind in (Route.TEXT, Route.PATTERN, Route.ANY_TEXT) and self.any_text is not None:
+            raise ValueError(f"Route {route.value!r} comes after any_text, which catches every text")
+
+        duplicate = {Route.TEXT: self.texts, Route.CALLBACK: self.callbacks, Route.COMMAND: self.commands}
+        if (route.kind in duplicate and route.value in duplicate[route.kind]) \
+                or (route.kind == Route.PATTERN and route.value in patterns):
+            raise ValueError(f"Route {route.value!r} is already routed earlier in the state")
+
+        # A pattern without special characters is a text, only matching itself
+        if route.kind == Route.TEXT or (route.kind == Route.PATTERN and re.escape(route.value) == route.value):
+            for earlier in patterns:
+                if re.fullmatch(earlier, route.value):
+                    raise ValueError(f"Route {route.value!r} is shadowed by pattern {earlier!r}")
+
+    # Returns the action for this update, or None if no route matches
+    def check_update(self, update: object) -> Action | None:
+        if not isinstance(update, Update):
+            return None
+
+        if update.callback_query is not None:
+            return self.callbacks.get(update.callback_query.data)
+
+        message = update.message
+        if message is None or message.text is None:
+            return None
+
+        if message.entities and message.entities[0].type == MessageEntity.BOT_COMMAND \
+                and message.entities[0].offset == 0:
+            name = message.text[1:message.entities[0].length].split('@')[0]
+            return self.commands.get(name)
+
+        action = self.texts.get(message.text)
+        if action is not None:
+            return action
+
+        if self.regex is not None:
+            match = self.regex.fullmatch(message.text)
+            if match is not None:
+                return self.pattern_actions[match.lastgroup]
+
+        return self.any_text
+
+    async def handle_update(self, update: Update, application: Application, check_result: Action,
+                            context: CallbackContext) -> object:
+        self.collect_additional_context(context, update, application, check_result)
+        if self.flow_name is None:
+            return await check_result(update, context)
+        return await run_recorded(check_result, update, context, self.flow_name, self.state)
+
+    async def _dispatch(self, update: Update, context: CallbackContext) -> object:
+        action = self.check_update(update)
+        return await action(update, context) if action is not None else None
+
+
+# Run an action and record the update as an analytics event of the flow
+async def run_recorded(action: Action, update: Update, context: CallbackContext, flow_name: bytes,
+                       state: int) -> object:
+    analytics.clinic_id.set(0)
+    started_at = time.perf_counter()
+    attributes = {'flow.name': flow_name.decode(), 'flow.state': state}
+    with tracing.span(getattr(action, '__qualname__', 'action'), **attributes) as span:
+        next_state = await action(update, context)
+        if span is not None and isinstance(next_state, int):
+            span.set('flow.next_state', next_state)
+    analytics.record(update.effective_chat.id, flow_name, state, next_state if isinstance(next_state, int) else state,
+                     analytics.clinic_id.get(), (time.perf_counter() - started_at) * 1000)
+    return next_state
+
+
+""" END OF DISPATCH """
+
+""" START OF FLOW """
+
+
+# A controller's conversation: shared state helpers plus the table compiled into a ConversationHandler
+class Flow:
+    def __init__(self, name: str, process_name: str, flow_logger: logging.Logger = logger) -> None:
+        self.name = name
+        self.process_name = process_name
+        self.logger = flow_logger
+        self.state_store = state_backend.ChatStateStore(name)
+        self.table: dict[object, list[Route]] = {}
+        self.handler: state_backend.SharedConversationHandler | None = None
+
+    # Store current state
+    async def store_state(self, chat_id: int, state: int = -1) -> None:
+        self.state_store.store(chat_id, state)
+
+    # Get state from state store
+    async def get_state(self, chat_id: int) -> int:
+        return self.state_store.get(chat_id)
+
+    # Clear chat state
+    async def clear_state(self, chat_id: int) -> bool:
+        return self.state_store.clear(chat_id)
+
+    # Leave the flow and the bot, shared by every controller
+    async def end(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        query = update.callback_query
+        if query is not None:
+            await query.answer()
+
+        self.logger.info(f"{update.effective_user.first_name} [{update.effective_user.id}] | Cancelled [{self.process_name}] process.")
+
+        await helpers.handle_message(update,
+                                     "Alright, I'll see you again soon\! " +
+                                     "\n\nFor more information, please visit our website at " +
+                                     WEBSITE.replace('.', '\.').replace('-', '\-') + "\." +
+                                     "\n\nPress start on the menu or type \/start to start the bot again\.",
+                                     ReplyKeyboardRemove())
+
+        await self.clear_state(update.effective_chat.id)
+        return STATES.END
+
+    # Run one of the flow's actions from outside the conversation (e.g. a /start deep link) and leave the chat's
+    # conversation in the state the action returns
+    async def open(self, action: Action, update: Update, context: ContextTypes.DEFAULT_TYPE) -> object:
+        state = await run_recorded(action, update, context, self.name.encode(), analytics.ENTRY)
+        if state is not None:
+            self.handler.set_state(update, state)
+        return state
+
+    # Forget the chat's position in this flow
+    def leave(self, update: Update) -> None:
+        self.handler.set_state(update, None)
+
+    # Compile the flow table into a conversation handler with one FlowStateHandler per state
+    def compile(self, entry_points: list[Route], states: dict[object, list[Route]],
+                fallbacks: list[Route]) -> ConversationHandler:
+        self.table = {"entry_points": entry_points, **states, "fallbacks": fallbacks}
+
+        self.handler = state_backend.SharedConversationHandler(
+            name=self.name,
+            entry_points=[FlowStateHandler(entry_points, self.name, analytics.ENTRY)],
+            states={state: [FlowStateHandler(routes, self.name, state)] for state, routes in states.items()},
+            fallbacks=[FlowStateHandler(fallbacks, self.name, analytics.FALLBACK)],
+            map_to_parent={
+                STATES.END: ConversationHandler.END
+            }
+        )
+        return self.handler
+
+
+""" END OF FLOW """
@@ -1,25 +1,136 @@
+import asyncio
+import logging
+
 import telegram
 from telegram import (
     BotCommand,
     Message,
     Update
 )
-from telegram.ext import Application
+from telegram.ext import Application, ContextTypes
 
+import analytics
+import api
+import chat_registry
+import clinic_directory
 import constants
+import faq_store
+import lifecycle
+import push_events
+import startup
+import state_backend
+import tracing
+
+import Controllers.Broadcast as Broadcast
+
+logger = logging.getLogger(__name__)
 
 REPLY_MARKUP = constants.REPLY_MARKUP
 
+BOT_COMMANDS = [
+    BotCommand(command="start", description="Start talking to the bot."),
+    BotCommand(command="stop", description="Terminates interactions with the bot."),
+    # BotCommand(command="hello", description="Bot will greet you."),
+    # BotCommand(command="help", description="Did you say you need help?")
+]
+
+# Coroutines (taking no arguments) started by post_init and run concurrently, e.g. cache warm-ups and health checks.
+# They run alongside the first updates instead of delaying them.
+STARTUP_TASKS = [
+    api.health_check,
+    chat_registry.load,
+    clinic_directory.warm_start
+]
+
+# Coroutines taking the application, started by post_init once the startup tasks are done and left running
+BACKGROUND_TASKS = [
+    clinic_directory.refresh_periodically,
+    faq_store.watch,
+    analytics.flush_periodically,
+    tracing.export_periodically,
+    push_events.serve,
+    state_backend.expire_periodically
+]
+
+# Background tasks that must run in one process only, however many sharded workers there are
+PRIMARY_TASKS = [
+    Broadcast.resume
+]
+
+# Whether this process sets the bot commands and runs PRIMARY_TASKS, turned off in all sharded workers but the first
+PRIMARY: bool = True
+
+
+# Only call set_my_commands when the command list differs from the one Telegram has for this bot.
+# Run in the background by run_startup_tasks, so neither round trip delays polling.
+async def set_bot_commands(application: Application) -> bool:
+    if tuple(await application.bot.get_my_commands()) == tuple(BOT_COMMANDS):
+        return False
+
+    await application.bot.set_my_commands(BOT_COMMANDS)
+    return True
+
+
+# Coroutines (taking no arguments) awaited by post_shutdown, e.g. flushing buffered data
+SHUTDOWN_TASKS = [
+    analytics.flush,
+    tracing.export,
+    state_backend.flush
+]
+
+
+# Tasks started by post_init, cancelled by post_shutdown
+tasks: list[asyncio.Task] = []
 
-# Custom startup logic that requires to await coroutines
+
+# Run the startup tasks (and, in the primary process, bring the bot commands up to date), then start the background
+# tasks that depend on them
+async def run_startup_tasks(application: Application) -> None:
+    awaited = {task.__qualname__: task() for task in STARTUP_TASKS}
+    if PRIMARY:
+        awaited["set_bot_commands"] = set_bot_commands(application)
+    results = await asyncio.gather(*awaited.values(), return_exceptions=True)
+
+    for name, result in zip(awaited, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Startup task [{name}] failed: {result!r}")
+        elif name == "set_bot_commands" and result is False:
+            logger.info("Bot commands unchanged, skipped set_my_commands.")
+
+    tasks.extend(asyncio.create_task(task(application))
+                 for task in BACKGROUND_TASKS + (PRIMARY_TASKS if PRIMARY else []))
+
+    startup.mark("startup tasks finished")
+    logger.info(startup.report())
+
+
+# Custom startup logic that requires to await coroutines. Only what has to happen before polling starts is awaited,
+# the rest is started here and runs while the first updates are handled
 async def post_init(application: Application) -> None:
-    bot_commands = [
-        BotCommand(command="start", description="Start talking to the bot."),
-        BotCommand(command="stop", description="Terminates interactions with the bot."),
-        # BotCommand(command="hello", description="Bot will greet you."),
-        # BotCommand(command="help", description="Did you say you need help?")
-    ]
-    await application.bot.set_my_commands(bot_commands)
+    startup.mark("post_init started")
+
+    try:
+        await lifecycle.resume(application)
+    except Exception as exc:
+        logger.warning(f"Startup task [resume] failed: {exc!r}")
+
+    tasks.append(asyncio.create_task(run_startup_tasks(application)))
+
+    startup.mark("post_init finished")
+
+
+# Custom shutdown logic, run after the application has stopped
+async def post_shutdown(application: Application) -> None:
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    tasks.clear()
+
+    for task in SHUTDOWN_TASKS:
+        try:
+            await task()
+        except Exception as exc:
+            logger.warning(f"Shutdown task [{task.__qualname__}] failed: {exc!r}")
 
 
 # To handle messages between CallbackQueryHandler and MessageHandler methods
@@ -27,8 +138,19 @@ async def handle_message(update: Update = None, text: str = None, reply_markup:
     query = update.callback_query
 
     if query is not None:
-        await query.answer()
-        await query.delete_message()
-        return await update.effective_chat.send_message(text, telegram.constants.ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
+        with tracing.span("answerCallbackQuery", tracing.KIND_CLIENT):
+            await query.answer()
+        with tracing.span("deleteMessage", tracing.KIND_CLIENT):
+            await query.delete_message()
+        with tracing.span("sendMessage", tracing.KIND_CLIENT):
+            return await update.effective_chat.send_message(text, telegram.constants.ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
     else:
-        return await update.message.reply_text(text, telegram.constants.ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
+        with tracing.span("sendMessage", tracing.KIND_CLIENT):
+            return await update.message.reply_text(text, telegram.constants.ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
+
+
+# Clinic ID picked from a clinic list ("<id>. <name>") or given by a /start deep link ("queue_<id>", "clinic_<id>")
+def selected_clinic_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if context.args:
+        return int(context.args[0].partition('_')[2])
+    return int(update.message.text.split('.')[0])
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+
+from http import HTTPStatus
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Request handler: (method, path, lower-cased headers, body) -> (status code, response body)
+RequestHandler = Callable[[str, str, dict[str, str], bytes], Awaitable[tuple[int, bytes]]]
+
+# Requests larger than this are rejected instead of being read into memory
+MAX_BODY_SIZE: int = 1 << 20
+
+
+# Read one HTTP/1.1 request, returns None when the client has closed the connection
+async def read_request(reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str], bytes] | None:
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_SIZE:
+        raise ValueError(f"Request body too large ({length} bytes)")
+    body = await reader.readexactly(length) if length else b''
+
+    return method, path, headers, body
+
+
+# Minimal keep-alive HTTP server for small JSON endpoints (webhooks, push events)
+async def serve(host: str, port: int, handler: RequestHandler) -> asyncio.Server:
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+
+                try:
+                    status, response = await handler(*request)
+                except Exception as exc:
+                    logger.exception(f"Unhandled error serving {request[0]} {request[1]}: {exc!r}")
+                    status, response = HTTPStatus.INTERNAL_SERVER_ERROR, b''
+
+                writer.write(f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(response)}\r\n\r\n".encode('latin-1') + response)
+                await writer.drain()
+
+                if request[2].get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as exc:
+            logger.debug(f"Dropped HTTP connection: {exc!r}")
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connection, host, port)
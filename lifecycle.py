@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application
+
+import admission
+import profiler
+
+import Controllers.Broadcast as Broadcast
+import Controllers.Profile as Profile
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+# Heroku sends SIGKILL 30 seconds after SIGTERM, the offset has to be confirmed before that
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', 20))
+
+""" Restart drain (polling mode)
+
+    on SIGTERM/SIGINT
+    1. stop polling getUpdates
+    2. pause broadcast / profiling jobs
+    3. drain the update queue, with a deadline
+    4. confirm with Telegram every update up to the first one left unprocessed (getUpdates with that offset)
+
+PTB's Updater.stop does not confirm the last batch it fetched, so without step 4 the next process would be sent
+all of it again. With it, Telegram redelivers exactly the updates this process did not get to, and the next process
+needs nothing from this one: no file has to survive the restart. An update still being handled when the deadline
+passes is left to finish (or be cut off by the platform) and is not redelivered.
+A next process that starts polling before the drain ends may also be sent the updates still queued here, which are
+then handled twice; with no overlap between the two processes, each update is handled once.
+"""
+
+draining: bool = False
+drain_task: asyncio.Task | None = None
+
+
+""" START OF SHUTDOWN METHODS """
+
+
+# Pause the jobs that outlive single updates: the broadcast is checkpointed to resume after the restart,
+# and the profiling window is cut short with what was sampled so far written out
+async def pause_jobs() -> None:
+    if Profile.profile_task is not None and not Profile.profile_task.done():
+        Profile.profile_task.cancel()
+        profiler.stop()
+    await Broadcast.pause()
+
+
+# Take the updates still waiting in the queue out of it, oldest first, and forget their admission records
+def take_queued(update_queue: asyncio.Queue) -> list[Update]:
+    queued = []
+    while not update_queue.empty():
+        item = update_queue.get_nowait()
+        update_queue.task_done()
+        if isinstance(item, Update):
+            admission.forget(item)
+            queued.append(item)
+    return queued
+
+
+# Confirm every update below offset, so that Telegram only redelivers the ones from offset on
+async def confirm_offset(application: Application, offset: int) -> None:
+    try:
+        await application.bot.get_updates(offset=offset, limit=1, timeout=0)
+    except TelegramError as exc:
+        logger.warning(f"Could not confirm updates below offset {offset}, they will be delivered again: {exc!r}")
+
+
+# Stop fetching updates, let queued and running ones finish within SHUTDOWN_DRAIN_TIMEOUT, confirm the ones that
+# were handled with Telegram, then stop the event loop so that run_polling shuts the application down
+async def drain_and_stop(application: Application) -> None:
+    if application.updater.running:
+        await application.updater.stop()
+    logger.info(f"Stopped fetching updates, draining for up to {SHUTDOWN_DRAIN_TIMEOUT:.0f}s")
+
+    started_at = time.monotonic()
+    queued_before = application.update_queue.qsize()
+    queue_joined = asyncio.ensure_future(application.update_queue.join())
+    jobs_paused = asyncio.ensure_future(pause_jobs())
+    await asyncio.wait([queue_joined, jobs_paused], timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    drained = queue_joined.done() and jobs_paused.done()
+    left = [] if queue_joined.done() else take_queued(application.update_queue)
+    queue_joined.cancel()
+
+    # Updates are queued and handled in update ID order, so the ones left over are the newest fetched
+    if left:
+        await confirm_offset(application, min(update.update_id for update in left))
+    elif admission.last_queued_id:
+        await confirm_offset(application, admission.last_queued_id + 1)
+    logger.info(f"Drained {queued_before - len(left)} queued updates in {time.monotonic() - started_at:.2f}s, "
+                f"left {len(left)} for Telegram to deliver to the next process"
+                + ("" if drained else ", one update or job was still running"))
+
+    asyncio.get_running_loop().stop()
+
+
+# Graceful stop on the signals run_polling would otherwise stop on at once
+def on_stop_signal(application: Application) -> None:
+    global draining, drain_task
+
+    if draining:
+        return
+    draining = True
+    drain_task = asyncio.get_running_loop().create_task(drain_and_stop(application))
+
+
+""" END OF SHUTDOWN METHODS """
+
+""" START OF STARTUP METHODS """
+
+
+# Replace run_polling's stop signal handlers with a graceful drain. Only applies to polling mode.
+async def resume(application: Application) -> None:
+    if application.updater is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, on_stop_signal, application)
+
+
+""" END OF STARTUP METHODS """
@@ -1,31 +1,53 @@
-import logging
+import startup
 
-import os
-from dotenv import load_dotenv
+import logging
 
+import admission
+import chat_registry
+import constants
 import helpers
+import state_backend
 
 import bot
 
-from telegram.ext import Application
+import Controllers.Broadcast as Broadcast
+import Controllers.InlineQuery as InlineQuery
+import Controllers.Profile as Profile
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
-if load_dotenv() is False:
-    logger.info(msg="Failed to load environment variables.")
+startup.mark("modules imported")
 
 # Essential Info
-TELEGRAM_BOT_API_TOKEN = os.getenv('TELEGRAM_BOT_API_TOKEN')
+TELEGRAM_BOT_API_TOKEN = constants.TELEGRAM_BOT_API_TOKEN
+
+
+# Register the bot's handlers, shared by polling mode and the sharded workers
+def add_handlers(application: Application) -> None:
+    # Group -4 measures queueing delay and drops repeated taps before anything else runs
+    application.add_handler(TypeHandler(Update, admission.admit), group=-4)
+    # Group -1 runs before the conversation handlers and only records time-to-first-update
+    application.add_handler(TypeHandler(Update, startup.on_first_update), group=-1)
+    # Group -3 records every chat that talks to the bot, for broadcasts
+    application.add_handler(TypeHandler(Update, chat_registry.record), group=-3)
+    # Group -2 loads the chat's conversation state from a shared state backend without blocking the event loop
+    application.add_handler(TypeHandler(Update, state_backend.prefetch), group=-2)
+    application.add_handler(bot.CONV_HANDLER)
+    application.add_handler(InlineQuery.INLINE_QUERY_HANDLER)
+    application.add_handlers(Broadcast.BROADCAST_HANDLERS)
+    application.add_handlers(Profile.PROFILE_HANDLERS)
 
 
 def main() -> None:
-    application = Application.builder().token(token=TELEGRAM_BOT_API_TOKEN).post_init(helpers.post_init).build()
+    application = (Application.builder().token(token=TELEGRAM_BOT_API_TOKEN)
+                   .update_queue(admission.AdmissionQueue()).post_init(helpers.post_init)
+                   .post_shutdown(helpers.post_shutdown).build())
 
-    application.add_handler(bot.CONV_HANDLER)
+    add_handlers(application)
+    startup.mark("application built")
 
     # Run the bot until the user presses Ctrl-C
     application.run_polling(timeout=1000)
@@ -0,0 +1,118 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import time
+
+from telegram.ext import BaseHandler
+
+import constants
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(constants.CACHE_DIR, 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.1))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 600))
+
+# Sent with every summary: the event loop keeps running other tasks while a sampled update awaits, and cProfile
+# attributes their time to the sampled update too
+CAVEAT = ("cProfile stays on across the awaits of a sampled update, so time spent in other tasks that ran meanwhile "
+          "(background tasks, other updates' callbacks) is included.")
+
+# The only thing checked per update while profiling is off
+active: bool = False
+# Worker shard of this process when sharded; only updates of the chats it owns are profiled
+shard: int | None = None
+
+sample_rate: float = PROFILE_SAMPLE_RATE
+started_at: float = 0.0
+# Profiles of the sampled updates, merged
+stats: pstats.Stats | None = None
+seen: int = 0
+sampled: int = 0
+# cProfile profiles the whole thread, so only one update is profiled at a time
+profiling: bool = False
+
+
+""" START OF PROFILING METHODS """
+
+
+# Wrap a handler's handle_update so that, while profiling is on, a fraction of its updates run under cProfile
+def instrument(handler: BaseHandler) -> None:
+    handle_update = handler.handle_update
+
+    async def profiled_handle_update(update, application, check_result, context):
+        if not active:
+            return await handle_update(update, application, check_result, context)
+        return await profile_update(handle_update, update, application, check_result, context)
+
+    handler.handle_update = profiled_handle_update
+
+
+async def profile_update(handle_update, *args) -> object:
+    global profiling, seen, sampled, stats
+
+    seen += 1
+    if profiling or random.random() >= sample_rate:
+        return await handle_update(*args)
+
+    profiling = True
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return await handle_update(*args)
+    finally:
+        profile.disable()
+        profiling = False
+        sampled += 1
+        if stats is None:
+            stats = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+
+
+# Turn profiling on, returns the window actually used
+def start(seconds: float, rate: float = PROFILE_SAMPLE_RATE) -> float:
+    global active, sample_rate, started_at, stats, seen, sampled
+
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    sample_rate = min(max(rate, 0.0), 1.0)
+    started_at = time.monotonic()
+    stats, seen, sampled = None, 0, 0
+    active = True
+    logger.info(f"Profiling {sample_rate:.0%} of updates for {seconds:.0f}s")
+    return seconds
+
+
+# Turn profiling off and write the merged profile to PROFILE_DIR, returns its path (None if nothing was sampled)
+def stop() -> str | None:
+    global active
+
+    active = False
+    if stats is None:
+        logger.info(f"Profiling stopped | {seen} updates seen, none sampled")
+        return None
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, time.strftime('profile-%Y%m%d-%H%M%S.pstats'))
+    stats.dump_stats(path)
+    logger.info(f"Profiling stopped after {time.monotonic() - started_at:.0f}s | {sampled} of {seen} updates profiled, "
+                f"written to {path}")
+    return path
+
+
+# Functions with the most cumulative time in the merged profile
+def summary(limit: int = 15) -> str:
+    if stats is None:
+        return "No updates were profiled."
+
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return output.getvalue()
+
+
+""" END OF PROFILING METHODS """
@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+from http import HTTPStatus
+
+from telegram.ext import Application
+
+import appointment_cache
+import clinic_directory
+import httpserver
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+# The receiver only runs when both a port and a secret are configured
+PUSH_EVENTS_PORT = int(os.getenv('PUSH_EVENTS_PORT', 0))
+PUSH_EVENTS_SECRET = os.getenv('PUSH_EVENTS_SECRET', '')
+PUSH_EVENTS_PATH = os.getenv('PUSH_EVENTS_PATH', '/events')
+# Events arriving within this many seconds of each other are applied together
+PUSH_BATCH_WINDOW = float(os.getenv('PUSH_BATCH_WINDOW', 0.2))
+# Signed requests older (or newer) than this are rejected, so a captured request cannot be replayed later
+PUSH_MAX_SKEW = float(os.getenv('PUSH_MAX_SKEW', 300))
+
+""" Push event format
+
+    POST {PUSH_EVENTS_PATH}
+    X-DHRMS-Timestamp: <unix seconds>
+    X-DHRMS-Signature: sha256=<hex HMAC-SHA256 of "<timestamp>.<body>" keyed with PUSH_EVENTS_SECRET>
+
+    body: one event, or a JSON array of events
+
+    {"type": "queue.count", "clinicId": 12, "clinicName": "...", "count": 7}
+    {"type": "clinic.updated", "clinicId": 12, "clinic": {...}}     (clinic optional: without it, details are refetched)
+    {"type": "clinic.deleted", "clinicId": 12}
+    {"type": "appointment.changed", "nric": "S1234567D", "apptId": 42}     (either or both)
+
+Accepted requests are answered with 202 as soon as the events are queued.
+"""
+
+# Events received but not yet applied
+pending: list[dict] = []
+flush_handle: asyncio.TimerHandle | None = None
+received: int = 0
+batches: int = 0
+rejected: int = 0
+
+
+""" START OF SIGNATURE METHODS """
+
+
+# Signature header value of a request body, also used by the stand-in sender
+def sign(timestamp: str, body: bytes, secret: str | None = None) -> str:
+    digest = hmac.new((secret or PUSH_EVENTS_SECRET).encode(), timestamp.encode() + b'.' + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+# Whether a request was signed with PUSH_EVENTS_SECRET within PUSH_MAX_SKEW seconds
+def is_authentic(headers: dict[str, str], body: bytes) -> bool:
+    timestamp = headers.get('x-dhrms-timestamp', '')
+    try:
+        if abs(time.time() - float(timestamp)) > PUSH_MAX_SKEW:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(headers.get('x-dhrms-signature', ''), sign(timestamp, body))
+
+
+""" END OF SIGNATURE METHODS """
+
+""" START OF EVENT METHODS """
+
+
+# Apply a batch of events, coalesced so that each clinic and appointment is only touched once
+def apply(events: list[dict]) -> dict[str, int]:
+    queue_counts: dict[int, dict] = {}
+    changed_clinics: dict[int, dict] = {}
+    stale_clinics: set[int] = set()
+    deleted_clinics: set[int] = set()
+    nric_digests: set[str] = set()
+    appt_ids: set[str] = set()
+
+    for event in events:
+        kind = event.get('type')
+        try:
+            if kind == 'queue.count':
+                queue_counts[int(event['clinicId'])] = event
+            elif kind == 'clinic.updated':
+                clinic_id = int(event['clinicId'])
+                deleted_clinics.discard(clinic_id)
+                if event.get('clinic'):
+                    changed_clinics[clinic_id] = dict(event['clinic'], clinicId=clinic_id)
+                stale_clinics.add(clinic_id)
+            elif kind == 'clinic.deleted':
+                clinic_id = int(event['clinicId'])
+                changed_clinics.pop(clinic_id, None)
+                stale_clinics.discard(clinic_id)
+                deleted_clinics.add(clinic_id)
+            elif kind == 'appointment.changed':
+                if event.get('nric'):
+                    nric_digests.add(appointment_cache.hash_nric(str(event['nric'])))
+                if event.get('apptId') is not None:
+                    appt_ids.add(str(event['apptId']))
+            else:
+                logger.warning(f"Ignoring push event of unknown type {kind!r}")
+        except (KeyError, TypeError, ValueError) as exc:
+            logger.warning(f"Ignoring malformed push event of type {kind!r}: {exc!r}")
+
+    for clinic_id, event in queue_counts.items():
+        clinic = clinic_directory.clinics.get(clinic_id, {})
+        clinic_directory.push_queue_count(clinic_id, event.get('clinicName') or clinic.get('clinicName'),
+                                          event.get('count'))
+
+    changed = clinic_directory.apply_diff(list(changed_clinics.values()), list(deleted_clinics))
+    # A pushed record is the clinic's full record, so it also replaces the detail record; without one, the
+    # details are fetched again on next use
+    for clinic_id in stale_clinics:
+        if clinic_id in changed_clinics:
+            clinic_directory.set_details(clinic_id, changed_clinics[clinic_id])
+        elif clinic_directory.invalidate_details(clinic_id):
+            changed += 1
+
+    return {
+        'queue counts': len(queue_counts),
+        'clinics': changed,
+        'appointment chats': appointment_cache.invalidate_changed(nric_digests, appt_ids)
+    }
+
+
+# Apply everything received during the batch window
+def flush() -> None:
+    global flush_handle, batches
+
+    flush_handle = None
+    events = pending[:]
+    pending.clear()
+    counts = apply(events)
+
+    batches += 1
+    logger.info(f"Push events applied | {len(events)} events, " +
+                ", ".join(f"{name}: {count}" for name, count in counts.items()))
+    if counts['clinics']:
+        clinic_directory.spawn(clinic_directory.save_snapshot())
+
+
+# Queue events, starting the batch window if it is not already open
+def receive(events: list[dict]) -> None:
+    global flush_handle, received
+
+    received += len(events)
+    pending.extend(events)
+    if flush_handle is None:
+        flush_handle = asyncio.get_running_loop().call_later(PUSH_BATCH_WINDOW, flush)
+
+
+""" END OF EVENT METHODS """
+
+""" START OF RECEIVER METHODS """
+
+
+# Authenticate a push request and queue its events
+async def on_request(method: str, path: str, headers: dict[str, str], body: bytes) -> tuple[int, bytes]:
+    global rejected
+
+    if path != PUSH_EVENTS_PATH:
+        return HTTPStatus.NOT_FOUND, b''
+    if method != 'POST':
+        return HTTPStatus.METHOD_NOT_ALLOWED, b''
+    if not is_authentic(headers, body):
+        rejected += 1
+        return HTTPStatus.UNAUTHORIZED, b''
+
+    try:
+        events = json.loads(body)
+    except ValueError:
+        return HTTPStatus.BAD_REQUEST, b''
+    if isinstance(events, dict):
+        events = [events]
+    if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+        return HTTPStatus.BAD_REQUEST, b''
+
+    receive(events)
+    return HTTPStatus.ACCEPTED, json.dumps({'accepted': len(events)}).encode()
+
+
+# Run the receiver for as long as the application runs
+async def serve(application: Application) -> None:
+    if not PUSH_EVENTS_PORT or not PUSH_EVENTS_SECRET:
+        return
+
+    server = await httpserver.serve('0.0.0.0', PUSH_EVENTS_PORT, on_request)
+    logger.info(f"Push event receiver listening on port {PUSH_EVENTS_PORT}{PUSH_EVENTS_PATH}")
+    async with server:
+        await server.serve_forever()
+
+
+""" END OF RECEIVER METHODS """
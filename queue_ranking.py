@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import time
+
+import numpy as np
+
+import api
+import clinic_directory
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+# A ranking reuses queue counts fetched within this many seconds, so users asking together share one round of calls
+QUEUE_SNAPSHOT_TTL = float(os.getenv('QUEUE_SNAPSHOT_TTL', 30))
+QUEUE_FETCH_CONCURRENCY = int(os.getenv('QUEUE_FETCH_CONCURRENCY', 8))
+# Queue places a kilometre of distance is worth when ranking near a postal code
+QUEUE_DISTANCE_WEIGHT = float(os.getenv('QUEUE_DISTANCE_WEIGHT', 1.0))
+RANKING_SIZE: int = 10
+
+# Approximate centre (latitude, longitude) of each postal district, with the postal sectors it covers.
+# Distances between postal codes are estimated from these, to within a few kilometres.
+POSTAL_DISTRICTS: list[tuple[tuple[float, float], tuple[int, ...]]] = [
+    ((1.2830, 103.8513), (1, 2, 3, 4, 5, 6)),
+    ((1.2760, 103.8430), (7, 8)),
+    ((1.2850, 103.8070), (14, 15, 16)),
+    ((1.2650, 103.8220), (9, 10)),
+    ((1.3000, 103.7750), (11, 12, 13)),
+    ((1.2930, 103.8520), (17,)),
+    ((1.3000, 103.8600), (18, 19)),
+    ((1.3080, 103.8510), (20, 21)),
+    ((1.3040, 103.8320), (22, 23)),
+    ((1.3180, 103.8000), (24, 25, 26, 27)),
+    ((1.3250, 103.8400), (28, 29, 30)),
+    ((1.3300, 103.8550), (31, 32, 33)),
+    ((1.3350, 103.8800), (34, 35, 36, 37)),
+    ((1.3180, 103.8950), (38, 39, 40, 41)),
+    ((1.3050, 103.9050), (42, 43, 44, 45)),
+    ((1.3240, 103.9300), (46, 47, 48)),
+    ((1.3600, 103.9800), (49, 50, 81)),
+    ((1.3550, 103.9450), (51, 52)),
+    ((1.3700, 103.8900), (53, 54, 55, 82)),
+    ((1.3600, 103.8450), (56, 57)),
+    ((1.3400, 103.7750), (58, 59)),
+    ((1.3400, 103.7100), (60, 61, 62, 63, 64)),
+    ((1.3700, 103.7600), (65, 66, 67, 68)),
+    ((1.4100, 103.7200), (69, 70, 71)),
+    ((1.4300, 103.7700), (72, 73)),
+    ((1.3900, 103.8200), (77, 78)),
+    ((1.4300, 103.8300), (75, 76)),
+    ((1.4000, 103.8700), (79, 80))
+]
+KM_PER_DEGREE: float = 111.32
+# (latitude, longitude) by postal sector, NaN for sectors not in use, built by sector_coordinates() on first use
+_sector_coordinates: np.ndarray | None = None
+
+# Queue counts of every clinic from the last round of calls: (time fetched, clinic IDs, counts with NaN if unknown)
+snapshot: tuple[float, np.ndarray, np.ndarray] | None = None
+# Only one round of calls runs at a time; users arriving meanwhile wait for it instead of starting another
+fetch_lock = asyncio.Lock()
+
+
+""" START OF QUEUE COUNT METHODS """
+
+
+# Queue count of one clinic from the backend, None if unavailable
+def fetch_count(clinic_id: int) -> int | None:
+    result = api.get(f"queue/get/count/{clinic_id}", timeout=10)
+    if result.status_code != 200:
+        return None
+    queue_dict = result.json()
+    clinic_directory.record_queue_count(clinic_id, queue_dict.get('clinicName'), queue_dict.get('count'))
+    return queue_dict.get('count')
+
+
+# Fetch the queue counts of all clinics concurrently, QUEUE_FETCH_CONCURRENCY at a time
+async def fetch_counts(clinic_ids: np.ndarray) -> np.ndarray:
+    semaphore = asyncio.Semaphore(QUEUE_FETCH_CONCURRENCY)
+
+    async def fetch(clinic_id: int) -> int | None:
+        # Counts pushed by the backend are current, no need to ask for them
+        pushed = clinic_directory.get_pushed_queue_count(clinic_id)
+        if pushed is not None:
+            return pushed[1]
+        async with semaphore:
+            try:
+                return await asyncio.to_thread(fetch_count, clinic_id)
+            except Exception as exc:
+                logger.warning(f"Could not fetch queue count of clinic [{clinic_id}]: {exc!r}")
+                return None
+
+    with tracing.span("queue_ranking.fetch_counts", clinics=len(clinic_ids)):
+        counts = await asyncio.gather(*[fetch(int(clinic_id)) for clinic_id in clinic_ids])
+    return np.array([np.nan if count is None else count for count in counts], dtype=float)
+
+
+# Queue counts of every clinic in the directory, from the snapshot while it is fresh
+async def get_counts() -> tuple[np.ndarray, np.ndarray]:
+    global snapshot
+
+    async with fetch_lock:
+        clinic_ids = np.fromiter(clinic_directory.clinics, dtype=np.int64, count=len(clinic_directory.clinics))
+        if (snapshot is None or time.time() - snapshot[0] > QUEUE_SNAPSHOT_TTL
+                or not np.array_equal(snapshot[1], clinic_ids)):
+            started_at = time.perf_counter()
+            snapshot = (time.time(), clinic_ids, await fetch_counts(clinic_ids))
+            logger.info(f"Queue counts fetched | {len(clinic_ids)} clinics, "
+                        f"{np.count_nonzero(np.isnan(snapshot[2]))} unavailable, "
+                        f"{(time.perf_counter() - started_at) * 1000:.0f} ms")
+        return snapshot[1], snapshot[2]
+
+
+""" END OF QUEUE COUNT METHODS """
+
+""" START OF RANKING METHODS """
+
+
+# Coordinates of every postal sector, built from POSTAL_DISTRICTS the first time a ranking needs them
+def sector_coordinates() -> np.ndarray:
+    global _sector_coordinates
+    if _sector_coordinates is None:
+        _sector_coordinates = np.full((100, 2), np.nan)
+        for centre, sectors in POSTAL_DISTRICTS:
+            _sector_coordinates[list(sectors)] = centre
+    return _sector_coordinates
+
+
+# Approximate distance in km from a postal code to each of a set of postal codes, NaN where unknown
+def distances(postal_code: int, postal_codes: np.ndarray) -> np.ndarray:
+    coordinates = sector_coordinates()
+    origin = coordinates[postal_code // 10000]
+    points = coordinates[postal_codes // 10000 % 100]
+    delta_lat = points[:, 0] - origin[0]
+    delta_lon = (points[:, 1] - origin[1]) * np.cos(np.radians(origin[0]))
+    return np.hypot(delta_lat, delta_lon) * KM_PER_DEGREE
+
+
+# Clinics with the shortest queues, optionally weighted by distance from a postal code: (clinic ID, count, km or None).
+# Also returns how many clinics could not be ranked, for lack of a queue count or (near a postal code) a location.
+def rank(clinic_ids: np.ndarray, counts: np.ndarray, postal_code: int | None = None,
+         size: int = RANKING_SIZE) -> tuple[list[tuple[int, int, float | None]], int, int]:
+    km = None
+    score = counts.copy()
+    if postal_code is not None:
+        postal_codes = np.array([int(clinic_directory.clinics[int(clinic_id)].get('clinicPostal') or 0)
+                                 for clinic_id in clinic_ids], dtype=np.int64)
+        km = distances(postal_code, postal_codes)
+        score += QUEUE_DISTANCE_WEIGHT * km
+
+    # Clinics with unknown counts (or locations) score NaN, which sorts last and is counted instead of ranked
+    order = np.argsort(score, kind='stable')
+    order = order[~np.isnan(score[order])][:size]
+    no_count = int(np.count_nonzero(np.isnan(counts)))
+    no_location = int(np.count_nonzero(np.isnan(score))) - no_count
+    ranking = [(int(clinic_ids[i]), int(counts[i]), None if km is None else float(km[i])) for i in order]
+    return ranking, no_count, no_location
+
+
+""" END OF RANKING METHODS """
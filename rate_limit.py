@@ -0,0 +1,157 @@
+import functools
+import logging
+import os
+import time
+
+from array import array
+from collections import OrderedDict
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+# "<requests>/<seconds>" per chat, for every flow without its own entry in RATE_LIMITS
+RATE_LIMIT_DEFAULT = os.getenv('RATE_LIMIT_DEFAULT', '10/60')
+# Per-flow overrides, e.g. "GetAppointments=5/60,FindClinic=20/60"
+RATE_LIMITS = os.getenv('RATE_LIMITS', '')
+# Chats tracked per flow, the least recently seen one is evicted when the table is full
+RATE_LIMIT_CHATS = int(os.getenv('RATE_LIMIT_CHATS', 10000))
+
+THROTTLED_MESSAGE = "You're sending requests too quickly. Please wait {seconds} seconds and try again."
+
+
+""" START OF SUPPORT METHODS """
+
+
+# Parse "<requests>/<seconds>" into (burst, tokens per second)
+def parse_limit(limit: str) -> tuple[float, float]:
+    requests, _, seconds = limit.partition('/')
+    return float(requests), float(requests) / float(seconds or 1)
+
+
+# Token buckets for up to `capacity` chats, kept in fixed-size arrays (24 bytes per chat plus the slot map).
+# A bucket that has been idle long enough to refill is indistinguishable from a new one, so such buckets are
+# evicted as they age out; when the table is still full the least recently seen chat makes room.
+class TokenBucketTable:
+    def __init__(self, burst: float, rate: float, capacity: int = RATE_LIMIT_CHATS) -> None:
+        self.burst = burst
+        self.rate = rate
+        self.refill_time = burst / rate
+        self.capacity = capacity
+        self.tokens = array('d', bytes(8 * capacity))
+        self.updated_at = array('d', bytes(8 * capacity))
+        # Whether the chat has been told it is throttled since its last allowed request
+        self.warned = array('b', bytes(capacity))
+        # chat ID -> slot, least recently seen first
+        self.slots: OrderedDict[int, int] = OrderedDict()
+        self.free = list(range(capacity - 1, -1, -1))
+
+    # Evict idle buckets from the front, and the least recently seen one if there is still no free slot
+    def _evict(self, now: float) -> None:
+        while self.slots:
+            chat_id, slot = next(iter(self.slots.items()))
+            if now - self.updated_at[slot] < self.refill_time and self.free:
+                break
+            del self.slots[chat_id]
+            self.free.append(slot)
+            if now - self.updated_at[slot] < self.refill_time:
+                break
+
+    # Slot of a chat's bucket, starting a full one for chats not in the table
+    def _slot(self, chat_id: int, now: float) -> int:
+        slot = self.slots.get(chat_id)
+        if slot is not None:
+            self.slots.move_to_end(chat_id)
+            return slot
+
+        self._evict(now)
+        slot = self.free.pop()
+        self.slots[chat_id] = slot
+        self.tokens[slot] = self.burst
+        self.updated_at[slot] = now
+        self.warned[slot] = 0
+        return slot
+
+    # Take a token for the chat, returns 0 if allowed or else the seconds until the next token
+    def acquire(self, chat_id: int) -> float:
+        now = time.monotonic()
+        slot = self._slot(chat_id, now)
+
+        tokens = min(self.burst, self.tokens[slot] + (now - self.updated_at[slot]) * self.rate)
+        self.updated_at[slot] = now
+        if tokens >= 1:
+            self.tokens[slot] = tokens - 1
+            self.warned[slot] = 0
+            return 0.0
+
+        self.tokens[slot] = tokens
+        return (1 - tokens) / self.rate
+
+    # Mark the chat as told it is throttled, returns False if it already was
+    def warn(self, chat_id: int) -> bool:
+        slot = self.slots[chat_id]
+        if self.warned[slot]:
+            return False
+        self.warned[slot] = 1
+        return True
+
+
+limits: dict[str, tuple[float, float]] = {
+    flow_name.strip(): parse_limit(limit)
+    for flow_name, _, limit in (entry.partition('=') for entry in RATE_LIMITS.split(',') if entry.strip())
+}
+tables: dict[str, TokenBucketTable] = {}
+throttled: int = 0
+
+
+# Bucket table of a flow, using its RATE_LIMITS entry or RATE_LIMIT_DEFAULT
+def get_table(flow_name: str) -> TokenBucketTable:
+    table = tables.get(flow_name)
+    if table is None:
+        table = tables[flow_name] = TokenBucketTable(*limits.get(flow_name, parse_limit(RATE_LIMIT_DEFAULT)))
+    return table
+
+
+""" END OF SUPPORT METHODS """
+
+""" START OF BOT METHODS """
+
+
+# Decorator for controller actions that call the backend: each chat gets a token bucket per flow.
+# Over the limit, the chat is told once how long to wait and further requests are ignored until a token is
+# available again; the conversation stays in its current state.
+def limited(flow_name: str):
+    table = get_table(flow_name)
+
+    def decorator(action):
+        @functools.wraps(action)
+        async def rate_limited(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            global throttled
+
+            chat_id = update.effective_chat.id
+            wait = table.acquire(chat_id)
+            if not wait:
+                return await action(update, context)
+
+            throttled += 1
+            query = update.callback_query
+            if table.warn(chat_id):
+                logger.warning(f"{update.effective_user.first_name} [{update.effective_user.id}] | "
+                               f"Throttled in [{flow_name}] for {wait:.0f}s.")
+                message = THROTTLED_MESSAGE.format(seconds=max(1, round(wait)))
+                if query is not None:
+                    await query.answer(message)
+                elif update.message is not None:
+                    await update.message.reply_text(message)
+            elif query is not None:
+                await query.answer()
+            return None
+
+        return rate_limited
+
+    return decorator
+
+
+""" END OF BOT METHODS """
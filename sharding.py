@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from http import HTTPStatus
+from multiprocessing.queues import Queue
+from typing import Callable
+
+import admission
+import analytics
+import constants
+import helpers
+import httpserver
+import lifecycle
+import profiler
+import push_events
+import tracing
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+TELEGRAM_BOT_API_TOKEN = constants.TELEGRAM_BOT_API_TOKEN
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', os.cpu_count() or 1))
+PORT = int(os.getenv('PORT', 8443))
+
+# Maximum number of queued updates a worker takes from its inbox per wake-up
+WORKER_BATCH_SIZE: int = 64
+
+# Builds the Application run by one worker process, called with the shard index
+ApplicationFactory = Callable[[int], Application]
+
+
+""" START OF SHARDING METHODS
+
+Every update belongs to exactly one shard, decided by its chat ID. A chat's ConversationHandler state therefore
+only ever lives in one worker process and needs no locking or sharing.
+"""
+
+
+# Shard that owns a chat
+def shard_for(chat_id: int, workers: int) -> int:
+    return chat_id % workers
+
+
+# Find the chat (or, failing that, the user) an update belongs to, without building telegram objects
+def extract_chat_id(data: dict) -> int:
+    for key, value in data.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        if 'chat' in value:
+            return value['chat']['id']
+        if isinstance(value.get('message'), dict):
+            return value['message']['chat']['id']
+        if 'from' in value:
+            return value['from']['id']
+        if 'user' in value:
+            return value['user']['id']
+
+    # Updates with no chat or user (e.g. polls) always go to the first shard
+    return 0
+
+
+# Routes raw update payloads to the inbox of the owning worker, along with the time they arrived
+class Dispatcher:
+    def __init__(self, inboxes: list[Queue]) -> None:
+        self.inboxes = inboxes
+        self.routed = [0] * len(inboxes)
+
+    def dispatch(self, payload: bytes) -> int:
+        data = json.loads(payload)
+        if not isinstance(data, dict):
+            raise ValueError(f"Update payload is a JSON {type(data).__name__}, not an object")
+        shard = shard_for(extract_chat_id(data), len(self.inboxes))
+        self.inboxes[shard].put((time.monotonic(), payload))
+        self.routed[shard] += 1
+        return shard
+
+    def close(self) -> None:
+        for inbox in self.inboxes:
+            inbox.put(None)
+
+
+""" END OF SHARDING METHODS """
+
+""" START OF WORKER METHODS """
+
+
+# Default worker application: the normal bot, fed by the dispatcher instead of an Updater
+def build_application(shard: int) -> Application:
+    import main
+
+    # Each shard appends to its own analytics file; analytics_report.py reads them together
+    analytics.ANALYTICS_PATH = f"{analytics.ANALYTICS_PATH}.{shard}"
+    tracing.TRACE_PATH = f"{tracing.TRACE_PATH}.{shard}"
+    # Each shard caches its own data, so the backend pushes to every shard's receiver: PUSH_EVENTS_PORT + shard
+    if push_events.PUSH_EVENTS_PORT:
+        push_events.PUSH_EVENTS_PORT += shard
+
+    # Every shard keeps its own caches and background tasks, but bot commands are set (and an interrupted broadcast
+    # resumed) by the first shard only
+    helpers.PRIMARY = shard == 0
+    profiler.shard = shard
+
+    builder = (Application.builder().token(token=TELEGRAM_BOT_API_TOKEN).updater(None)
+               .post_init(helpers.post_init).post_shutdown(helpers.post_shutdown))
+    application = builder.build()
+    main.add_handlers(application)
+    return application
+
+
+# Process updates from the inbox until the dispatcher sends None
+async def serve_shard(shard: int, inbox: Queue, application: Application) -> tuple[int, float]:
+    loop = asyncio.get_running_loop()
+    processed = 0
+
+    async with application:
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+
+        started_at = time.perf_counter()
+        running = True
+        while running:
+            batch = [await loop.run_in_executor(None, inbox.get)]
+            try:
+                while len(batch) < WORKER_BATCH_SIZE:
+                    batch.append(inbox.get_nowait())
+            except queue.Empty:
+                pass
+
+            if None in batch:
+                batch = batch[:batch.index(None)]
+                running = False
+
+            # Record the whole batch as queued first, so that admission.admit can drop repeats within it
+            updates = []
+            for arrived_at, payload in batch:
+                update = Update.de_json(json.loads(payload), application.bot)
+                admission.arrived(update, arrived_at)
+                updates.append(update)
+
+            for update in updates:
+                await application.process_update(update)
+                processed += 1
+
+        elapsed = time.perf_counter() - started_at
+        # application.stop waits for every task it created, so cut a profiling window and a broadcast short first
+        await lifecycle.pause_jobs()
+        await application.stop()
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
+
+    return processed, elapsed
+
+
+# Entry point of a worker process. Stop signals reach every process of the dyno, but the updates in a worker's inbox
+# have already been acknowledged to Telegram, so workers ignore them and drain until the front sends None.
+def run_worker(shard: int, inbox: Queue, results: Queue | None,
+               factory: ApplicationFactory = build_application) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    processed, elapsed = asyncio.run(serve_shard(shard, inbox, factory(shard)))
+    logger.info(f"Shard [{shard}] | Processed {processed} updates in {elapsed:.2f}s.")
+    if results is not None:
+        results.put((shard, processed, elapsed))
+
+
+# Start one process per shard, returning the processes and their inboxes
+def start_workers(workers: int, results: Queue | None = None,
+                  factory: ApplicationFactory = build_application) -> tuple[list, list[Queue]]:
+    context = multiprocessing.get_context('spawn')
+    inboxes = [context.Queue() for _ in range(workers)]
+    processes = [context.Process(target=run_worker, args=(shard, inboxes[shard], results, factory),
+                                 name=f"shard-{shard}", daemon=True)
+                 for shard in range(workers)]
+    for process in processes:
+        process.start()
+    return processes, inboxes
+
+
+""" END OF WORKER METHODS """
+
+""" START OF FRONT DISPATCHER METHODS """
+
+
+# Accept Telegram webhook requests and hand them to the dispatcher
+async def serve_front(dispatcher: Dispatcher, port: int) -> None:
+    async def on_request(method: str, path: str, headers: dict[str, str], body: bytes) -> tuple[int, bytes]:
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, b''
+        if WEBHOOK_SECRET and headers.get('x-telegram-bot-api-secret-token') != WEBHOOK_SECRET:
+            return HTTPStatus.FORBIDDEN, b''
+        try:
+            dispatcher.dispatch(body)
+        except (ValueError, KeyError, TypeError):
+            return HTTPStatus.BAD_REQUEST, b''
+        return HTTPStatus.OK, b''
+
+    server = await httpserver.serve('0.0.0.0', port, on_request)
+
+    if WEBHOOK_URL:
+        async with Bot(TELEGRAM_BOT_API_TOKEN) as front_bot:
+            await front_bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    logger.info(f"Front dispatcher listening on port {port} for {len(dispatcher.inboxes)} shards.")
+    async with server:
+        await stop_event.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the bot as N worker processes sharded by chat ID.")
+    parser.add_argument('--workers', type=int, default=SHARD_WORKERS)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+
+    processes, inboxes = start_workers(args.workers)
+    dispatcher = Dispatcher(inboxes)
+    try:
+        asyncio.run(serve_front(dispatcher, args.port))
+    finally:
+        dispatcher.close()
+        for process in processes:
+            process.join()
+
+
+""" END OF FRONT DISPATCHER METHODS """
+
+if __name__ == "__main__":
+    main()
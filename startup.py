@@ -0,0 +1,42 @@
+import logging
+import time
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Time at which the startup path began, i.e. when main.py imported this module
+STARTED_AT: float = time.perf_counter()
+
+# Ordered list of (milestone, seconds since STARTED_AT)
+marks: list[tuple[str, float]] = []
+first_update_seen: bool = False
+
+
+# Record a startup milestone
+def mark(name: str) -> float:
+    elapsed = time.perf_counter() - STARTED_AT
+    marks.append((name, elapsed))
+    return elapsed
+
+
+# Format the recorded milestones as a timing report
+def report() -> str:
+    lines = ["Startup timing report:"]
+    prev = 0.0
+    for name, elapsed in marks:
+        lines.append(f"  {name:<28} {elapsed * 1000:9.1f} ms  (+{(elapsed - prev) * 1000:.1f} ms)")
+        prev = elapsed
+    return "\n".join(lines)
+
+
+# Record time-to-first-update and log the full report, once per process
+async def on_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    global first_update_seen
+    if first_update_seen:
+        return
+
+    first_update_seen = True
+    mark("first update")
+    logger.info(report())
@@ -0,0 +1,501 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from collections.abc import Iterator, MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+from cachetools import TTLCache
+from telegram import Update
+from telegram.ext import Application, ContextTypes, ConversationHandler
+
+import constants
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', os.path.join(constants.CACHE_DIR, 'state.sqlite3'))
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', 10000))
+STATE_CACHE_TTL = float(os.getenv('STATE_CACHE_TTL', 600))
+# State of conversations left untouched this long (e.g. abandoned half-way) is deleted
+STATE_TTL = float(os.getenv('STATE_TTL', 24 * 60 * 60))
+STATE_EXPIRE_INTERVAL: float = 60 * 60
+
+
+# Raised when a write is based on a version that another replica has already replaced
+class VersionConflict(Exception):
+    pass
+
+
+""" START OF BACKENDS
+
+Every key holds a JSON-serialisable value and a version number. A missing key has version 0, and each successful
+write increments the version. Writes must name the version they were based on, so a replica holding a stale
+copy gets a VersionConflict instead of overwriting newer state.
+"""
+
+
+class StateBackend(ABC):
+    # Returns (value, version), or (None, 0) if the key does not exist
+    @abstractmethod
+    def get(self, key: str) -> tuple[Any, int]:
+        ...
+
+    # Writes value if the stored version still equals version, returns the new version
+    @abstractmethod
+    def set(self, key: str, value: Any, version: int) -> int:
+        ...
+
+    # Deletes the key if the stored version still equals version
+    @abstractmethod
+    def delete(self, key: str, version: int) -> None:
+        ...
+
+    # Keys starting with prefix
+    @abstractmethod
+    def keys(self, prefix: str = "") -> list[str]:
+        ...
+
+    # Deletes keys not written for max_age seconds, returns how many
+    @abstractmethod
+    def expire(self, max_age: float) -> int:
+        ...
+
+    # {key: (value, version)} for several keys at once
+    def get_many(self, keys: list[str]) -> dict[str, tuple[Any, int]]:
+        return {key: self.get(key) for key in keys}
+
+    # Whether another process may have written since the last call; backends that cannot tell always say so
+    def changed_elsewhere(self) -> bool:
+        return True
+
+    # Wait until every write made so far is stored
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+# Process-local backend, the default for a single bot process
+class InMemoryStateBackend(StateBackend):
+    def __init__(self) -> None:
+        # key: (value, version, time written)
+        self._data: dict[str, tuple[Any, int, float]] = {}
+
+    def get(self, key: str) -> tuple[Any, int]:
+        entry = self._data.get(key)
+        return (None, 0) if entry is None else (entry[0], entry[1])
+
+    def set(self, key: str, value: Any, version: int) -> int:
+        current = self.get(key)[1]
+        if current != version:
+            raise VersionConflict(key)
+        self._data[key] = (value, version + 1, time.monotonic())
+        return version + 1
+
+    def delete(self, key: str, version: int) -> None:
+        current = self.get(key)[1]
+        if current != version:
+            raise VersionConflict(key)
+        self._data.pop(key, None)
+
+    def keys(self, prefix: str = "") -> list[str]:
+        return [key for key in self._data if key.startswith(prefix)]
+
+    def expire(self, max_age: float) -> int:
+        cutoff = time.monotonic() - max_age
+        expired = [key for key, entry in self._data.items() if entry[2] < cutoff]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    # Only this process writes to it
+    def changed_elsewhere(self) -> bool:
+        return False
+
+
+# Backend shared by every process that opens the same database file (WAL allows concurrent readers and a writer)
+class SQLiteStateBackend(StateBackend):
+    def __init__(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state ("
+                           "key TEXT PRIMARY KEY, value TEXT NOT NULL, version INTEGER NOT NULL)")
+        # Databases created before expiry was added lack the write time, their rows count as written now
+        if 'updated_at' not in [row[1] for row in self._conn.execute("PRAGMA table_info(state)")]:
+            self._conn.execute(f"ALTER TABLE state ADD COLUMN updated_at REAL NOT NULL DEFAULT {time.time()}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS state_updated_at ON state (updated_at)")
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get(self, key: str) -> tuple[Any, int]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, version FROM state WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, 0
+        return json.loads(row[0]), row[1]
+
+    def get_many(self, keys: list[str]) -> dict[str, tuple[Any, int]]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT key, value, version FROM state WHERE key IN ({', '.join('?' * len(keys))})",
+                                      keys).fetchall()
+        entries = {key: (None, 0) for key in keys}
+        entries.update((key, (json.loads(value), version)) for key, value, version in rows)
+        return entries
+
+    def set(self, key: str, value: Any, version: int) -> int:
+        encoded = json.dumps(value)
+        with self._lock:
+            if version == 0:
+                cursor = self._conn.execute("INSERT OR IGNORE INTO state (key, value, version, updated_at) "
+                                            "VALUES (?, ?, 1, ?)", (key, encoded, time.time()))
+            else:
+                cursor = self._conn.execute("UPDATE state SET value = ?, version = version + 1, updated_at = ? "
+                                            "WHERE key = ? AND version = ?", (encoded, time.time(), key, version))
+        if cursor.rowcount == 0:
+            raise VersionConflict(key)
+        return version + 1
+
+    def delete(self, key: str, version: int) -> None:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM state WHERE key = ? AND version = ?", (key, version))
+        if cursor.rowcount == 0 and version != 0:
+            raise VersionConflict(key)
+
+    def keys(self, prefix: str = "") -> list[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM state WHERE substr(key, 1, ?) = ?",
+                                      (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def expire(self, max_age: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM state WHERE updated_at < ?", (time.time() - max_age,))
+        return cursor.rowcount
+
+    # SQLite bumps data_version whenever another connection commits to the database
+    def changed_elsewhere(self) -> bool:
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        changed = data_version != self._data_version
+        self._data_version = data_version
+        return changed
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# Local cache in front of a shared backend, keeps database calls off the event loop. Every call to the shared backend
+# runs in one worker thread, in order: writes are made to the cache at once and stored in the background (a conflict
+# found then only drops the cached entry), and the state an update needs is loaded by prefetch before it is handled.
+# prefetch also empties the cache whenever another replica has written since, so handlers never act on its stale state.
+class CachedStateBackend(StateBackend):
+    def __init__(self, backend: StateBackend, maxsize: int = STATE_CACHE_SIZE, ttl: float = STATE_CACHE_TTL) -> None:
+        self.backend = backend
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-backend")
+        # Set when keys were expired, so that the next prefetch drops what the cache still holds of them
+        self._expired = False
+        self.hits = 0
+        self.misses = 0
+
+    # Run a call to the shared backend after the ones queued before it
+    def _submit(self, function, *args) -> Future:
+        return self._executor.submit(function, *args)
+
+    # Runs in the worker thread, the cache is only ever touched on the event loop
+    def _load(self, keys: list[str]) -> tuple[bool, dict[str, tuple[Any, int]]]:
+        stale = self.backend.changed_elsewhere() or self._expired
+        self._expired = False
+        return stale, self.backend.get_many(keys)
+
+    # Load keys into the cache without blocking the event loop
+    async def prefetch(self, keys: list[str]) -> None:
+        stale, entries = await asyncio.wrap_future(self._submit(self._load, keys))
+        if stale:
+            self._cache.clear()
+        self._cache.update(entries)
+
+    def get(self, key: str) -> tuple[Any, int]:
+        entry = self._cache.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        # Not prefetched, e.g. read outside an update: wait for the queued writes, then read
+        self.misses += 1
+        entry = self._submit(self.backend.get, key).result()
+        self._cache[key] = entry
+        return entry
+
+    # Drop the cached entry of a write the shared backend turned down
+    def _on_written(self, key: str, done: asyncio.Future) -> None:
+        if done.exception() is None:
+            return
+        self._cache.pop(key, None)
+        if isinstance(done.exception(), VersionConflict):
+            logger.warning(f"State for [{key}] was changed by another replica, keeping the newer state.")
+        else:
+            logger.error(f"Could not store state for [{key}]: {done.exception()!r}")
+
+    # Store a write in the background, or straight away when no event loop is running (e.g. in a script)
+    def _write(self, key: str, function, *args) -> None:
+        future = self._submit(function, *args)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            try:
+                future.result()
+            except VersionConflict:
+                self._cache.pop(key, None)
+                raise
+            return
+        asyncio.wrap_future(future, loop=loop).add_done_callback(lambda done: self._on_written(key, done))
+
+    def set(self, key: str, value: Any, version: int) -> int:
+        if self.get(key)[1] != version:
+            raise VersionConflict(key)
+        self._cache[key] = (value, version + 1)
+        self._write(key, self.backend.set, key, value, version)
+        return version + 1
+
+    def delete(self, key: str, version: int) -> None:
+        if self.get(key)[1] != version:
+            raise VersionConflict(key)
+        self._cache[key] = (None, 0)
+        self._write(key, self.backend.delete, key, version)
+
+    def keys(self, prefix: str = "") -> list[str]:
+        return self._submit(self.backend.keys, prefix).result()
+
+    def expire(self, max_age: float) -> int:
+        expired = self._submit(self.backend.expire, max_age).result()
+        self._expired = True
+        return expired
+
+    def flush(self) -> None:
+        self._submit(lambda: None).result()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.backend.close()
+
+
+# Build the backend selected by STATE_BACKEND
+def create_backend(kind: str = STATE_BACKEND) -> StateBackend:
+    match kind:
+        case 'memory':
+            return InMemoryStateBackend()
+        case 'sqlite':
+            return CachedStateBackend(SQLiteStateBackend(STATE_DB_PATH))
+        case _:
+            raise ValueError(f"Unknown STATE_BACKEND: {kind}")
+
+
+BACKEND: StateBackend = create_backend()
+
+
+# PTB 20.0 marks the chat and user of every update for the next persistence run, which never comes without a
+# persistence, so the marks would pile up for every chat and user ever seen
+def drop_persistence_marks(application: Application) -> None:
+    if application.persistence is None:
+        application._chat_ids_to_be_updated_in_persistence.clear()
+        application._user_ids_to_be_updated_in_persistence.clear()
+
+
+# Delete the state of conversations left untouched for STATE_TTL, started by post_init
+async def expire_periodically(application: Application) -> None:
+    while True:
+        await asyncio.sleep(STATE_EXPIRE_INTERVAL)
+        drop_persistence_marks(application)
+        try:
+            # The in-memory sweep is quick and must not run while handlers change the dict; SQLite goes to a thread
+            if isinstance(BACKEND, InMemoryStateBackend):
+                expired = BACKEND.expire(STATE_TTL)
+            else:
+                expired = await asyncio.to_thread(BACKEND.expire, STATE_TTL)
+            if expired:
+                logger.info(f"State expired | {expired} keys untouched for {STATE_TTL:.0f}s")
+        except Exception as exc:
+            logger.warning(f"State expiry failed: {exc!r}")
+
+
+# Store every write made so far before the process exits, run by post_shutdown
+async def flush() -> None:
+    await asyncio.to_thread(BACKEND.flush)
+
+
+""" END OF BACKENDS """
+
+""" START OF ADAPTERS """
+
+# Every chat state store and conversation mapping, whose keys prefetch loads for an update
+stores: list["ChatStateStore"] = []
+conversations: list["SharedConversations"] = []
+
+
+
+# Versions of keys as read at the start of the update handling them, so that writes made while handling it are
+# checked against that version: a replica that moved the chat on meanwhile causes a VersionConflict. Only keys that
+# exist are kept, and only for as long as a conversation may reasonably take.
+class ReadVersions:
+    def __init__(self) -> None:
+        self._versions: TTLCache = TTLCache(maxsize=STATE_CACHE_SIZE, ttl=STATE_TTL)
+
+    def read(self, backend: StateBackend, key: str) -> tuple[Any, int]:
+        value, version = backend.get(key)
+        if version:
+            self._versions[key] = version
+        else:
+            self._versions.pop(key, None)
+        return value, version
+
+    # Version the next write has to be based on: the one read earlier, or else the current one
+    def base(self, backend: StateBackend, key: str) -> int:
+        version = self._versions.get(key)
+        return version if version is not None else backend.get(key)[1]
+
+    def written(self, key: str, version: int) -> None:
+        if version:
+            self._versions[key] = version
+        else:
+            self._versions.pop(key, None)
+
+
+# Per-controller chat state, replacing the process-local state_dict of each controller
+class ChatStateStore:
+    def __init__(self, namespace: str, backend: StateBackend = None) -> None:
+        self.namespace = namespace
+        self.backend = backend or BACKEND
+        self.versions = ReadVersions()
+        stores.append(self)
+
+    def _key(self, chat_id: int) -> str:
+        return f"chat:{self.namespace}:{chat_id}"
+
+    def get(self, chat_id: int) -> int | None:
+        return self.versions.read(self.backend, self._key(chat_id))[0]
+
+    def store(self, chat_id: int, state: int) -> bool:
+        key = self._key(chat_id)
+        try:
+            self.versions.written(key, self.backend.set(key, state, self.versions.base(self.backend, key)))
+            return True
+        except VersionConflict:
+            self.versions.written(key, 0)
+            logger.warning(f"State for [{key}] was changed by another replica, keeping the newer state.")
+            return False
+
+    def clear(self, chat_id: int) -> bool:
+        key = self._key(chat_id)
+        version = self.versions.base(self.backend, key)
+        self.versions.written(key, 0)
+        if version == 0:
+            return False
+        try:
+            self.backend.delete(key, version)
+            return True
+        except VersionConflict:
+            return False
+
+
+# ConversationHandler state mapping backed by a StateBackend, keyed by conversation name and (chat, user)
+class SharedConversations(MutableMapping):
+    def __init__(self, name: str, backend: StateBackend) -> None:
+        self.prefix = f"conv:{name}:"
+        self.backend = backend
+        self.versions = ReadVersions()
+        # Non-blocking handlers store unpicklable PendingState objects, those never leave the process
+        self._pending: dict[tuple, Any] = {}
+        conversations.append(self)
+
+    def _key(self, key: tuple) -> str:
+        return self.prefix + ":".join(str(part) for part in key)
+
+    # ConversationHandler.check_update reads the state here when an update arrives
+    def __getitem__(self, key: tuple) -> Any:
+        if key in self._pending:
+            return self._pending[key]
+        value, version = self.versions.read(self.backend, self._key(key))
+        if version == 0:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: tuple, value: Any) -> None:
+        if not isinstance(value, (int, str, type(None))):
+            self._pending[key] = value
+            return
+
+        self._pending.pop(key, None)
+        backend_key = self._key(key)
+        try:
+            self.versions.written(backend_key, self.backend.set(backend_key, value,
+                                                                self.versions.base(self.backend, backend_key)))
+        except VersionConflict:
+            self.versions.written(backend_key, 0)
+            logger.warning(f"Conversation [{backend_key}] was advanced by another replica, update dropped.")
+
+    def __delitem__(self, key: tuple) -> None:
+        if self._pending.pop(key, None) is not None:
+            return
+        backend_key = self._key(key)
+        version = self.versions.base(self.backend, backend_key)
+        self.versions.written(backend_key, 0)
+        if version == 0:
+            raise KeyError(key)
+        try:
+            self.backend.delete(backend_key, version)
+        except VersionConflict:
+            logger.warning(f"Conversation [{backend_key}] was advanced by another replica, end dropped.")
+
+    def __iter__(self) -> Iterator[tuple]:
+        yield from self._pending
+        for backend_key in self.backend.keys(self.prefix):
+            yield tuple(int(part) for part in backend_key[len(self.prefix):].split(":"))
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self.backend.keys(self.prefix))
+
+
+# ConversationHandler whose states live in the shared backend instead of process memory
+class SharedConversationHandler(ConversationHandler):
+    def __init__(self, *args, backend: StateBackend = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if self.name is None:
+            raise ValueError("SharedConversationHandler requires a name.")
+        self._conversations = SharedConversations(self.name, backend or BACKEND)
+
+    # Put the update's conversation into a state, or end it with None
+    def set_state(self, update: Update, state: object) -> None:
+        key = self._get_key(update)
+        if state is None:
+            self._conversations.pop(key, None)
+        else:
+            self._conversations[key] = state
+
+
+# Handler run before the conversation handlers: loads the chat's state from a shared backend in the background,
+# so that the handlers (ConversationHandler reads its state synchronously) find it in the cache
+async def prefetch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not isinstance(BACKEND, CachedStateBackend) or update.effective_chat is None or update.effective_user is None:
+        return
+
+    chat_id, user_id = update.effective_chat.id, update.effective_user.id
+    await BACKEND.prefetch([store._key(chat_id) for store in stores]
+                           + [conversation._key((chat_id, user_id)) for conversation in conversations])
+
+
+""" END OF ADAPTERS """
@@ -0,0 +1,218 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import time
+
+from telegram import Update
+from telegram.ext import Application, BaseHandler
+
+import constants
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+TRACE_PATH = os.getenv('TRACE_PATH', os.path.join(constants.CACHE_DIR, 'traces.jsonl'))
+# Traces are only kept if they took at least this long, or failed
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', 1000))
+TRACE_EXPORT_INTERVAL = float(os.getenv('TRACE_EXPORT_INTERVAL', 5))
+SERVICE_NAME = "dhrms-telegram-bot"
+
+# OTLP span kinds and status codes
+KIND_INTERNAL: int = 1
+KIND_SERVER: int = 2
+KIND_CLIENT: int = 3
+STATUS_OK: int = 1
+STATUS_ERROR: int = 2
+
+
+# One timed operation within a trace
+class Span:
+    __slots__ = ('name', 'kind', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name: str, kind: int, parent_id: str | None, attributes: dict) -> None:
+        self.name = name
+        self.kind = kind
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: str | None = None
+
+    def set(self, key: str, value: object) -> None:
+        self.attributes[key] = value
+
+    def fail(self, message: str) -> None:
+        self.error = message
+
+
+# Spans of one update
+class Trace:
+    __slots__ = ('trace_id', 'spans', 'failed')
+
+    def __init__(self) -> None:
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans: list[Span] = []
+        self.failed = False
+
+
+# Trace of the update being handled and the innermost open span, None outside update handling
+current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar('current_trace', default=None)
+current_span: contextvars.ContextVar[str | None] = contextvars.ContextVar('current_span', default=None)
+
+# Slow or failed traces waiting to be written, as OTLP-JSON lines
+pending: list[str] = []
+kept: int = 0
+discarded: int = 0
+
+
+""" START OF SPAN METHODS """
+
+
+# Time a block as a span of the current trace; does nothing outside a trace
+@contextlib.contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    new_span = Span(name, kind, current_span.get(), attributes)
+    token = current_span.set(new_span.span_id)
+    try:
+        yield new_span
+    except BaseException as exc:
+        new_span.fail(repr(exc))
+        raise
+    finally:
+        new_span.end_ns = time.time_ns()
+        current_span.reset(token)
+        trace.spans.append(new_span)
+        if new_span.error is not None:
+            trace.failed = True
+
+
+# Backend URI with personal data (NRICs) replaced by placeholders
+def redact(uri: str) -> str:
+    return re.sub(r"(nric/)[^/?]+", r"\1{nric}", uri)
+
+
+# Wrap a handler's handle_update so that every update it handles runs in a new trace
+def instrument(handler: BaseHandler) -> None:
+    handle_update = handler.handle_update
+
+    async def traced_handle_update(update, application, check_result, context):
+        trace = Trace()
+        trace_token = current_trace.set(trace)
+        span_token = current_span.set(None)
+        try:
+            with span("telegram.update", KIND_SERVER, **update_attributes(update)):
+                return await handle_update(update, application, check_result, context)
+        finally:
+            current_span.reset(span_token)
+            current_trace.reset(trace_token)
+            finish(trace)
+
+    handler.handle_update = traced_handle_update
+
+
+# Attributes of the root span: which update, and how long it waited in the admission queue
+def update_attributes(update: Update) -> dict:
+    import admission
+
+    return {
+        'telegram.update_id': update.update_id,
+        'telegram.chat_id': update.effective_chat.id if update.effective_chat else 0,
+        'telegram.update_type': 'callback_query' if update.callback_query is not None else 'message',
+        'admission.queue_time_ms': round(admission.queue_time.get() * 1000, 3)
+    }
+
+
+""" END OF SPAN METHODS """
+
+""" START OF EXPORT METHODS """
+
+
+# Tail sampling: keep the trace only if it was slow or failed
+def finish(trace: Trace) -> None:
+    global kept, discarded
+
+    root = trace.spans[-1]
+    if not trace.failed and (root.end_ns - root.start_ns) / 1e6 < TRACE_SLOW_MS:
+        discarded += 1
+        return
+
+    kept += 1
+    pending.append(json.dumps(to_otlp(trace), separators=(',', ':')))
+
+
+# Attribute value in OTLP's AnyValue form (64-bit integers are strings in OTLP-JSON)
+def otlp_value(value: object) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+# Trace as an OTLP-JSON ExportTraceServiceRequest
+def to_otlp(trace: Trace) -> dict:
+    spans = []
+    for item in trace.spans:
+        otlp_span = {
+            'traceId': trace.trace_id,
+            'spanId': item.span_id,
+            'name': item.name,
+            'kind': item.kind,
+            'startTimeUnixNano': str(item.start_ns),
+            'endTimeUnixNano': str(item.end_ns),
+            'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in item.attributes.items()],
+            'status': {'code': STATUS_ERROR, 'message': item.error} if item.error is not None else {'code': STATUS_OK}
+        }
+        if item.parent_id is not None:
+            otlp_span['parentSpanId'] = item.parent_id
+        spans.append(otlp_span)
+
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+        'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}]
+    }]}
+
+
+# Append lines to TRACE_PATH
+def append(lines: list[str]) -> None:
+    os.makedirs(os.path.dirname(TRACE_PATH) or '.', exist_ok=True)
+    with open(TRACE_PATH, 'a') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# Write the kept traces to TRACE_PATH, one OTLP-JSON request per line
+async def export() -> int:
+    if not pending:
+        return 0
+
+    lines = pending[:]
+    pending.clear()
+    try:
+        await asyncio.to_thread(append, lines)
+    except OSError as exc:
+        logger.warning(f"Could not write {len(lines)} traces: {exc!r}")
+        return 0
+    return len(lines)
+
+
+# Export the kept traces every TRACE_EXPORT_INTERVAL seconds
+async def export_periodically(application: Application) -> None:
+    while True:
+        await asyncio.sleep(TRACE_EXPORT_INTERVAL)
+        await export()
+
+
+""" END OF EXPORT METHODS """
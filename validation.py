@@ -0,0 +1,76 @@
+import logging
+import os
+
+from collections import Counter
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Essential Info
+NEGATIVE_CACHE_TTL = float(os.getenv('NEGATIVE_CACHE_TTL', 60))
+NEGATIVE_CACHE_SIZE = int(os.getenv('NEGATIVE_CACHE_SIZE', 10000))
+
+# NRIC/FIN check letters by prefix, indexed by the weighted digit sum modulo 11
+NRIC_WEIGHTS = (2, 7, 6, 5, 4, 3, 2)
+NRIC_OFFSETS = {'S': 0, 'T': 4, 'F': 0, 'G': 4, 'M': 3}
+NRIC_CHECK_LETTERS = {'S': "JZIHGFEDCBA", 'T': "JZIHGFEDCBA", 'F': "XWUTRQPNMLK", 'G': "XWUTRQPNMLK",
+                      'M': "XWUTRQPNJLK"}
+
+# Postal sectors (first two digits of a postal code) in use, 01 to 82 except 74
+POSTAL_SECTORS = frozenset(range(1, 83)) - {74}
+
+# Lookups that recently returned nothing, keyed by (kind, key); NRICs only ever appear as their salted hash
+negative_cache: TTLCache = TTLCache(maxsize=NEGATIVE_CACHE_SIZE, ttl=NEGATIVE_CACHE_TTL)
+# Backend calls avoided, by reason
+avoided: Counter = Counter()
+
+
+""" START OF VALIDATION METHODS """
+
+
+# NRIC or FIN with a correct check letter
+def is_valid_nric(nric: str) -> bool:
+    nric = nric.strip().upper()
+    if len(nric) != 9 or nric[0] not in NRIC_OFFSETS or not nric[1:8].isdigit():
+        return False
+
+    total = sum(int(digit) * weight for digit, weight in zip(nric[1:8], NRIC_WEIGHTS)) + NRIC_OFFSETS[nric[0]]
+    return nric[8] == NRIC_CHECK_LETTERS[nric[0]][total % 11]
+
+
+# Six-digit Singapore postal code in a sector that exists
+def is_valid_postal_code(postal_code: str) -> bool:
+    postal_code = postal_code.strip()
+    return len(postal_code) == 6 and postal_code.isdigit() and int(postal_code[:2]) in POSTAL_SECTORS
+
+
+""" END OF VALIDATION METHODS """
+
+""" START OF NEGATIVE CACHE METHODS """
+
+
+# Count a backend call that was not made
+def avoid(reason: str) -> None:
+    avoided[reason] += 1
+
+
+# Whether a lookup returned nothing within NEGATIVE_CACHE_TTL, counting the call avoided if so
+def is_known_empty(kind: str, key: str) -> bool:
+    if (kind, key) in negative_cache:
+        avoid(f"empty {kind}")
+        return True
+    return False
+
+
+# Remember that a lookup returned nothing
+def remember_empty(kind: str, key: str) -> None:
+    negative_cache[(kind, key)] = True
+
+
+# Backend calls avoided so far
+def report() -> str:
+    return "Backend calls avoided | " + ", ".join(f"{reason}: {count}" for reason, count in sorted(avoided.items()))
+
+
+""" END OF NEGATIVE CACHE METHODS """